@@ -1,33 +1,216 @@
 import os
+import gzip
 import hashlib
+import json
+import base64
+import time
+import datetime
 import functools
+import inspect
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
-from db_manager import SchoolDB
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, send_file, make_response
+from markupsafe import Markup
+from db_manager import SchoolDB, pool_stats
+from db_pool import BackendUnavailable
+from transfers import parse_range, download_name, content_disposition
+from blob_store import get_blob_store
+from cache import cache, make_key
+import metrics
 import rpc_handlers 
+import rpc_wire
+import rpc_auth
+import events
+import provisioning
+import exports
+import fragments
+from journal import journal
 from xmlrpc.server import SimpleXMLRPCDispatcher
+from xmlrpc.client import Fault
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli (smaller than gzip for HTML / JSON)
+    brotli = None
+
 load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'pi_secure_key')
 logger = logging.getLogger(__name__)
 
+if not rpc_auth.REQUIRE_TOKEN:
+    logger.warning("RPC_REQUIRE_TOKEN is off: RPC calls without a token are served unchecked (roles and ids are "
+                   "only enforced for calls that send X-RPC-Token). Set RPC_REQUIRE_TOKEN=1 once every client logs in.")
+
 # --- RPC REGISTRATION ---
-rpc_dispatcher = SimpleXMLRPCDispatcher(allow_none=True)
+BACKEND_UNAVAILABLE_FAULT = -32001
+AUTH_REQUIRED_FAULT = -32003
+RATE_LIMITED_FAULT = -32029
+
+class RPCDispatcher(SimpleXMLRPCDispatcher):
+    """ Times every method call, including each call inside system.multicall """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._signatures = {}  # method -> inspect.Signature, for rpc_auth.check
+
+    def _dispatch(self, method, params):
+        return self._timed(method, lambda: super(RPCDispatcher, self)._dispatch(method, params), params)
+
+    def call_named(self, method, kwargs):
+        """ JSON-RPC by-name params (the XML-RPC path is positional only) """
+        return self._timed(method, lambda: self.funcs[method](**kwargs), (), kwargs)
+
+    def _arguments(self, method, params, kwargs):
+        """ {parameter name: value} of the call, for rpc_auth.check ({} if they don't fit: the call itself will fail) """
+        sig = self._signatures.get(method)
+        if sig is None and method in self.funcs:
+            sig = self._signatures[method] = inspect.signature(self.funcs[method])
+        try:
+            return sig.bind_partial(*params, **(kwargs or {})).arguments if sig else {}
+        except TypeError:
+            return {}
+
+    def _timed(self, method, call, params=(), kwargs=None):
+        start = time.perf_counter()
+        try:
+            rpc_auth.check(method, self._arguments(method, params, kwargs))
+            return call()
+        except BackendUnavailable as e:
+            metrics.RPC_ERRORS.inc(method)
+            raise Fault(BACKEND_UNAVAILABLE_FAULT, f"backend unavailable: {e}")
+        except rpc_auth.AuthRequired as e:
+            metrics.RPC_ERRORS.inc(method)
+            raise Fault(AUTH_REQUIRED_FAULT, str(e))
+        except rpc_auth.RateLimited as e:
+            metrics.RPC_ERRORS.inc(method)
+            raise Fault(RATE_LIMITED_FAULT, str(e))
+        except Exception:
+            metrics.RPC_ERRORS.inc(method)
+            raise
+        finally:
+            metrics.RPC_LATENCY.observe(time.perf_counter() - start, method)
+
+rpc_dispatcher = RPCDispatcher(allow_none=True)
 rpc_dispatcher.register_function(rpc_handlers.rpc_login, 'login')
+rpc_dispatcher.register_function(rpc_handlers.rpc_logout, 'logout')
+rpc_dispatcher.register_function(rpc_handlers.rpc_whoami, 'whoami')
+rpc_dispatcher.register_function(rpc_handlers.rpc_wait_events, 'wait_events')
 rpc_dispatcher.register_function(rpc_handlers.rpc_get_student_tps, 'get_student_tps')
 rpc_dispatcher.register_function(rpc_handlers.rpc_get_submissions, 'get_submissions')
 rpc_dispatcher.register_function(rpc_handlers.rpc_grade_submission, 'grade_submission')
+rpc_dispatcher.register_function(rpc_handlers.rpc_grade_submissions, 'grade_submissions')
 rpc_dispatcher.register_function(rpc_handlers.rpc_get_teacher_data, 'get_teacher_data')
 
 rpc_dispatcher.register_function(rpc_handlers.rpc_submit_rapport, 'submit_rapport')
 rpc_dispatcher.register_function(rpc_handlers.rpc_get_session_students, 'get_session_students')
+rpc_dispatcher.register_function(rpc_handlers.rpc_resolve_seance, 'resolve_seance')
+rpc_dispatcher.register_function(rpc_handlers.rpc_pregenerate_seances, 'pregenerate_seances')
 rpc_dispatcher.register_function(rpc_handlers.rpc_save_attendance, 'save_attendance')
 
+# Batched calls: system.multicall + composite "page bootstrap" methods
+rpc_dispatcher.register_function(rpc_handlers.rpc_get_teacher_portal, 'get_teacher_portal')
+rpc_dispatcher.register_function(rpc_handlers.rpc_get_student_portal, 'get_student_portal')
+rpc_dispatcher.register_function(rpc_handlers.rpc_get_attendance_sheet, 'get_attendance_sheet')
+rpc_dispatcher.register_multicall_functions()
+
+# Chunked uploads / ranged downloads
+rpc_dispatcher.register_function(rpc_handlers.rpc_begin_upload, 'begin_upload')
+rpc_dispatcher.register_function(rpc_handlers.rpc_put_chunk, 'put_chunk')
+rpc_dispatcher.register_function(rpc_handlers.rpc_upload_status, 'upload_status')
+rpc_dispatcher.register_function(rpc_handlers.rpc_abort_upload, 'abort_upload')
+rpc_dispatcher.register_function(rpc_handlers.rpc_commit_upload, 'commit_upload')
+rpc_dispatcher.register_function(rpc_handlers.rpc_get_file_info, 'get_file_info')
+rpc_dispatcher.register_function(rpc_handlers.rpc_read_file_chunk, 'read_file_chunk')
+
+# Write-behind journal (WRITE_JOURNAL=/path/journal.db)
+rpc_dispatcher.register_function(rpc_handlers.rpc_journal_status, 'journal_status')
+rpc_dispatcher.register_function(rpc_handlers.rpc_journal_conflicts, 'journal_conflicts')
+
 @app.route('/RPC2', methods=['POST'])
 def rpc_handler():
-    return Response(rpc_dispatcher._marshaled_dispatch(request.data), mimetype='text/xml')
+    with rpc_auth.bound(request.headers.get('X-RPC-Token'), request.remote_addr):
+        return Response(rpc_dispatcher._marshaled_dispatch(request.data), mimetype='text/xml')
+
+# Same functions over JSON-RPC 2.0 (application/json) or MessagePack (application/msgpack)
+@app.route('/rpc', methods=['POST'])
+def rpc_wire_handler():
+    codec = rpc_wire.codec_for(request.content_type)
+    if codec is None:
+        return jsonify(rpc_wire._error(rpc_wire.INVALID_REQUEST, 'unsupported Content-Type (json or msgpack)')), 415
+    with rpc_auth.bound(request.headers.get('X-RPC-Token'), request.remote_addr):
+        body = rpc_wire.handle(rpc_dispatcher, request.get_data(), codec)
+    if not body: return Response(status=204)
+    return Response(body, mimetype=codec[3])
+
+# --- INSTRUMENTATION ---
+@app.before_request
+def start_timer():
+    request.start_time = time.perf_counter()
+    metrics.begin_request()
+
+@app.after_request
+def record_timing(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - request.start_time, endpoint, response.status_code)
+    metrics.DB_ROUNDTRIPS.observe(metrics.request_roundtrips(), endpoint)
+    return response
+
+# --- RESPONSE COMPRESSION / ETAGS ---
+COMPRESS_TYPES = {'text/html', 'application/json'}
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '500'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))  # fast enough for the Pi
+
+def _encoding():
+    if brotli is not None and request.accept_encodings['br']: return 'br'
+    if request.accept_encodings['gzip']: return 'gzip'
+    return None
+
+@app.after_request
+def compress_response(response):
+    """ ETag + 304 and gzip / brotli for buffered HTML and JSON. Streams (SSE, exports, files) pass through untouched """
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or response.mimetype not in COMPRESS_TYPES or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    encoding = _encoding() if len(body) >= COMPRESS_MIN_SIZE else None
+    response.vary.add('Accept-Encoding')
+    if request.method in ('GET', 'HEAD'):
+        tag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()[:20]
+        response.set_etag(f"{tag}-{encoding}" if encoding else tag)  # one ETag per representation
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    if encoding:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(body, GZIP_LEVEL))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def not_modified(tag):
+    """ 304 if the client already has tag (in any encoding), before any DB work """
+    for candidate in (tag, f"{tag}-gzip", f"{tag}-br"):
+        if candidate in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(candidate)
+            resp.vary.add('Accept-Encoding')
+            return resp
+    return None
+
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(e):
+    resp = jsonify({'status': 'error', 'error': 'backend unavailable'})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '5'
+    return resp
+
+@app.route('/metrics')
+def prometheus_metrics():
+    gauges = {'db_pool': {f"{name}_{k}": v for name, st in pool_stats().items() for k, v in st.items()},
+              'app_cache': cache.stats(), 'rpc_auth': rpc_auth.stats(), 'events': events.bus.stats()}
+    if journal: gauges['write_journal'] = journal.stats()
+    if metrics.STARTUP: gauges['startup'] = metrics.STARTUP
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 # --- WEB UI SECURITY ---
 def login_required(role=None):
@@ -44,26 +227,84 @@ def login_required(role=None):
 @app.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        with SchoolDB() as db:
-            hpw = hashlib.sha256(request.form['password'].encode()).hexdigest()
-            user = db.login(request.form['email'], hpw)
-            if user:
-                session.update({'user_id': user['id'], 'name': user['name'], 'role': user['role']})
-                if user['role'] == 'Direction': return redirect(url_for('admin_dashboard'))
-                # Dashboards for other roles can be added here
-            flash("Invalid Credentials", "danger")
+        hpw = hashlib.sha256(request.form['password'].encode()).hexdigest()
+        try:
+            user = rpc_auth.authenticate(request.form['email'], hpw, request.remote_addr)
+        except rpc_auth.RateLimited:
+            flash("Too many failed attempts, try again later", "danger")
+            return render_template('login.html')
+        if user:
+            session.update({'user_id': user['id'], 'name': user['name'], 'role': user['role']})
+            if user['role'] == 'Direction': return redirect(url_for('admin_dashboard'))
+            # Dashboards for other roles can be added here
+        flash("Invalid Credentials", "danger")
     return render_template('login.html')
 
 # --- ADMIN USER MANAGEMENT (AJAX OPTIMIZED) ---
 @app.route('/admin')
 @login_required('Direction')
 def admin_dashboard():
+    # Sections are rendered once per version (fragments.py); an unchanged page is a 304
+    tag = f"admin-{fragments.etag()}-{ADMIN_TEMPLATES}-{session['user_id']}"
+    cached = not_modified(tag)
+    if cached: return cached
+    users = admin_fragment('users', _users_fragment)
+    page = render_template('admin.html',
+                           user_rows=users['rows'],
+                           next_cursor=users['next'],
+                           group_options=admin_fragment('groups', lambda db: Markup(render_template('_group_options.html', grouped_groups=db.get_groups_by_filiere()))),
+                           module_options=admin_fragment('modules', lambda db: Markup(render_template('_module_options.html', modules=db.get_all_modules()))),
+                           tp_rows=admin_fragment('tps', lambda db: Markup(render_template('_global_tps.html', all_tps=db.get_all_tps_global()))))
+    resp = make_response(page)
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+def admin_fragment(section, build):
+    def make():
+        with SchoolDB() as db:
+            return build(db)
+    return fragments.render(section, make)
+
+def _users_fragment(db):
+    users, last = db.get_users_page(limit=USERS_PAGE_SIZE)
+    return {'rows': Markup(render_template('_user_rows.html', users=users)), 'next': encode_cursor(last)}
+
+def _templates_tag(*names):
+    digest = hashlib.sha1()
+    for name in names:
+        with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:8]
+
+# A deploy that changes the page must not be answered with 304
+ADMIN_TEMPLATES = _templates_tag('admin.html', '_user_rows.html', '_group_options.html', '_module_options.html', '_global_tps.html')
+
+# --- USER DIRECTORY API (keyset pagination) ---
+USERS_PAGE_SIZE = 50
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode() if key else None
+
+def decode_cursor(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode())) if token else None
+    except ValueError:
+        return None
+
+@app.route('/admin/api/users')
+@login_required('Direction')
+def users_page():
+    limit = min(request.args.get('limit', USERS_PAGE_SIZE, type=int), 200)
     with SchoolDB() as db:
-        return render_template('admin.html', 
-                               users=db.get_all_users_extended(), 
-                               grouped_groups=db.get_groups_by_filiere(), 
-                               modules=db.get_all_modules(), 
-                               all_tps=db.get_all_tps_global())
+        users, last = db.get_users_page(after=decode_cursor(request.args.get('after')), limit=limit,
+                                        role=request.args.get('role') or None,
+                                        group_id=request.args.get('group_id', type=int),
+                                        q=request.args.get('q') or None)
+    page = {'users': users, 'next': encode_cursor(last)}
+    if request.args.get('format') == 'html':
+        page['html'] = render_template('_user_rows.html', users=users)
+    return jsonify(page)
 
 @app.route('/admin/get_user/<int:user_id>')
 @login_required('Direction')
@@ -87,6 +328,27 @@ def create_user():
         )
     return jsonify({'status': 'success' if success else 'error'})
 
+@app.route('/admin/import_users', methods=['POST'])
+@login_required('Direction')
+def import_users():
+    roster = request.files.get('roster')
+    if not roster or not roster.filename:
+        return jsonify({'status': 'error', 'message': 'no file'}), 400
+    try:
+        result = provisioning.run_import(roster.stream, roster.filename, request.form.get('role') or 'Etudiant')
+    except provisioning.RosterError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if result['report_id']:
+        result['report_url'] = url_for('import_report', report_id=result['report_id'])
+    return jsonify({'status': 'success', **result})
+
+@app.route('/admin/import_report/<report_id>')
+@login_required('Direction')
+def import_report(report_id):
+    path = provisioning.report_path(report_id)
+    if not path: return jsonify({'status': 'error'}), 404
+    return send_file(path, mimetype='text/csv', as_attachment=True, download_name='import_errors.csv')
+
 @app.route('/admin/update_user', methods=['POST'])
 @login_required('Direction')
 def update_user():
@@ -137,38 +399,192 @@ def delete_assignment(aid):
         success = db.delete_assignment(aid)
     return jsonify({'status': 'success' if success else 'error'})
 
+# --- FILE DOWNLOADS (streamed, Range-capable) ---
+@app.route('/files/<kind>/<int:file_id>')
+@login_required()
+def download_file(kind, file_id):
+    if kind not in SchoolDB.BLOB_TABLES: return jsonify({'status': 'error'}), 404
+    with SchoolDB() as db:
+        info = db.get_blob_info(kind, file_id)
+        if info and not db.can_read_file(kind, file_id, {'id': session['user_id'], 'role': session['role']}):
+            return jsonify({'status': 'error'}), 403
+    if not info: return jsonify({'status': 'error'}), 404
+    name = download_name(info['name'], info['hash'] or f"{kind}_{file_id}")
+
+    store = get_blob_store()
+    if info['hash'] and store:
+        # Content-addressed: the hash is a strong ETag, Range/If-None-Match handled by send_file
+        return send_file(store.path_for(info['hash'], info['size']), mimetype=info['type'] or 'application/octet-stream',
+                         as_attachment=True, download_name=name, conditional=True, etag=info['hash'])
+
+    size = info['size']
+    rng = parse_range(request.headers.get('Range'), size)
+    start, end = rng if rng else (0, size)
+
+    def generate():
+        with SchoolDB() as db:
+            yield from db.iter_blob(kind, file_id, start, end)
+
+    resp = Response(generate(), status=206 if rng else 200,
+                    mimetype=info['type'] or 'application/octet-stream')
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Content-Length'] = str(end - start)
+    resp.headers['Content-Disposition'] = content_disposition(name)
+    if rng: resp.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    return resp
+
+# --- CHANGE FEED (Server-Sent Events) ---
+SSE_KEEPALIVE = 15
+
+def feed_subscription():
+    """ (topics, cursor) for the /events request, or None if it has no session / token.
+        async_server calls it too (inside a request context) before streaming natively """
+    user = {'id': session['user_id'], 'role': session['role']} if 'user_id' in session else \
+        rpc_auth.validate(request.headers.get('X-RPC-Token') or request.args.get('token'))
+    if not user: return None
+    topics = events.allowed_topics(user, [t for t in request.args.get('topics', '').split(',') if t])
+    after = request.headers.get('Last-Event-ID') or request.args.get('after') or ''
+    return topics, after or None
+
+@app.route('/events')
+def event_stream():
+    """ ?topics=group:3,tp:12 ; resumes from Last-Event-ID. Browser session or ?token= / X-RPC-Token """
+    if not events.ENABLED: return jsonify({'status': 'error', 'error': 'change feed is off'}), 404
+    sub = feed_subscription()
+    if sub is None: return jsonify({'status': 'error'}), 401
+    topics, cursor = sub
+
+    def generate():
+        nonlocal cursor
+        yield "retry: 3000\n\n"
+        while True:
+            found, cursor, reset = events.bus.wait(topics, cursor, SSE_KEEPALIVE)
+            yield events.sse(found, cursor, reset)
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+# --- EXPORTS ---
+def _export_scope():
+    """ Formateurs only export their own classes; Direction may pick one (or all) """
+    if session.get('role') == 'Formateur': return session['user_id']
+    return request.args.get('formateur_id', type=int)
+
+def _export_response(fetch, filename):
+    """ Streams fetch(db) (header row + rows) as CSV or XLSX, holding one pooled connection """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS: return jsonify({'status': 'error', 'message': 'format must be csv or xlsx'}), 400
+    if session.get('role') == 'Etudiant': return jsonify({'status': 'error'}), 403
+
+    def rows():
+        with SchoolDB() as db:
+            yield from fetch(db)
+
+    body = exports.stream(rows(), fmt, filename)
+    if body is None: return jsonify({'status': 'error', 'message': 'XLSX export needs openpyxl'}), 400
+    resp = Response(body, mimetype=exports.FORMATS[fmt])
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return resp
+
+@app.route('/export/attendance')
+@login_required()
+def export_attendance():
+    try:
+        date_to = datetime.date.fromisoformat(request.args.get('to') or datetime.date.today().isoformat())
+        date_from = datetime.date.fromisoformat(request.args.get('from') or (date_to - datetime.timedelta(days=30)).isoformat())
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'dates must be YYYY-MM-DD'}), 400
+    group_id, fid = request.args.get('group_id', type=int), _export_scope()
+    return _export_response(lambda db: db.export_attendance(date_from.isoformat(), date_to.isoformat(), group_id, fid),
+                            f"attendance_{date_from}_{date_to}")
+
+@app.route('/export/absences')
+@login_required()
+def export_absences():
+    group_id, fid = request.args.get('group_id', type=int), _export_scope()
+    return _export_response(lambda db: db.export_absences(fid, group_id), "absences")
+
+@app.route('/export/grades/<int:tp_id>')
+@login_required()
+def export_grades(tp_id):
+    fid = session['user_id'] if session.get('role') == 'Formateur' else None
+    return _export_response(lambda db: db.export_grades(tp_id, fid), f"grades_tp{tp_id}")
+
 # --- ANALYTICS ---
 @app.route('/analytics')
 @login_required()
 def analytics_dashboard():
     role = session.get('role')
-    with SchoolDB() as db:
-        teachers = []
-        if role == 'Direction':
-            with db.conn.cursor() as cursor:
-                cursor.execute("SELECT UserID, Nom, Prenom FROM Utilisateur WHERE Role='Formateur'")
-                teachers = [{"id": r.UserID, "name": f"{r.Nom} {r.Prenom}"} for r in cursor.fetchall()]
+    teachers = []
+    if role == 'Direction':
+        with SchoolDB() as db:
+            teachers = db.get_all_teachers()
     return render_template('analytics.html', role=role, teachers=teachers)
 
+# The three analytics queries run side by side, each on its own pooled connection
+analytics_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='analytics')
+
+def _analytics_query(method, target):
+    with SchoolDB() as db:
+        return getattr(db, method)(target)
+
+def build_analytics_payload(target):
+    """ Returns (json_body, etag), cached per formateur until attendance is saved """
+    key = make_key('analytics', (target,))
+    hit = cache.get(key, None)
+    if hit: return hit
+
+    jobs = {name: analytics_executor.submit(_analytics_query, name, target)
+            for name in ('get_presence_stats', 'get_absent_report', 'get_global_kpis')}
+    stats = jobs['get_presence_stats'].result()
+    absences = jobs['get_absent_report'].result()
+    kpis = jobs['get_global_kpis'].result()
+
+    # Avoid division by zero for Avg Rate
+    avg_rate = 0
+    if stats:
+        avg_rate = round(sum(s['rate'] for s in stats) / len(stats), 1)
+    kpis['avg_rate'] = avg_rate
+
+    body = json.dumps({'stats': stats, 'kpis': kpis, 'absences': absences})
+    result = (body, hashlib.sha1(body.encode()).hexdigest())
+    cache.set(key, result)
+    return result
+
 @app.route('/api/analytics_data', methods=['POST'])
 @login_required()
 def get_analytics_data():
     target = session['user_id'] if session['role'] == 'Formateur' else request.json.get('formateur_id')
     if target == 'all': target = None
-    
-    with SchoolDB() as db:
-        # Separate calls to prevent cursor state conflict
-        stats = db.get_presence_stats(target)
-        absences = db.get_absent_report(target)
-        kpis = db.get_global_kpis(target)
-        
-        # Avoid division by zero for Avg Rate
-        avg_rate = 0
-        if stats:
-            avg_rate = round(sum(s['rate'] for s in stats) / len(stats), 1)
-        kpis['avg_rate'] = avg_rate
-        
-        return jsonify({'stats': stats, 'kpis': kpis, 'absences': absences})
+
+    body, etag = build_analytics_payload(target)
+    # POST is never conditional in browsers: analytics.html sends If-None-Match itself
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# --- MONITORING ---
+@app.route('/admin/pool_stats')
+@login_required('Direction')
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/admin/cache_stats')
+@login_required('Direction')
+def get_cache_stats():
+    return jsonify(cache.stats())
+
+@app.route('/admin/cache_toggle', methods=['POST'])
+@login_required('Direction')
+def toggle_cache():
+    cache.set_enabled(request.form.get('enabled', '1') == '1')
+    return jsonify(cache.stats())
 
 @app.route('/logout')
 def logout():
@@ -176,5 +592,12 @@ def logout():
     return redirect(url_for('login'))
 
 if __name__ == '__main__':
-    # Use threaded=True to help the Pi 1 B+ handle multiple background fetch requests
-    app.run(host='0.0.0.0', port=5000, threaded=True, debug=True)
\ No newline at end of file
+    if journal:
+        journal.start()  # replays what a previous run left pending, without waiting for a new write
+    if os.getenv('SERVE_MODE') == 'async':
+        # Bounded executor + admission control instead of one thread per request
+        import asyncio, async_server
+        asyncio.run(async_server.serve('0.0.0.0', 5000))
+    else:
+        # Use threaded=True to help the Pi 1 B+ handle multiple background fetch requests
+        app.run(host='0.0.0.0', port=5000, threaded=True, debug=True)
\ No newline at end of file
@@ -0,0 +1,337 @@
+""" asyncio serving mode: one event loop accepts connections, blocking pyodbc work runs
+in a bounded thread pool sized to the DB connection pool.
+
+    python async_server.py --port 5000
+
+/RPC2 and /rpc are dispatched directly; every other route goes through the Flask app
+(WSGI) on the same executor. Admission control keeps at most workers + ASYNC_QUEUE_LIMIT
+requests in the system and answers 503 beyond that, and every request has a deadline
+(ASYNC_DEADLINE seconds) after which it gets 503/504 instead of piling up; a request answered
+504 keeps its slot until its worker thread is actually free. A request body
+and each chunk of a streamed response must arrive within ASYNC_READ_TIMEOUT seconds, or the
+connection is dropped; a Content-Length that is not a plain number gets 400.
+
+The change feed (GET /events and the wait_events RPC) is served on the loop itself: only
+the subscription check runs on the executor, the wait is events.bus.wait_async(), so a
+subscriber holds no executor thread and no admission slot (at most ASYNC_MAX_SUBSCRIBERS).
+"""
+import io
+import os
+import sys
+import re
+import time
+import asyncio
+import logging
+import argparse
+import xmlrpc.client
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import events
+import metrics
+import rpc_auth
+from db_pool import pool_settings
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv('ASYNC_WORKERS', str(pool_settings()['max_size'])))
+QUEUE_LIMIT = int(os.getenv('ASYNC_QUEUE_LIMIT', '32'))
+DEADLINE = float(os.getenv('ASYNC_DEADLINE', '15'))
+MAX_BODY = int(os.getenv('ASYNC_MAX_BODY', str(64 * 1024 * 1024)))
+MAX_SUBSCRIBERS = int(os.getenv('ASYNC_MAX_SUBSCRIBERS', '1000'))
+READ_TIMEOUT = float(os.getenv('ASYNC_READ_TIMEOUT', '30'))
+_LENGTH = re.compile(r'[0-9]+')
+
+SHED = metrics.Counter('async_shed_total', 'Requests rejected by admission control', ('reason',))
+metrics.REGISTRY.append(SHED)
+
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 401: 'Unauthorized', 411: 'Length Required', 413: 'Payload Too Large',
+           503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class Shed(Exception):
+    """ The request waited in the queue past its deadline: skip the DB work """
+
+
+class AsyncRPCServer:
+    def __init__(self, app, dispatcher, workers=WORKERS, queue_limit=QUEUE_LIMIT, deadline=DEADLINE):
+        self.app = app
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.capacity = workers + queue_limit
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rpc-worker')
+        self.inflight = 0
+        self.subscribers = 0
+
+    # --- ADMISSION CONTROL ---
+    async def run_blocking(self, fn, *args, deadline, busy=None):
+        """ fn(*args) on the executor within the deadline. The worker thread cannot be interrupted:
+            on timeout its result is dropped and, if it is still running, its future goes to busy """
+        def guarded():
+            if time.monotonic() > deadline:
+                raise Shed()
+            return fn(*args)
+
+        fut = self.executor.submit(guarded)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=max(deadline - time.monotonic(), 0.001))
+        except asyncio.TimeoutError:
+            if busy is not None and not fut.done():  # still queued work was cancelled with the wait
+                busy.append(fut)
+            raise
+
+    def _release(self, busy):
+        """ Frees the request's admission slot, or hands it to the executor work it left running:
+            the slot is only free again once that thread is """
+        if not busy:
+            self.inflight -= 1
+            return
+        loop = asyncio.get_running_loop()
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self._release, busy[1:])
+            except RuntimeError:
+                pass  # loop closed
+        busy[0].add_done_callback(done)
+
+    # --- HTTP ---
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                keep_alive = await self.handle_request(head, reader, writer, peer)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def handle_request(self, head, reader, writer, peer):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            await self.respond(writer, 400, [], b'', False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                headers[k.strip().lower()] = v.strip()
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            await self.respond(writer, 411, [], b'', False)
+            return False
+        length = headers.get('content-length') or '0'
+        if not _LENGTH.fullmatch(length):
+            await self.respond(writer, 400, [], b'bad Content-Length', False)
+            return False
+        length = int(length)
+        if length > MAX_BODY:
+            await self.respond(writer, 413, [], b'', False)
+            return False
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b''
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return False  # the client went away or stalled mid-body
+
+        path, _, query = target.partition('?')
+        feed = method == 'GET' and path == '/events'
+        if method == 'POST' and path == '/RPC2' and b'wait_events' in body:
+            try:
+                params, name = xmlrpc.client.loads(body, use_builtin_types=True)
+            except Exception:
+                params, name = None, None
+            feed = name == 'wait_events'
+        if feed and events.ENABLED:  # off: /events 404s and wait_events faults through the app
+            if self.subscribers >= MAX_SUBSCRIBERS:
+                SHED.inc('subscribers')
+                await self.respond(writer, 503, [('Retry-After', '5')], b'too many subscribers', keep_alive)
+                return keep_alive
+            self.subscribers += 1
+            try:
+                if path == '/events':
+                    return await self.serve_events(method, path, query, version, headers, body, peer, writer)
+                return await self.wait_events(params, headers, peer, writer, keep_alive)
+            finally:
+                self.subscribers -= 1
+
+        if self.inflight >= self.capacity:
+            SHED.inc('queue_full')
+            await self.respond(writer, 503, [('Retry-After', '1')], b'server busy', keep_alive)
+            return keep_alive
+
+        self.inflight += 1
+        deadline = time.monotonic() + self.deadline
+        busy = []  # executor work still running past the deadline: it keeps the slot
+        try:
+            if method == 'POST' and path == '/RPC2':
+                out = await self.run_blocking(rpc_auth.call_with_token, headers.get('x-rpc-token'), peer[0] if peer else None,
+                                              self.dispatcher._marshaled_dispatch, body, deadline=deadline, busy=busy)
+                await self.respond(writer, 200, [('Content-Type', 'text/xml')], out, keep_alive)
+            else:
+                keep_alive = await self.serve_wsgi(method, path, query, version, headers, body, peer, writer, keep_alive,
+                                                   deadline, busy)
+        except Shed:
+            SHED.inc('deadline_in_queue')
+            await self.respond(writer, 503, [('Retry-After', '1')], b'server busy', keep_alive)
+        except asyncio.TimeoutError:
+            SHED.inc('deadline')
+            await self.respond(writer, 504, [], b'deadline exceeded', keep_alive)
+        finally:
+            self._release(busy)
+        return keep_alive
+
+    async def respond(self, writer, status, headers, body, keep_alive):
+        if isinstance(body, str):
+            body = body.encode()
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        head += [f"{k}: {v}" for k, v in headers if k.lower() not in ('content-length', 'connection')]
+        head.append(f"Content-Length: {len(body)}")
+        head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+
+    # --- CHANGE FEED (on the loop) ---
+    async def wait_events(self, params, headers, peer, writer, keep_alive):
+        """ wait_events RPC: topics are checked on the executor, the wait itself is awaited """
+        import rpc_handlers
+        from app import AUTH_REQUIRED_FAULT
+        topics, after, timeout = (list(params) + [None, None, 10])[:3]
+        start = time.perf_counter()
+        try:
+            allowed = await self.run_blocking(rpc_auth.call_with_token, headers.get('x-rpc-token'), peer[0] if peer else None,
+                                              rpc_handlers.feed_topics, topics, deadline=time.monotonic() + self.deadline)
+            result = await events.bus.wait_async(allowed, after or None, timeout if timeout is not None else 10)
+            out = xmlrpc.client.dumps((rpc_handlers.feed_reply(*result),), methodresponse=True, allow_none=True)
+        except rpc_auth.AuthRequired as e:
+            metrics.RPC_ERRORS.inc('wait_events')
+            out = xmlrpc.client.dumps(xmlrpc.client.Fault(AUTH_REQUIRED_FAULT, str(e)), allow_none=True)
+        except (Shed, asyncio.TimeoutError):
+            SHED.inc('deadline')
+            await self.respond(writer, 503, [('Retry-After', '1')], b'server busy', keep_alive)
+            return keep_alive
+        except Exception as e:
+            metrics.RPC_ERRORS.inc('wait_events')
+            out = xmlrpc.client.dumps(xmlrpc.client.Fault(1, f"{type(e).__name__}:{e}"), allow_none=True)
+        metrics.RPC_LATENCY.observe(time.perf_counter() - start, 'wait_events')
+        await self.respond(writer, 200, [('Content-Type', 'text/xml')], out, keep_alive)
+        return keep_alive
+
+    async def serve_events(self, method, path, query, version, headers, body, peer, writer):
+        """ GET /events as Server-Sent Events until the client goes away """
+        from app import app as flask_app, feed_subscription, SSE_KEEPALIVE
+        environ = self.environ(method, path, query, version, headers, body, peer)
+
+        def subscribe():
+            with flask_app.request_context(environ):
+                return feed_subscription()
+        try:
+            sub = await self.run_blocking(subscribe, deadline=time.monotonic() + self.deadline)
+        except (Shed, asyncio.TimeoutError):
+            SHED.inc('deadline')
+            await self.respond(writer, 503, [('Retry-After', '1')], b'server busy', False)
+            return False
+        if sub is None:
+            await self.respond(writer, 401, [('Content-Type', 'application/json')], b'{"status": "error"}', False)
+            return False
+        topics, cursor = sub
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"X-Accel-Buffering: no\r\nConnection: close\r\n\r\nretry: 3000\n\n")
+        try:
+            while True:
+                await writer.drain()
+                found, cursor, reset = await events.bus.wait_async(topics, cursor, SSE_KEEPALIVE)
+                writer.write(events.sse(found, cursor, reset).encode())
+        except ConnectionError:
+            pass
+        return False
+
+    # --- WSGI BRIDGE (Flask routes, /rpc) ---
+    def environ(self, method, path, query, version, headers, body, peer):
+        environ = {
+            'REQUEST_METHOD': method, 'SCRIPT_NAME': '', 'PATH_INFO': unquote(path), 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '0', 'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '', 'CONTENT_TYPE': headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.multithread': True,
+            'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        for k, v in headers.items():
+            if k not in ('content-type', 'content-length'):
+                environ['HTTP_' + k.upper().replace('-', '_')] = v
+        return environ
+
+    async def serve_wsgi(self, method, path, query, version, headers, body, peer, writer, keep_alive, deadline, busy=None):
+        environ = self.environ(method, path, query, version, headers, body, peer)
+        captured = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            captured['status'], captured['headers'] = status, response_headers
+            return lambda data: None
+
+        def first_chunk():
+            result = self.app(environ, start_response)
+            it = iter(result)
+            return result, it, next(it, None)
+
+        result, it, chunk = await self.run_blocking(first_chunk, deadline=deadline, busy=busy)
+        loop = asyncio.get_running_loop()
+        pending = None
+        try:
+            hdrs = captured['headers']
+            has_length = any(k.lower() == 'content-length' for k, _ in hdrs)
+            if not has_length:
+                keep_alive = False  # unknown length: delimit the body by closing
+            head = [f"HTTP/1.1 {captured['status']}"]
+            head += [f"{k}: {v}" for k, v in hdrs if k.lower() != 'connection']
+            head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+            while chunk is not None:
+                if chunk:
+                    writer.write(chunk)
+                    await writer.drain()
+                # Streamed bodies (file downloads, exports) pull one chunk per executor hop, each within READ_TIMEOUT
+                pending = self.executor.submit(next, it, None)
+                try:
+                    chunk = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(pending)), READ_TIMEOUT)
+                except asyncio.TimeoutError:
+                    SHED.inc('stream_timeout')
+                    logger.warning(f"{path}: no chunk for {READ_TIMEOUT}s, dropping the connection")
+                    if busy is not None: busy.append(pending)
+                    return False
+        finally:
+            if hasattr(result, 'close'):
+                if pending is not None and not pending.done():
+                    # The worker is still inside next(): it closes the stream once it comes back
+                    pending.add_done_callback(lambda _: result.close())
+                else:
+                    await loop.run_in_executor(self.executor, result.close)
+        return keep_alive
+
+
+async def serve(host, port):
+    from app import app, rpc_dispatcher
+    from journal import journal
+    if journal:
+        journal.start()  # entries left pending by the previous run replay now
+    server = AsyncRPCServer(app, rpc_dispatcher)
+    srv = await asyncio.start_server(server.handle_client, host, port, limit=64 * 1024)
+    logger.info(f"async server on {host}:{port} ({server.workers} DB workers, capacity {server.capacity})")
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='0.0.0.0')
+    ap.add_argument('--port', type=int, default=5000)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,19 @@
+""" Benchmark / load-test harness that runs the app against a local SQLite stand-in.
+
+    python -m bench.datagen --students 2000 --days 180      # build bench/bench.db
+    python -m bench.loadtest --threads 8 --duration 30      # p50/p95/p99 per scenario
+"""
+import os
+import sys
+
+BENCH_DB = os.getenv('BENCH_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench.db'))
+
+
+def install():
+    """ Routes every `import pyodbc` to the SQLite stand-in. Call before importing the app """
+    from bench import fake_pyodbc
+    sys.modules['pyodbc'] = fake_pyodbc
+    os.environ.setdefault('BENCH_DB', BENCH_DB)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
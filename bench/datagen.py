@@ -0,0 +1,120 @@
+""" Builds a synthetic school year in the SQLite stand-in.
+
+    python -m bench.datagen --students 2000 --groups 60 --teachers 80 --days 180
+Every account's password is 123456. The admin is admin@school.com.
+"""
+import os
+import random
+import sqlite3
+import hashlib
+import argparse
+import datetime
+
+from bench import BENCH_DB, install
+
+PASSWORD_HASH = hashlib.sha256(b"123456").hexdigest()
+FIRST = ["Ayoub", "Rachid", "Salma", "Imane", "Youssef", "Hamza", "Khadija", "Omar", "Sara", "Mehdi", "Nora", "Anas"]
+LAST = ["Alaoui", "Bennani", "Chraibi", "Idrissi", "Tazi", "Fassi", "Berrada", "Amrani", "Kettani", "Ziani"]
+
+
+def generate(path, students, groups, teachers, modules, days, tps_per_group, seed=42):
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    with open(os.path.join(os.path.dirname(__file__), 'schema.sql')) as f:
+        db.executescript(f.read())
+
+    def name():
+        return rnd.choice(LAST), rnd.choice(FIRST)
+
+    db.execute("INSERT INTO Utilisateur (Nom, Prenom, Email, MotDePasse, Role) VALUES ('Admin', 'Direction', 'admin@school.com', ?, 'Direction')", (PASSWORD_HASH,))
+    filieres = max(groups // 10, 1)
+    db.executemany("INSERT INTO Filiere (NomFiliere) VALUES (?)", [(f"Filiere {i + 1}",) for i in range(filieres)])
+    db.executemany("INSERT INTO Groupe (NomGroupe, FiliereID) VALUES (?,?)", [(f"G{i + 1:03d}", i % filieres + 1) for i in range(groups)])
+    db.executemany("INSERT INTO Module (NomModule) VALUES (?)", [(f"Module {i + 1}",) for i in range(modules)])
+
+    teacher_ids = []
+    for i in range(teachers):
+        nom, prenom = name()
+        cur = db.execute("INSERT INTO Utilisateur (Nom, Prenom, Email, MotDePasse, Role) VALUES (?,?,?,?, 'Formateur')",
+                         (nom, prenom, f"prof{i + 1}@school.com", PASSWORD_HASH))
+        teacher_ids.append(cur.lastrowid)
+    db.executemany("INSERT INTO Formateur (FormateurID, Matricule, Specialite) VALUES (?,?, 'General')",
+                   [(t, f"M{t:05d}") for t in teacher_ids])
+
+    group_students = {g: [] for g in range(1, groups + 1)}
+    for i in range(students):
+        nom, prenom = name()
+        gid = i % groups + 1
+        cur = db.execute("INSERT INTO Utilisateur (Nom, Prenom, Email, MotDePasse, Role) VALUES (?,?,?,?, 'Etudiant')",
+                         (nom, prenom, f"etu{i + 1}@school.com", PASSWORD_HASH))
+        db.execute("INSERT INTO Etudiant (EtudiantID, CNE, GroupeID, DateNaissance) VALUES (?,?,?, '2005-01-01 00:00:00')",
+                   (cur.lastrowid, f"R{cur.lastrowid:09d}", gid))
+        group_students[gid].append(cur.lastrowid)
+
+    # Each group follows 4 modules, each with its own teacher
+    affectations = []
+    for gid in range(1, groups + 1):
+        for mid in rnd.sample(range(1, modules + 1), min(4, modules)):
+            affectations.append((rnd.choice(teacher_ids), gid, mid))
+    db.executemany("INSERT INTO Affectation (FormateurID, GroupeID, ModuleID) VALUES (?,?,?)", affectations)
+
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    blob = os.urandom(64 * 1024)
+    for fid, gid, mid in affectations:
+        for t in range(tps_per_group):
+            deadline = start + datetime.timedelta(days=rnd.randrange(days))
+            cur = db.execute("INSERT INTO TP (Titre, Description, FichierData, FichierNom, FichierType, DateLimite, ModuleID, FormateurID, GroupeID) "
+                             "VALUES (?,?,?,?,?,?,?,?,?)",
+                             (f"TP {t + 1} - Module {mid}", "Bench handout", blob, "tp.pdf", "application/pdf",
+                              f"{deadline} 23:59:00", mid, fid, gid))
+            tpid = cur.lastrowid
+            db.executemany("INSERT INTO Soumission (TPID, EtudiantID, FichierData, FichierNom, FichierType, DateSoumission, Note) VALUES (?,?,?,?,?,?,?)",
+                           [(tpid, sid, blob[:4096], "rapport.pdf", "application/pdf", f"{deadline} 12:00:00",
+                             rnd.choice([None, rnd.randint(5, 20)])) for sid in group_students[gid] if rnd.random() < 0.8])
+
+    # One séance per affectation per school day, every student marked
+    presence_rows = 0
+    for d in range(days):
+        day = start + datetime.timedelta(days=d)
+        if day.weekday() >= 5:
+            continue
+        for fid, gid, mid in affectations:
+            if rnd.random() < 0.5:
+                continue
+            cur = db.execute("INSERT INTO Seance (DateDebut, DateFin, Salle, ModuleID, FormateurID, GroupeID) VALUES (?,?, 'Virtual', ?,?,?)",
+                             (f"{day} 08:00:00", f"{day} 10:00:00", mid, fid, gid))
+            sid = cur.lastrowid
+            rows = [(sid, e, 'Absent' if rnd.random() < 0.08 else 'Present') for e in group_students[gid]]
+            db.executemany("INSERT INTO Presence (SeanceID, EtudiantID, Etat) VALUES (?,?,?)", rows)
+            presence_rows += len(rows)
+    db.commit()
+    db.close()
+    return presence_rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--db', default=BENCH_DB)
+    ap.add_argument('--students', type=int, default=2000)
+    ap.add_argument('--groups', type=int, default=60)
+    ap.add_argument('--teachers', type=int, default=80)
+    ap.add_argument('--modules', type=int, default=30)
+    ap.add_argument('--days', type=int, default=180)
+    ap.add_argument('--tps', type=int, default=3, help='TPs per (group, module)')
+    args = ap.parse_args()
+
+    n = generate(args.db, args.students, args.groups, args.teachers, args.modules, args.days, args.tps)
+    print(f"Generated {args.students} students, {n} presence rows in {args.db}")
+
+    # Fill the rollups through the app's own rebuild path
+    os.environ['BENCH_DB'] = args.db
+    install()
+    from db_manager import SchoolDB
+    with SchoolDB() as db:
+        print("Aggregates rebuilt." if db.rebuild_attendance_aggregates() else "Aggregate rebuild failed.")
+
+
+if __name__ == '__main__':
+    main()
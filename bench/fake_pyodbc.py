@@ -0,0 +1,318 @@
+""" Minimal pyodbc stand-in backed by SQLite, for benchmarks only.
+
+Translates the T-SQL subset SchoolDB uses (GETDATE, ISNULL, CAST AS DATE, TOP (?),
+OUTPUT INSERTED/DELETED, @@IDENTITY, varbinary .WRITE, SUBSTRING, DATALENGTH,
+rowversion cursors), #temp tables (SQLite temp schema), UPDATE ... FROM ... JOIN and
+MERGE (run as a few plain statements, OUTPUT ... INTO included). Lock hints are dropped:
+the bench measures the set-based write paths, not their concurrency behaviour.
+"""
+import os
+import re
+import sqlite3
+import datetime
+
+version = 'fake-sqlite'
+Binary = bytes
+
+
+class Error(Exception):
+    pass
+
+
+class NotSupportedError(Error):
+    pass
+
+
+def _convert_timestamp(value):
+    text = value.decode()
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M'):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    return text
+
+
+sqlite3.register_converter('DATETIME', _convert_timestamp)
+
+
+# --- T-SQL -> SQLite ---
+_RULES = [
+    (re.compile(r"IF OBJECT_ID\('tempdb\.\.#(\w+)'\) IS NOT NULL DROP TABLE #\w+", re.I), r'DROP TABLE IF EXISTS temp.\1'),
+    (re.compile(r'#(\w+)'), r'temp.\1'),
+    (re.compile(r'GETDATE\(\)', re.I), "datetime('now', 'localtime')"),
+    (re.compile(r'CONVERT\(BINARY\(8\), CAST\(\? AS BIGINT\)\)', re.I), 'CAST(? AS INTEGER)'),
+    (re.compile(r'CAST\(([\w.]+) AS BIGINT\)', re.I), r'\1'),
+    (re.compile(r'\bMIN_ACTIVE_ROWVERSION\(\)', re.I), '9223372036854775807'),
+    (re.compile(r'CONVERT\(VARCHAR\((\d+)\), ([\w.]+), (?:120|23)\)', re.I), r'substr(\2, 1, \1)'),
+    (re.compile(r'CONVERT\(VARCHAR\((\d+)\), ([\w.]+), 108\)', re.I), r'substr(\2, 12, \1)'),
+    (re.compile(r'\bISNULL\(', re.I), 'IFNULL('),
+    (re.compile(r"CONCAT\(([\w.]+), ' ', ([\w.]+)\)", re.I), r"\1 || ' ' || \2"),
+    (re.compile(r'DATEADD\(day, (-?\d+), ([\w.?]+)\)', re.I), r"date(\2, '\1 day')"),
+    (re.compile(r'DATEADD\(hour, (\d+), CAST\(([\w.]+) AS DATETIME\)\)', re.I), r"datetime(\2, '+\1 hours')"),
+    (re.compile(r"DATEADD\(second, -\?, ([\w.]+|datetime\('now', 'localtime'\))\)", re.I), r"datetime(\1, '-' || ? || ' seconds')"),
+    (re.compile(r'DATEDIFF\(day, 0, ([\w.]+)\)', re.I), r"CAST(julianday(\1) - julianday('1900-01-01') AS INTEGER)"),
+    (re.compile(r'\s*WITH \((?:UPDLOCK|HOLDLOCK|ROWLOCK)(?:, (?:UPDLOCK|HOLDLOCK|ROWLOCK))*\)', re.I), ''),
+    (re.compile(r'OPTION \(MAXRECURSION \d+\)', re.I), ''),
+    (re.compile(r'CAST\(([\w.?]+) AS DATE\)', re.I), r'date(\1)'),
+    (re.compile(r'SELECT @@IDENTITY', re.I), 'SELECT last_insert_rowid()'),
+    (re.compile(r'\b0x\b'), "X''"),
+    (re.compile(r'(\w+)\.WRITE\(\?, NULL, NULL\)', re.I), r'\1 = blob_append(\1, ?)'),
+    (re.compile(r'\bSUBSTRING\(', re.I), 'substr('),
+    (re.compile(r'\bDATALENGTH\(', re.I), 'length('),
+    (re.compile(r'\bLEN\(', re.I), 'length('),
+]
+_OUTPUT = re.compile(r'\bOUTPUT\s+((?:(?:INSERTED|DELETED)\.\w+\s*,?\s*)+)', re.I)
+_TOP = re.compile(r'^\s*SELECT\s+TOP\s*\(\?\)', re.I)
+_TOP_N = re.compile(r'^\s*SELECT\s+TOP\s*\(?(\d+)\)?', re.I)
+_UNSUPPORTED = re.compile(r'\bOBJECT_ID\b|\bsys\.', re.I)
+_UPDATE_FROM = re.compile(r'^\s*UPDATE (\w+) SET (.+?)(\s+OUTPUT\s.+?)?\s+FROM (\w+) (\w+) JOIN (\S+) (\w+) ON (.+?)'
+                          r'(?:\s+WHERE (.+?))?\s*;?\s*$', re.I | re.S)
+_MERGE = re.compile(r'^\s*MERGE\s+(\w+)\s+AS\s+(\w+)\s+USING\s+(.+?)\s+AS\s+(\w+)\s+ON\s+(.+?)\s+'
+                    r'WHEN MATCHED THEN UPDATE SET\s+(.+?)\s+'
+                    r'WHEN NOT MATCHED THEN INSERT\s*\(([^)]*)\)\s*VALUES\s*\((.+?)\)'
+                    r'(?:\s+OUTPUT\s+(.+?)\s+INTO\s+([\w.]+))?\s*;?\s*$', re.I | re.S)
+
+_cache = {}
+
+
+def _split(text, sep=','):
+    """ Splits on sep outside parentheses and quotes """
+    parts, depth, quote, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == "'":
+            quote = not quote
+        elif not quote and ch == '(':
+            depth += 1
+        elif not quote and ch == ')':
+            depth -= 1
+        elif not quote and depth == 0 and ch == sep:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+class _Frag:
+    """ SQL text with the indexes of the parameters its ?s take """
+    def __init__(self, sql, first=0):
+        self.sql, self.args = sql, list(range(first, first + sql.count('?')))
+
+    @staticmethod
+    def join(*parts):
+        out = _Frag('')
+        for p in parts:
+            if isinstance(p, str):
+                out.sql += p
+            else:
+                out.sql += p.sql
+                out.args += p.args
+        return out
+
+
+def _merge(m):
+    """ MERGE as plain statements: snapshot the source, OUTPUT INTO, UPDATE matched, INSERT the rest """
+    target, t, source, s, on, sets, cols, vals, output, into = m.groups()
+    at = 0
+    def frag(sql):
+        nonlocal at
+        f = _Frag(sql, at)
+        at += len(f.args)
+        return f
+    source, on = frag(source), frag(on)
+    sets = {p.split('=', 1)[0].strip(): frag(p.split('=', 1)[1].strip()) for p in _split(sets)}
+    vals = [frag(v) for v in _split(vals)]
+    inserted = dict(zip([c.strip() for c in cols.split(',')], vals))
+    src = f"temp._merge_src AS {s}"
+    missing = _Frag.join(f" WHERE NOT EXISTS (SELECT 1 FROM {target} AS {t} WHERE ", on, ")")
+    steps = [_Frag("DROP TABLE IF EXISTS temp._merge_src"),
+             _Frag.join("CREATE TEMP TABLE _merge_src AS SELECT * FROM ", source)]
+    if output:
+        for action in ('UPDATE', 'INSERT'):
+            select = []
+            for c in _split(output):
+                side, _, col = c.partition('.')
+                if c.lower() == '$action':
+                    select.append(f"'{action}'")
+                elif action == 'UPDATE':
+                    select.append(sets.get(col, f"{t}.{col}") if side.lower() == 'inserted' else f"{t}.{col}")
+                else:
+                    select.append(inserted.get(col, 'NULL') if side.lower() == 'inserted' else 'NULL')
+            select = _Frag.join(*[x for i, f in enumerate(select) for x in ((', ',) if i else ()) + (f,)])
+            if action == 'UPDATE':
+                steps.append(_Frag.join(f"INSERT INTO {into} SELECT ", select, f" FROM {target} AS {t} JOIN {src} ON ", on))
+            else:
+                steps.append(_Frag.join(f"INSERT INTO {into} SELECT ", select, f" FROM {src}", missing))
+    assign = [x for i, (c, f) in enumerate(sets.items()) for x in ((', ' if i else '') + f"{c} = ", f)]
+    steps.append(_Frag.join(f"UPDATE {target} AS {t} SET ", *assign, f" FROM {src} WHERE ", on))
+    values = [x for i, f in enumerate(vals) for x in ((', ',) if i else ()) + (f,)]
+    steps.append(_Frag.join(f"INSERT INTO {target} ({cols}) SELECT ", *values, f" FROM {src}", missing))
+    steps.append(_Frag("DROP TABLE temp._merge_src"))
+    return steps
+
+
+def _statement(out):
+    """ One translated statement -> (sql, move_top) """
+    move_top = False
+    m = _UPDATE_FROM.match(out)
+    if m and m.group(1) == m.group(5):
+        table, alias, sets, output, source, salias, on, where = m.group(4, 1, 2, 3, 6, 7, 8, 9)
+        out = (f"UPDATE {table} AS {alias} SET {sets}{output or ''} FROM {source} AS {salias} WHERE {on}"
+               + (f" AND {where}" if where else ''))
+    m = _OUTPUT.search(out)
+    if m:
+        cols = ', '.join(c.split('.', 1)[1].strip() for c in m.group(1).split(',') if c.strip())
+        out = out[:m.start()] + out[m.end():]
+        out = out.rstrip().rstrip(';') + ' RETURNING ' + cols
+    if _TOP.search(out):
+        out = _TOP.sub('SELECT', out).rstrip().rstrip(';') + ' LIMIT ?'
+        move_top = True
+    elif _TOP_N.search(out):
+        n = _TOP_N.search(out).group(1)
+        out = _TOP_N.sub('SELECT', out).rstrip().rstrip(';') + f' LIMIT {n}'
+    return out, move_top
+
+
+def translate(sql, params):
+    """ Returns [(sqlite_sql, params), ...]: one statement, or several for a MERGE or a
+        ;-separated batch. Results are memoised per T-SQL string """
+    hit = _cache.get(sql)
+    if hit is None:
+        out = sql
+        for rx, repl in _RULES:
+            out = rx.sub(repl, out)
+        if _UNSUPPORTED.search(out):
+            raise NotSupportedError("T-SQL construct not available in the SQLite stand-in: " + ' '.join(sql.split())[:120])
+        hit, at = [], 0
+        for part in _split(out, ';'):
+            m = _MERGE.match(part)
+            if m:
+                steps = _merge(m)
+                hit += [(f.sql, [a + at for a in f.args], False) for f in steps]
+            else:
+                text, move_top = _statement(part)
+                hit.append((text, list(range(at, at + part.count('?'))), move_top))
+            at += part.count('?')
+        _cache[sql] = hit
+    params = list(params)
+    steps = []
+    for text, args, move_top in hit:
+        p = [params[a] for a in args]
+        if move_top and p:
+            p = p[1:] + p[:1]
+        steps.append((text, p))
+    return steps
+
+
+# --- DB-API objects ---
+class Row(tuple):
+    """ Tuple with pyodbc-style attribute access (row.Nom) """
+    __slots__ = ()
+    _index = {}
+
+    def __getattr__(self, name):
+        try:
+            return self[self._index[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _row_class(description):
+    index = {d[0]: i for i, d in enumerate(description)}
+    return type('Row', (Row,), {'__slots__': (), '_index': index})
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self._cur = conn._db.cursor()
+        self._row = None
+        self.fast_executemany = False
+        self.rowcount = -1
+        self.description = None
+
+    def _wrap(self, raw):
+        return self._row(raw) if raw is not None else None
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        for out, args in translate(sql, params):
+            args = [bytes(p) if isinstance(p, memoryview) else p for p in args]
+            try:
+                self._cur.execute(out, args)
+            except sqlite3.Error as e:
+                raise Error(f"{e} in: {out}") from e
+        self.rowcount = self._cur.rowcount
+        self.description = self._cur.description
+        self._row = _row_class(self.description) if self.description else None
+        return self
+
+    def executemany(self, sql, seq):
+        seq = list(seq)
+        if not seq:
+            return self
+        (out, _), = translate(sql, seq[0])
+        try:
+            self._cur.executemany(out, seq)
+        except sqlite3.Error as e:
+            raise Error(f"{e} in: {out}") from e
+        self.rowcount = self._cur.rowcount
+        return self
+
+    def fetchone(self):
+        return self._wrap(self._cur.fetchone())
+
+    def fetchall(self):
+        row = self._row
+        return [row(r) for r in self._cur.fetchall()]
+
+    def fetchmany(self, size=1):
+        row = self._row
+        return [row(r) for r in self._cur.fetchmany(size)]
+
+    def __iter__(self):
+        row = self._row
+        for r in self._cur:
+            yield row(r)
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # pyodbc commits on a clean exit when autocommit is off
+        if exc_type is None:
+            self.connection.commit()
+        self.close()
+
+
+class Connection:
+    def __init__(self, path, timeout):
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES, isolation_level='IMMEDIATE')
+        self._db.create_function('blob_append', 2, lambda a, b: (a or b'') + (b or b''), deterministic=True)
+        self._db.create_function('CONCAT', -1, lambda *a: ''.join('' if v is None else str(v) for v in a), deterministic=True)
+        self._db.create_function('POWER', 2, lambda a, b: None if a is None or b is None else a ** b, deterministic=True)
+        self._db.create_function('DAY', 1, lambda d: int(str(d)[8:10]) if d is not None else None, deterministic=True)
+        self._db.create_function('MONTH', 1, lambda d: int(str(d)[5:7]) if d is not None else None, deterministic=True)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self.autocommit = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def close(self):
+        self._db.close()
+
+
+def connect(conn_str='', timeout=10, **kwargs):
+    return Connection(os.environ.get('BENCH_DB', 'bench.db'), timeout)
@@ -0,0 +1,217 @@
+""" Concurrent load driver for /RPC2 and the Flask routes.
+
+    python -m bench.loadtest --threads 8 --duration 30            # in-process, SQLite stand-in
+    python -m bench.loadtest --url http://pi:5000 --threads 4     # against a running server
+Reports count, errors, throughput and p50/p95/p99 latency per scenario.
+The rpc.save_attendance / rpc.grade_submissions scenarios write to the bench DB (upserts of
+existing rows); leave them out with --only when comparing read paths.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import xmlrpc.client
+import urllib.error
+import urllib.parse
+import urllib.request
+import http.cookiejar
+
+from bench import BENCH_DB, install
+
+ADMIN = ('admin@school.com', '123456')
+
+
+# --- TRANSPORTS ---
+class InProcessClient:
+    """ Flask test client: measures the app + DB layer without network noise """
+    def __init__(self, app):
+        self.http = app.test_client()
+
+    def rpc(self, method, *params):
+        body = xmlrpc.client.dumps(params, method, allow_none=True)
+        r = self.http.post('/RPC2', data=body, content_type='text/xml')
+        xmlrpc.client.loads(r.data, use_builtin_types=True)  # raises on Fault
+        return r.status_code
+
+    def request(self, method, path, data=None, json_body=None):
+        r = self.http.open(path, method=method, data=data, json=json_body)
+        if r.status_code >= 500: raise RuntimeError(f"HTTP {r.status_code}")
+        return r.status_code
+
+
+class RemoteClient:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.proxy = xmlrpc.client.ServerProxy(self.url + '/RPC2', allow_none=True)
+
+    def rpc(self, method, *params):
+        getattr(self.proxy, method)(*params)
+        return 200
+
+    def request(self, method, path, data=None, json_body=None):
+        headers, body = {}, None
+        if json_body is not None:
+            body, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self.url + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(req) as r:
+                r.read()
+                return r.status
+        except urllib.error.HTTPError as e:
+            if e.code >= 500: raise
+            return e.code
+
+
+# --- SCENARIOS ---
+def build_scenarios(ids):
+    st, te, tp, se, sub = ids['students'], ids['teachers'], ids['tps'], ids['seances'], ids['submissions']
+
+    def sheet(seance):
+        seance_id, students = seance
+        return {'seance_id': seance_id, 'presence': [{'student_id': s, 'status': random.choice(('Present', 'Absent'))} for s in students]}
+    return {
+        'rpc.login': (5, lambda c: c.rpc('login', 'etu1@school.com', '123456')),
+        'rpc.get_student_tps': (20, lambda c: c.rpc('get_student_tps', random.choice(st))),
+        'rpc.get_teacher_data': (10, lambda c: c.rpc('get_teacher_data', random.choice(te))),
+        'rpc.get_submissions': (10, lambda c: c.rpc('get_submissions', random.choice(tp))),
+        'rpc.get_teacher_portal': (10, lambda c: c.rpc('get_teacher_portal', random.choice(te), random.choice(tp))),
+        'rpc.multicall': (5, lambda c: c.rpc('system.multicall', [
+            {'methodName': 'get_student_tps', 'params': [random.choice(st)]},
+            {'methodName': 'get_teacher_data', 'params': [random.choice(te)]}])),
+        'http.admin': (5, lambda c: c.request('GET', '/admin')),
+        'http.users_page': (5, lambda c: c.request('GET', '/admin/api/users?q=a&format=html')),
+        'http.analytics': (10, lambda c: c.request('POST', '/api/analytics_data', json_body={'formateur_id': random.choice(['all'] + te)})),
+        'rpc.save_attendance': (3, lambda c: c.rpc('save_attendance', [sheet(x) for x in random.sample(se, 2)])),
+        'rpc.grade_submissions': (3, lambda c: c.rpc('grade_submissions', None, [{'submission_id': s, 'grade': random.randint(0, 20)}
+                                                                              for s in random.sample(sub, 5)])),
+    }
+
+
+def sample_ids(db_path):
+    import sqlite3
+    db = sqlite3.connect(db_path)
+    ids = {
+        'students': [r[0] for r in db.execute("SELECT EtudiantID FROM Etudiant ORDER BY RANDOM() LIMIT 200")],
+        'teachers': [r[0] for r in db.execute("SELECT FormateurID FROM Formateur ORDER BY RANDOM() LIMIT 50")],
+        'tps': [r[0] for r in db.execute("SELECT TPID FROM TP ORDER BY RANDOM() LIMIT 200")],
+        'submissions': [r[0] for r in db.execute("SELECT SoumissionID FROM Soumission ORDER BY RANDOM() LIMIT 200")],
+    }
+    ids['seances'] = [(sid, [r[0] for r in db.execute("SELECT EtudiantID FROM Etudiant WHERE GroupeID = ?", (gid,))])
+                      for sid, gid in db.execute("SELECT SeanceID, GroupeID FROM Seance ORDER BY RANDOM() LIMIT 50").fetchall()]
+    db.close()
+    return ids
+
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    k = min(int(round(p / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[k]
+
+
+def run(make_client, scenarios, threads, duration, max_requests):
+    samples = {name: [] for name in scenarios}
+    errors = {name: 0 for name in scenarios}
+    lock = threading.Lock()
+    names = list(scenarios)
+    weights = [scenarios[n][0] for n in names]
+    stop_at = time.monotonic() + duration
+    budget = [max_requests]
+
+    def worker():
+        client = make_client()
+        while time.monotonic() < stop_at:
+            with lock:
+                if budget[0] is not None:
+                    if budget[0] <= 0: return
+                    budget[0] -= 1
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                scenarios[name][1](client)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append(elapsed)
+                if not ok: errors[name] += 1
+
+    began = time.monotonic()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool: t.start()
+    for t in pool: t.join()
+    wall = time.monotonic() - began
+
+    report = {'threads': threads, 'wall_seconds': round(wall, 2), 'scenarios': {}}
+    total = 0
+    for name, values in samples.items():
+        values.sort()
+        total += len(values)
+        report['scenarios'][name] = {
+            'count': len(values), 'errors': errors[name],
+            'rps': round(len(values) / wall, 1) if wall else 0,
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'p99_ms': round(percentile(values, 99) * 1000, 1),
+        }
+    report['total_requests'] = total
+    report['throughput_rps'] = round(total / wall, 1) if wall else 0
+    return report
+
+
+def print_report(report):
+    print(f"{'scenario':28} {'count':>7} {'err':>5} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, s in report['scenarios'].items():
+        print(f"{name:28} {s['count']:>7} {s['errors']:>5} {s['rps']:>7} {s['p50_ms']:>7}ms {s['p95_ms']:>7}ms {s['p99_ms']:>7}ms")
+    print(f"total {report['total_requests']} requests in {report['wall_seconds']}s -> {report['throughput_rps']} req/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--url', help='hit a running server instead of the in-process app')
+    ap.add_argument('--db', default=BENCH_DB)
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--duration', type=float, default=20)
+    ap.add_argument('--requests', type=int, help='stop after this many requests')
+    ap.add_argument('--only', help='comma-separated scenario names')
+    ap.add_argument('--no-cache', action='store_true', help='run with CACHE_DISABLED=1')
+    ap.add_argument('--out', default='bench_output.txt', help='JSON report path')
+    args = ap.parse_args()
+
+    if args.no_cache:
+        os.environ['CACHE_DISABLED'] = '1'
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} not found: run python -m bench.datagen first")
+    scenarios = build_scenarios(sample_ids(args.db))
+    if args.only:
+        scenarios = {k: v for k, v in scenarios.items() if k in args.only.split(',')}
+
+    if args.url:
+        def make_client():
+            c = RemoteClient(args.url)
+            c.request('POST', '/', data={'email': ADMIN[0], 'password': ADMIN[1]})
+            return c
+    else:
+        os.environ['BENCH_DB'] = args.db
+        install()
+        from app import app
+
+        def make_client():
+            c = InProcessClient(app)
+            c.request('POST', '/', data={'email': ADMIN[0], 'password': ADMIN[1]})
+            return c
+
+    report = run(make_client, scenarios, args.threads, args.duration, args.requests)
+    print_report(report)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+-- SQLite mirror of the SchoolManagementDB tables used by db_manager.py (benchmarks only)
+CREATE TABLE Utilisateur (UserID INTEGER PRIMARY KEY AUTOINCREMENT, Nom TEXT, Prenom TEXT, Email TEXT UNIQUE, MotDePasse TEXT, Role TEXT);
+CREATE TABLE Filiere (FiliereID INTEGER PRIMARY KEY AUTOINCREMENT, NomFiliere TEXT);
+CREATE TABLE Groupe (GroupeID INTEGER PRIMARY KEY AUTOINCREMENT, NomGroupe TEXT, FiliereID INTEGER);
+CREATE TABLE Etudiant (EtudiantID INTEGER PRIMARY KEY, CNE TEXT, GroupeID INTEGER, DateNaissance DATETIME);
+CREATE TABLE Formateur (FormateurID INTEGER PRIMARY KEY, Matricule TEXT, Specialite TEXT);
+CREATE TABLE Module (ModuleID INTEGER PRIMARY KEY AUTOINCREMENT, NomModule TEXT);
+CREATE TABLE Affectation (AffectationID INTEGER PRIMARY KEY AUTOINCREMENT, FormateurID INTEGER, GroupeID INTEGER, ModuleID INTEGER);
+CREATE TABLE TP (TPID INTEGER PRIMARY KEY AUTOINCREMENT, Titre TEXT, Description TEXT, FichierData BLOB, FichierHash TEXT, FichierNom TEXT, FichierType TEXT,
+                 DateLimite DATETIME, ModuleID INTEGER, FormateurID INTEGER, GroupeID INTEGER, RowVer INTEGER);
+CREATE TABLE Soumission (SoumissionID INTEGER PRIMARY KEY AUTOINCREMENT, TPID INTEGER, EtudiantID INTEGER, FichierData BLOB, FichierHash TEXT, FichierNom TEXT,
+                         FichierType TEXT, DateSoumission DATETIME, Note REAL, Commentaire TEXT);
+CREATE TABLE Seance (SeanceID INTEGER PRIMARY KEY AUTOINCREMENT, DateDebut DATETIME, DateFin DATETIME, Salle TEXT,
+                     ModuleID INTEGER, FormateurID INTEGER, GroupeID INTEGER);
+CREATE TABLE Presence (PresenceID INTEGER PRIMARY KEY AUTOINCREMENT, SeanceID INTEGER, EtudiantID INTEGER, Etat TEXT,
+                       DateEnregistrement DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE Annonce (AnnonceID INTEGER PRIMARY KEY AUTOINCREMENT, Titre TEXT, Contenu TEXT, ImageBin BLOB, ImageHash TEXT, FormateurID INTEGER,
+                      GroupeID INTEGER, ModuleID INTEGER, DatePublication DATETIME);
+
+-- migrations/001_attendance_aggregates.sql
+CREATE TABLE PresenceAgg (Jour DATE, GroupeID INTEGER, FormateurID INTEGER, ModuleID INTEGER, Presents INTEGER DEFAULT 0, Total INTEGER DEFAULT 0,
+                          PRIMARY KEY (Jour, GroupeID, FormateurID, ModuleID));
+CREATE TABLE AbsenceCounter (EtudiantID INTEGER, ModuleID INTEGER, GroupeID INTEGER, FormateurID INTEGER, Absences INTEGER DEFAULT 0,
+                             PRIMARY KEY (EtudiantID, ModuleID, GroupeID, FormateurID));
+
+-- migrations/002_blob_store.sql
+CREATE TABLE Blob (Hash TEXT PRIMARY KEY, Taille INTEGER, RefCount INTEGER DEFAULT 0, CreeLe DATETIME DEFAULT CURRENT_TIMESTAMP);
+
+-- migrations/003_tp_rowversion.sql (rowversion emulated with triggers)
+CREATE TRIGGER TR_TP_RowVer_Insert AFTER INSERT ON TP
+BEGIN UPDATE TP SET RowVer = (SELECT IFNULL(MAX(RowVer), 0) + 1 FROM TP) WHERE TPID = NEW.TPID; END;
+CREATE TRIGGER TR_TP_RowVer_Update AFTER UPDATE OF Titre, Description, DateLimite, ModuleID, GroupeID, FichierNom ON TP
+BEGIN UPDATE TP SET RowVer = (SELECT IFNULL(MAX(RowVer), 0) + 1 FROM TP) WHERE TPID = NEW.TPID; END;
+
+CREATE INDEX IX_Etudiant_Groupe ON Etudiant (GroupeID);
+CREATE INDEX IX_Affectation_Formateur ON Affectation (FormateurID);
+CREATE INDEX IX_TP_Groupe ON TP (GroupeID);
+CREATE INDEX IX_TP_Groupe_RowVer ON TP (GroupeID, RowVer);
+CREATE INDEX IX_TP_Formateur ON TP (FormateurID);
+CREATE INDEX IX_Soumission_TP ON Soumission (TPID);
+CREATE INDEX IX_Seance_Formateur ON Seance (FormateurID, DateDebut);
+CREATE INDEX IX_Seance_Slot ON Seance (FormateurID, GroupeID, ModuleID, DateDebut);
+CREATE INDEX IX_Seance_DateDebut ON Seance (DateDebut);
+CREATE UNIQUE INDEX IX_Presence_Seance ON Presence (SeanceID, EtudiantID);
+CREATE INDEX IX_Presence_Etat ON Presence (Etat, SeanceID);
+CREATE INDEX IX_Presence_Etudiant ON Presence (EtudiantID, Etat);
+CREATE INDEX IX_PresenceAgg_Formateur ON PresenceAgg (FormateurID, Jour);
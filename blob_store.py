@@ -0,0 +1,118 @@
+""" Content-addressed file store for TP handouts, submissions and announcement images.
+
+Files live on local disk under their SHA-256, so the same handout uploaded to five groups
+is stored once. The DB keeps only the hash (TP.FichierHash, Soumission.FichierHash,
+Annonce.ImageHash) and a Blob row with size and reference count (migrations/002).
+
+Layout: <root>/<size class>/<h[0:2]>/<h[2:4]>/<h>. The size class (s < 1 MB, m < 16 MB,
+l above) lets large files be moved to another disk with a symlink.
+"""
+import os
+import mmap
+import time
+import uuid
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SIZE_CLASSES = ((1024 * 1024, 's'), (16 * 1024 * 1024, 'm'), (None, 'l'))
+READ_CHUNK = 256 * 1024
+
+
+def size_class(size):
+    for limit, name in SIZE_CLASSES:
+        if limit is None or size < limit:
+            return name
+
+
+class DiskBlobStore:
+    def __init__(self, root):
+        self.root = root
+        self.tmp = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def path_for(self, sha, size):
+        return os.path.join(self.root, size_class(size), sha[:2], sha[2:4], sha)
+
+    def put_stream(self, chunks):
+        """ Streams chunks to disk while hashing. Returns (sha256, size); identical content is kept once """
+        digest, size = hashlib.sha256(), 0
+        tmp_path = os.path.join(self.tmp, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha = digest.hexdigest()
+            final = self.path_for(sha, size)
+            if os.path.exists(final):
+                os.remove(tmp_path)  # dedup: content already stored
+                os.utime(final)  # young again: gc leaves it alone until our row has committed
+            else:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(tmp_path, final)
+            return sha, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def exists(self, sha, size):
+        return os.path.exists(self.path_for(sha, size))
+
+    def iter_range(self, sha, size, start=0, end=None, chunk_size=READ_CHUNK):
+        """ Yields bytes [start, end) through an mmap of the file (no read buffer copies) """
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with open(self.path_for(sha, size), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(start, end, chunk_size):
+                yield mm[pos:min(pos + chunk_size, end)]
+
+    def mtime(self, sha, size):
+        """ Last write or dedup hit of a stored file, None if it is not there """
+        try:
+            return os.stat(self.path_for(sha, size)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def delete(self, sha, size):
+        try:
+            os.remove(self.path_for(sha, size))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def walk(self):
+        """ Yields (sha, size, mtime) for every stored file (used by garbage collection) """
+        for _, cls in SIZE_CLASSES:
+            base = os.path.join(self.root, cls)
+            for dirpath, _, files in os.walk(base):
+                for name in files:
+                    st = os.stat(os.path.join(dirpath, name))
+                    yield name, st.st_size, st.st_mtime
+
+    def sweep_tmp(self, older_than=3600):
+        """ Removes partial writes left by crashed uploads """
+        limit = time.time() - older_than
+        for name in os.listdir(self.tmp):
+            path = os.path.join(self.tmp, name)
+            if os.stat(path).st_mtime < limit:
+                os.remove(path)
+
+
+_store = None
+
+def get_blob_store():
+    """ The configured store (BLOB_STORE_DIR), or None to keep files in the DB as before """
+    global _store
+    root = os.getenv('BLOB_STORE_DIR')
+    if not root:
+        return None
+    if _store is None or _store.root != root:
+        _store = DiskBlobStore(root)
+    return _store
@@ -0,0 +1,163 @@
+import os
+import zlib
+import mmap
+import time
+import struct
+import tempfile
+import functools
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows dev box: bumps are only atomic within the process
+    fcntl = None
+
+_MISSING = object()
+_SLOT = struct.Struct('<Q')
+
+# Invalidations of the shared cache are counted here, for the other worker processes
+CACHE_STATE = os.getenv('CACHE_STATE', os.path.join(tempfile.gettempdir(), 'rpc_cache.ver'))
+SHARED_SLOTS = 64
+
+
+class Versions:
+    """ One 64-bit counter per name in a memory-mapped file shared by every worker process """
+
+    def __init__(self, path, names):
+        self.index = {n: i for i, n in enumerate(names)}
+        self._lock = threading.Lock()
+        size = _SLOT.size * len(names)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def get(self, name):
+        return _SLOT.unpack_from(self._map, self.index[name] * _SLOT.size)[0]
+
+    def bump(self, *names):
+        with self._lock:
+            if fcntl: fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                for name in names:
+                    offset = self.index[name] * _SLOT.size
+                    _SLOT.pack_into(self._map, offset, _SLOT.unpack_from(self._map, offset)[0] + 1)
+            finally:
+                if fcntl: fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+def _slot(namespace):
+    return zlib.crc32(namespace.encode()) % SHARED_SLOTS  # hash() differs between a master and its re-exec
+
+
+class TTLCache:
+    """ Thread-safe LRU cache whose entries also expire after a TTL. With `shared` (a Versions
+    of SHARED_SLOTS counters) an invalidation also bumps its namespace's counter, and the other
+    processes drop that namespace on their next get() """
+
+    def __init__(self, max_entries=512, ttl=300, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = os.getenv('CACHE_DISABLED', '0') != '1'
+        self.shared = shared
+        self._seen = [shared.get(i) for i in range(SHARED_SLOTS)] if shared else None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _sync(self, namespace):
+        """ Drops the namespace (and those sharing its slot) if another process invalidated it. Holds _lock """
+        slot = _slot(namespace)
+        version = self.shared.get(slot)
+        if version != self._seen[slot]:
+            self._seen[slot] = version
+            keys = [k for k in self._data if _slot(k[0]) == slot]
+            for k in keys:
+                del self._data[k]
+            self._stats["invalidations"] += len(keys)
+
+    def get(self, key, default=_MISSING):
+        if not self.enabled:
+            return default
+        with self._lock:
+            if self.shared: self._sync(key[0])
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self._stats["misses"] += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+        expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, namespace, *args, local=False):
+        """ Drops one key (namespace, *args), or the whole namespace if no args. Other processes
+        drop the whole namespace, unless local (the caller knows they do the same) """
+        if self.shared and not local:
+            self.shared.bump(_slot(namespace))
+        with self._lock:
+            if args:
+                key = make_key(namespace, args)
+                keys = [key] if key in self._data else []
+            else:
+                keys = [k for k in self._data if k[0] == namespace]
+            for k in keys:
+                del self._data[k]
+            self._stats["invalidations"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def set_enabled(self, enabled):
+        """ Debug switch: a disabled cache always misses and stores nothing """
+        self.enabled = enabled
+        if not enabled:
+            self.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"entries": len(self._data), "enabled": self.enabled})
+        return data
+
+
+cache = TTLCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '512')),
+                 ttl=float(os.getenv('CACHE_TTL', '300')),
+                 shared=Versions(CACHE_STATE, range(SHARED_SLOTS)))
+
+
+def make_key(namespace, args):
+    # ids arrive as int from RPC and as str from request.form: key on the text
+    return (namespace,) + tuple(str(a) for a in args)
+
+
+def cached(namespace, ttl=None):
+    """ Read-through cache for SchoolDB methods, keyed by (namespace, *args).
+    Results are shared between callers: treat them as read-only. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapped(self, *args):
+            key = make_key(namespace, args)
+            value = cache.get(key)
+            if value is not _MISSING:
+                return value
+            value = fn(self, *args)
+            if self.conn is not None:  # never cache the "no connection" fallback
+                cache.set(key, value, ttl)
+            return value
+        return wrapped
+    return decorator
@@ -2,11 +2,169 @@ import pyodbc
 import os
 import hashlib
 import logging
+import time
+import datetime
+import threading
 from dotenv import load_dotenv
+from db_pool import ConnectionPool, CircuitBreaker, BackendUnavailable, CircuitOpen, pool_settings, breaker_settings
+from cache import cache, cached, make_key, TTLCache
+import metrics
+import queries
+import rpc_auth
+from events import bus
+import fragments
+from blob_store import get_blob_store
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# One pool per connection string, shared by every SchoolDB() in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+_inherited = []  # pools copied from the parent by fork(): never used nor closed in the child
+
+def _reset_after_fork():
+    """ A forked worker must not talk over the parent's DB sockets: it starts with no pools.
+        The copies are kept referenced so their connections are never closed (logged out) from here """
+    global _pools_lock
+    _inherited.extend(_pools.values())
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def warm_pool():
+    """ Opens the pool's min_size connections now rather than on the first request """
+    get_pool(SchoolDB().conn_str()).warm()
+
+def get_pool(conn_str):
+    pool = _pools.get(conn_str)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(conn_str)
+            if pool is None:
+                timeout = int(os.getenv('DB_CONNECT_TIMEOUT', '10'))
+                probe_timeout = int(os.getenv('DB_PROBE_TIMEOUT', '3'))
+                breaker = CircuitBreaker(lambda: _probe(conn_str, probe_timeout), **breaker_settings())
+                pool = ConnectionPool(lambda: metrics.InstrumentedConnection(pyodbc.connect(conn_str, timeout=timeout)),
+                                      breaker=breaker, **pool_settings())
+                _pools[conn_str] = pool
+    return pool
+
+GRADE_MAX = 20
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+# Rows fetched per round trip by the export generators
+EXPORT_FETCH = int(os.getenv('DB_EXPORT_FETCH', '500'))
+
+# Rows of the analytics absence report (the students with the most absences)
+ABSENT_REPORT_ROWS = int(os.getenv('ABSENT_REPORT_ROWS', '100'))
+
+# Bytes moved per DB round trip when streaming files in or out
+BLOB_CHUNK = int(os.getenv('DB_BLOB_CHUNK', str(256 * 1024)))
+
+def iter_chunks(data, size=None):
+    """ Slices an in-memory buffer into BLOB_CHUNK views without copying it """
+    view = memoryview(data)
+    size = size or BLOB_CHUNK
+    for i in range(0, len(view), size):
+        yield view[i:i + size]
+
+def _probe(conn_str, timeout):
+    """ Background health probe used by the circuit breaker: short connect + SELECT 1 """
+    conn = pyodbc.connect(conn_str, timeout=timeout)
+    try:
+        conn.cursor().execute("SELECT 1").fetchone()
+    finally:
+        conn.close()
+
+def pool_stats():
+    """ Checkout/wait/create counters for every pool (for monitoring) """
+    return {"pool_%d" % i: p.stats() for i, p in enumerate(_pools.values())}
+
+# Apply the #PresenceDelta rows written by save_presence_batch to the rollups
+# (migrations/001_attendance_aggregates.sql). Comparisons use the default CI collation.
+# HOLDLOCK on every upsert target: two concurrent first saves of a row serialize instead of one
+# failing on the primary key.
+PRESENCE_AGG_DELTA_SQL = """
+    MERGE PresenceAgg WITH (HOLDLOCK) AS T
+    USING (
+        SELECT CAST(S.DateDebut AS DATE) AS Jour, ISNULL(S.GroupeID, 0) AS GroupeID,
+               ISNULL(S.FormateurID, 0) AS FormateurID, ISNULL(S.ModuleID, 0) AS ModuleID,
+               SUM(CASE WHEN D.Nouveau = 'Present' THEN 1 ELSE 0 END
+                   - CASE WHEN D.Ancien = 'Present' THEN 1 ELSE 0 END) AS DPresents,
+               SUM(CASE WHEN D.Action = 'INSERT' THEN 1 ELSE 0 END) AS DTotal
+        FROM #PresenceDelta D JOIN Seance S ON S.SeanceID = D.SeanceID
+        GROUP BY CAST(S.DateDebut AS DATE), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0), ISNULL(S.ModuleID, 0)
+    ) AS X
+    ON T.Jour = X.Jour AND T.GroupeID = X.GroupeID AND T.FormateurID = X.FormateurID AND T.ModuleID = X.ModuleID
+    WHEN MATCHED THEN UPDATE SET Presents = T.Presents + X.DPresents, Total = T.Total + X.DTotal
+    WHEN NOT MATCHED THEN INSERT (Jour, GroupeID, FormateurID, ModuleID, Presents, Total)
+                          VALUES (X.Jour, X.GroupeID, X.FormateurID, X.ModuleID, X.DPresents, X.DTotal);
+"""
+
+ABSENCE_COUNTER_DELTA_SQL = """
+    MERGE AbsenceCounter WITH (HOLDLOCK) AS T
+    USING (
+        SELECT D.EtudiantID, ISNULL(S.ModuleID, 0) AS ModuleID, ISNULL(S.GroupeID, 0) AS GroupeID,
+               ISNULL(S.FormateurID, 0) AS FormateurID,
+               SUM(CASE WHEN D.Nouveau = 'Absent' THEN 1 ELSE 0 END
+                   - CASE WHEN D.Ancien = 'Absent' THEN 1 ELSE 0 END) AS DAbsences
+        FROM #PresenceDelta D JOIN Seance S ON S.SeanceID = D.SeanceID
+        GROUP BY D.EtudiantID, ISNULL(S.ModuleID, 0), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0)
+        HAVING SUM(CASE WHEN D.Nouveau = 'Absent' THEN 1 ELSE 0 END
+                   - CASE WHEN D.Ancien = 'Absent' THEN 1 ELSE 0 END) <> 0
+    ) AS X
+    ON T.EtudiantID = X.EtudiantID AND T.ModuleID = X.ModuleID AND T.GroupeID = X.GroupeID AND T.FormateurID = X.FormateurID
+    WHEN MATCHED THEN UPDATE SET Absences = T.Absences + X.DAbsences
+    WHEN NOT MATCHED THEN INSERT (EtudiantID, ModuleID, GroupeID, FormateurID, Absences)
+                          VALUES (X.EtudiantID, X.ModuleID, X.GroupeID, X.FormateurID, X.DAbsences);
+"""
+
+# Séance creation: the range lock (UPDLOCK, HOLDLOCK on IX_Seance_Slot) makes check + insert atomic,
+# so two teachers opening the same sheet get one séance. No row out = it already existed.
+SEANCE_UPSERT_SQL = """
+    INSERT INTO Seance (DateDebut, DateFin, Salle, ModuleID, FormateurID, GroupeID)
+    OUTPUT INSERTED.SeanceID
+    SELECT ?, ?, 'Virtual', ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM Seance WITH (UPDLOCK, HOLDLOCK)
+                      WHERE FormateurID = ? AND GroupeID = ? AND ModuleID = ? AND DateDebut >= ? AND DateDebut < DATEADD(day, 1, ?))
+"""
+
+# One séance (08:00-10:00) per Affectation per selected weekday between two dates, skipping existing ones.
+# Weekdays are a bitmask, bit 0 = Monday (day 0 of DATEDIFF is 1900-01-01, a Monday: independent of DATEFIRST)
+SEANCE_PREGENERATE_SQL = """
+    WITH Days AS (
+        SELECT CAST(? AS DATE) AS D
+        UNION ALL
+        SELECT DATEADD(day, 1, D) FROM Days WHERE D < CAST(? AS DATE)
+    )
+    INSERT INTO Seance (DateDebut, DateFin, Salle, ModuleID, FormateurID, GroupeID)
+    OUTPUT INSERTED.SeanceID, INSERTED.FormateurID, INSERTED.GroupeID, INSERTED.ModuleID, INSERTED.DateDebut
+    SELECT DATEADD(hour, 8, CAST(Days.D AS DATETIME)), DATEADD(hour, 10, CAST(Days.D AS DATETIME)), 'Virtual',
+           A.ModuleID, A.FormateurID, A.GroupeID
+    FROM Days CROSS JOIN Affectation A
+    WHERE (POWER(2, DATEDIFF(day, 0, Days.D) % 7) & ?) > 0
+      AND (? IS NULL OR A.FormateurID = ?) AND (? IS NULL OR A.GroupeID = ?)
+      AND NOT EXISTS (SELECT 1 FROM Seance S WITH (UPDLOCK, HOLDLOCK)
+                      WHERE S.FormateurID = A.FormateurID AND S.GroupeID = A.GroupeID AND S.ModuleID = A.ModuleID
+                        AND S.DateDebut >= Days.D AND S.DateDebut < DATEADD(day, 1, Days.D))
+    OPTION (MAXRECURSION 0)
+"""
+
+SEANCE_INDEX_DAYS = int(os.getenv('SEANCE_INDEX_DAYS', '14'))
+SEANCE_WEEKDAYS = [int(d) for d in os.getenv('SEANCE_WEEKDAYS', '0,1,2,3,4,5').split(',') if d.strip()]
+PREGENERATE_MAX_DAYS = 400
+
+# (formateur, groupe, module, day) -> SeanceID, warmed with the séances around today. Séances are
+# never moved or deleted by the app, so an entry can only go stale through manual DB edits
+seance_index = TTLCache(max_entries=int(os.getenv('SEANCE_INDEX_MAX', '20000')),
+                        ttl=float(os.getenv('SEANCE_INDEX_TTL', str(24 * 3600))))
+_seance_index_warm = False
+
 class SchoolDB:
     def __init__(self):
         # 1. Force FreeTDS Driver for Raspberry Pi
@@ -16,28 +174,72 @@ class SchoolDB:
         self.user = os.getenv('DB_USER', 'ayoub_rpc')
         self.password = os.getenv('DB_PASSWORD', 'ayoub_rpc')
         self.conn = None
+        self._pooled = None
+        self.error = None
 
     def __enter__(self):
         self.connect()
+        if self.conn is None:
+            # Fail in milliseconds with a clear error instead of handing out conn=None
+            raise self.error if isinstance(self.error, BackendUnavailable) else BackendUnavailable(str(self.error))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn: self.conn.close()
+        self.close()
+
+    def conn_str(self):
+        # Added MARS_Connection=yes to allow multiple cursors at once
+        return (
+            f"DRIVER={self.driver};SERVER={self.server};PORT=1433;"
+            f"DATABASE={self.database};UID={self.user};PWD={self.password};"
+            f"TDS_Version=7.4;TrustServerCertificate=yes;"
+            f"MARS_Connection=yes;" 
+        )
 
     def connect(self):
+        """ Checks a connection out of the shared pool instead of a fresh login """
+        if self._pooled: return
         try:
-            # Added MARS_Connection=yes to allow multiple cursors at once
-            conn_str = (
-                f"DRIVER={self.driver};SERVER={self.server};PORT=1433;"
-                f"DATABASE={self.database};UID={self.user};PWD={self.password};"
-                f"TDS_Version=7.4;TrustServerCertificate=yes;"
-                f"MARS_Connection=yes;" 
-            )
-            self.conn = pyodbc.connect(conn_str, timeout=10)
+            start = time.perf_counter()
+            self._pooled = get_pool(self.conn_str()).acquire()
+            metrics.DB_ACQUIRE.observe(time.perf_counter() - start)
+            self.conn = self._pooled.conn
         except Exception as e:
-            logger.error(f"❌ Connection Error: {e}")
+            if not isinstance(e, CircuitOpen): logger.error(f"❌ Connection Error: {e}")
+            self.error = e
+            self._pooled = None
             self.conn = None
 
+    def close(self):
+        """ Returns the connection to the pool (uncommitted work is rolled back) """
+        if self._pooled:
+            get_pool(self.conn_str()).release(self._pooled)
+        self._pooled = None
+        self.conn = None
+
+    # --- NAMED STATEMENTS (queries.py) ---
+    def _query(self, stmt, params=(), variant='default'):
+        """ Executes a registered statement on the cursor this pooled connection keeps for it,
+            so the same SQL text goes to the same handle and stays prepared """
+        key = (stmt.name, variant)
+        cursors = self._pooled.cursors
+        cursor = cursors.get(key)
+        if cursor is None:
+            cursor = cursors[key] = self.conn.cursor()
+        cursor.execute(stmt.sql(variant), params)
+        return cursor
+
+    def _rows(self, stmt, params=(), variant='default'):
+        """ The statement's rows mapped through its compiled projection """
+        return queries.fetch(self._query(stmt, params, variant), stmt.project)
+
+    def _query_ids(self, stmt, ids):
+        """ Raw rows of an 'in<n>' statement for any number of ids, ID_LIST_SIZES[-1] per round trip """
+        ids, size = list(ids), queries.ID_LIST_SIZES[-1]
+        for i in range(0, len(ids), size):
+            variant, params = queries.id_list(ids[i:i + size])
+            yield from queries.iter_rows(self._query(stmt, params, variant))
+
     # --- AUTHENTICATION ---
     def login(self, email, password):
         # Line 43 must be indented!
@@ -45,28 +247,21 @@ class SchoolDB:
             self.connect()
         
         try:
-            cursor = self.conn.cursor()
-            # We use .strip() to handle any hidden spaces in the SQL columns
-            sql = "SELECT UserID, Nom, Prenom, Role, MotDePasse FROM Utilisateur WHERE Email = ?"
-            cursor.execute(sql, (email.strip(),))
-            row = cursor.fetchone()
+            row = self._query(queries.LOGIN, (email.strip(),)).fetchone()
             
             if not row:
                 return None
 
-            # Get the hash from the DB and clean it
-            stored_hash = str(row.MotDePasse).strip()
+            # Get the hash from the DB and clean it (.strip() handles hidden spaces in the column)
+            user = queries.LOGIN.project(row)
+            stored_hash = str(user.pop('hash')).strip()
             
             # Check if input is a hash (64 chars) or plain text
             input_hash = password if len(password) == 64 else hashlib.sha256(password.encode()).hexdigest()
 
             if stored_hash == input_hash:
-                return {
-                    "id": row.UserID, 
-                    "name": f"{row.Nom} {row.Prenom}", 
-                    "role": row.Role, 
-                    "email": email
-                }
+                user['email'] = email
+                return user
         except Exception as e:
             print(f"Login error: {e}")
             return None
@@ -76,60 +271,111 @@ class SchoolDB:
     # --- ADMIN: USER MANAGEMENT ---
     def get_all_users_extended(self):
         if not self.conn: return []
-        cursor = self.conn.cursor()
-        sql = """
-            SELECT U.UserID, U.Nom, U.Prenom, U.Email, U.Role, G.NomGroupe, F.Matricule, E.CNE
-            FROM Utilisateur U
-            LEFT JOIN Etudiant E ON U.UserID = E.EtudiantID
-            LEFT JOIN Groupe G ON E.GroupeID = G.GroupeID
-            LEFT JOIN Formateur F ON U.UserID = F.FormateurID
-            ORDER BY U.Role, U.Nom
-        """
-        cursor.execute(sql)
-        users = []
-        for r in cursor.fetchall():
-            users.append({
-                "id": r.UserID, "name": f"{r.Nom} {r.Prenom}", "email": r.Email, 
-                "role": r.Role, "student_group": r.NomGroupe, 
-                "matricule": r.Matricule, "cne": r.CNE, "teacher_groups": []
-            })
+        users = self._rows(queries.USERS_ALL)
         
-        # Populate Teacher Groups
-        cursor.execute("SELECT A.FormateurID, G.NomGroupe, M.NomModule FROM Affectation A JOIN Groupe G ON A.GroupeID = G.GroupeID JOIN Module M ON A.ModuleID = M.ModuleID")
-        for assign in cursor.fetchall():
-            for u in users:
-                if u['id'] == assign.FormateurID:
-                    u['teacher_groups'].append(f"{assign.NomGroupe} ({assign.NomModule})")
+        # Populate Teacher Groups (dict index: one pass over Affectation)
+        by_id = {u['id']: u for u in users}
+        for fid, label in queries.iter_rows(self._query(queries.TEACHER_GROUP_LABELS)):
+            u = by_id.get(fid)
+            if u: u['teacher_groups'].append(label)
         return users
 
+    def get_users_page(self, after=None, limit=50, role=None, group_id=None, q=None):
+        """ Keyset page of the user directory ordered by (Role, Nom, UserID).
+            after is the (role, nom, id) of the last row already shown. Returns (users, last_key or None) """
+        if not self.conn: return [], None
+        used, params = [], [limit + 1]
+        if after:
+            used.append('after'); params += [after[0], after[0], after[1], after[1], after[2]]
+        if role:
+            used.append('role'); params.append(role)
+        if group_id:
+            used.append('group'); params += [group_id, group_id]
+        if q:
+            used.append('q'); params += [f"%{q.strip()}%"] * 4
+        rows = self._query(queries.USERS_PAGE, params, '+'.join(used) or 'all').fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        users = list(map(queries.USERS_PAGE.project, rows))
+        last = (rows[-1][4], rows[-1][1], rows[-1][0]) if more else None  # Role, Nom, UserID
+
+        # Teacher groups only for the formateurs on this page
+        by_id = {u['id']: u for u in users if u['role'] == 'Formateur'}
+        for fid, label in self._query_ids(queries.TEACHER_GROUP_LABELS_FOR, by_id):
+            by_id[fid]['teacher_groups'].append(label)
+        return users, last
+
+    @cached('groups_by_filiere')
     def get_groups_by_filiere(self):
         if not self.conn: return {}
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT F.NomFiliere, G.GroupeID, G.NomGroupe FROM Groupe G JOIN Filiere F ON G.FiliereID=F.FiliereID")
         res = {}
-        for r in cursor.fetchall():
-            if r.NomFiliere not in res: res[r.NomFiliere] = []
-            res[r.NomFiliere].append({'id': r.GroupeID, 'name': r.NomGroupe})
+        for filiere, gid, name in queries.iter_rows(self._query(queries.GROUPS_BY_FILIERE)):
+            if filiere not in res: res[filiere] = []
+            res[filiere].append({'id': gid, 'name': name})
         return res
 
+    @cached('all_modules')
     def get_all_modules(self):
         if not self.conn: return []
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT ModuleID, NomModule FROM Module")
-        return [{"id": r.ModuleID, "name": r.NomModule} for r in cursor.fetchall()]
+        return self._rows(queries.ALL_MODULES)
+
+    @cached('teachers')
+    def get_all_teachers(self):
+        if not self.conn: return []
+        return self._rows(queries.ALL_TEACHERS)
 
     def create_user_account(self, nom, prenom, email, password, role, extra):
         if not self.conn: return False
-        hashed_pw = hashlib.sha256(password.encode()).hexdigest()
+        hashed_pw = hash_password(password)
         cursor = self.conn.cursor()
         try:
             cursor.execute("INSERT INTO Utilisateur (Nom, Prenom, Email, MotDePasse, Role) VALUES (?,?,?,?,?)", (nom, prenom, email, hashed_pw, role))
             cursor.execute("SELECT @@IDENTITY"); uid = cursor.fetchone()[0]
             if role == 'Etudiant': cursor.execute("INSERT INTO Etudiant (EtudiantID, CNE, GroupeID, DateNaissance) VALUES (?,?,?,GETDATE())", (uid, extra.get('cne'), extra.get('groupe_id')))
             elif role == 'Formateur': cursor.execute("INSERT INTO Formateur (FormateurID, Matricule, Specialite) VALUES (?,?,'General')", (uid, extra.get('matricule')))
-            self.conn.commit(); return True
+            self.conn.commit()
+            if role == 'Formateur': cache.invalidate('teachers')
+            fragments.bump('users')
+            return True
         except Exception: self.conn.rollback(); return False
 
+    # --- BULK PROVISIONING (see provisioning.py) ---
+    def get_group_ids_by_name(self):
+        """ {lowercased group name: GroupeID} for the whole school, in one query """
+        if not self.conn: return {}
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT GroupeID, NomGroupe FROM Groupe")
+        return {str(r.NomGroupe).strip().lower(): r.GroupeID for r in cursor.fetchall()}
+
+    def existing_emails(self, emails):
+        """ Which of these (lowercased) emails already have an account """
+        if not emails: return set()
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT Email FROM Utilisateur WHERE Email IN ({','.join('?' * len(emails))})", list(emails))
+        return {r.Email.strip().lower() for r in cursor.fetchall()}
+
+    def insert_users_batch(self, users):
+        """ Inserts ready accounts (password_hash, resolved groupe_id) in ONE transaction.
+            Returns {email: UserID}; rolls back and raises if any row fails """
+        cursor = self.conn.cursor()
+        try:
+            values = ','.join(['(?,?,?,?,?)'] * len(users))
+            params = [v for u in users for v in (u['nom'], u['prenom'], u['email'], u['password_hash'], u['role'])]
+            cursor.execute(f"INSERT INTO Utilisateur (Nom, Prenom, Email, MotDePasse, Role) OUTPUT INSERTED.UserID, INSERTED.Email VALUES {values}", params)
+            ids = {r[1].strip().lower(): r[0] for r in cursor.fetchall()}
+            students = [(ids[u['email']], u['cne'], u['groupe_id']) for u in users if u['role'] == 'Etudiant']
+            teachers = [(ids[u['email']], u['matricule']) for u in users if u['role'] == 'Formateur']
+            cursor.fast_executemany = True
+            if students: cursor.executemany("INSERT INTO Etudiant (EtudiantID, CNE, GroupeID, DateNaissance) VALUES (?,?,?,GETDATE())", students)
+            if teachers: cursor.executemany("INSERT INTO Formateur (FormateurID, Matricule, Specialite) VALUES (?,?,'General')", teachers)
+            cursor.fast_executemany = False
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback(); raise
+        if teachers: cache.invalidate('teachers')
+        fragments.bump('users')
+        return ids
+
     # --- ASSIGNMENTS (Renamed to match app.py) ---
     def assign_formateur_to_module(self, formateur_id, groupe_id, module_id):
         """ Links a teacher to a group and module in the Affectation table """
@@ -147,21 +393,30 @@ class SchoolDB:
             sql = "INSERT INTO Affectation (FormateurID, GroupeID, ModuleID) VALUES (?, ?, ?)"
             cursor.execute(sql, (formateur_id, groupe_id, module_id))
             self.conn.commit()
+            self._invalidate_teacher(formateur_id)
             return True
         except Exception as e:
             print(f"❌ Assignment Error: {e}")
             self.conn.rollback()
             return False
 
+    def _invalidate_teacher(self, fid):
+        cache.invalidate('teacher_modules', fid)
+        cache.invalidate('teacher_assignments', fid)
+        fragments.bump('users')  # the Classes column of the user table
+
+    @cached('teacher_assignments')
     def get_teacher_assignments_detailed(self, fid):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT A.AffectationID, G.NomGroupe, M.NomModule FROM Affectation A JOIN Groupe G ON A.GroupeID=G.GroupeID JOIN Module M ON A.ModuleID=M.ModuleID WHERE A.FormateurID=?", (fid,))
-        return [{"id": r.AffectationID, "group": r.NomGroupe, "module": r.NomModule} for r in cursor.fetchall()]
+        return self._rows(queries.TEACHER_ASSIGNMENTS, (fid,))
 
     def delete_assignment(self, aid):
         try:
-            self.conn.cursor().execute("DELETE FROM Affectation WHERE AffectationID=?", (aid,))
-            self.conn.commit(); return True
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM Affectation OUTPUT DELETED.FormateurID WHERE AffectationID=?", (aid,))
+            row = cursor.fetchone()
+            self.conn.commit()
+            if row: self._invalidate_teacher(row[0])
+            return True
         except Exception: return False
 
     def update_user(self, user_id, data):
@@ -174,31 +429,27 @@ class SchoolDB:
                 cursor.execute("UPDATE Utilisateur SET Nom=?, Prenom=?, Email=? WHERE UserID=?", (data['nom'], data['prenom'], data['email'], user_id))
             if data['role'] == 'Etudiant': cursor.execute("UPDATE Etudiant SET CNE=?, GroupeID=? WHERE EtudiantID=?", (data.get('cne'), data.get('groupe_id'), user_id))
             elif data['role'] == 'Formateur': cursor.execute("UPDATE Formateur SET Matricule=? WHERE FormateurID=?", (data.get('matricule'), user_id))
-            self.conn.commit(); return True
+            self.conn.commit()
+            if data['role'] == 'Formateur': cache.invalidate('teachers')
+            rpc_auth.revoke_user(user_id)  # cached credentials / tokens carry the old name, email, password
+            fragments.bump('users', 'tps')  # the TP list shows teacher names
+            return True
         except Exception: self.conn.rollback(); return False
 
     def delete_user(self, user_id):
         try:
             self.conn.cursor().execute("DELETE FROM Utilisateur WHERE UserID=?", (user_id,))
-            self.conn.commit(); return True
+            self.conn.commit()
+            cache.invalidate('teachers'); self._invalidate_teacher(user_id)
+            rpc_auth.revoke_user(user_id)
+            fragments.bump('users', 'tps')
+            return True
         except Exception: return False
 
     def get_user_details(self, user_id):
         if not self.conn: return None
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM Utilisateur WHERE UserID = ?", (user_id,))
-        u = cursor.fetchone()
-        if not u: return None
-        data = {"id": u.UserID, "nom": u.Nom, "prenom": u.Prenom, "email": u.Email, "role": u.Role, "cne":"", "matricule":"", "groupe_id":""}
-        if u.Role == 'Etudiant':
-            cursor.execute("SELECT CNE, GroupeID FROM Etudiant WHERE EtudiantID=?", (user_id,))
-            ext = cursor.fetchone()
-            if ext: data.update({'cne': ext.CNE, 'groupe_id': ext.GroupeID})
-        elif u.Role == 'Formateur':
-            cursor.execute("SELECT Matricule FROM Formateur WHERE FormateurID=?", (user_id,))
-            ext = cursor.fetchone()
-            if ext: data.update({'matricule': ext.Matricule})
-        return data
+        users = self._rows(queries.USER_DETAILS, (user_id,))
+        return users[0] if users else None
 
     # --- 3. FIX: GLOBAL TPs (Use LEFT JOIN) ---
     # Ensure this def is aligned with other methods like get_absent_report
@@ -206,195 +457,543 @@ class SchoolDB:
         """ Fetches all TPs for the Admin Global Content tab with high reliability. """
         if not self.conn: 
             return []
-        
-        with self.conn.cursor() as cursor:
-            # Using LEFT JOIN ensures TPs show up even if a Group/Module was deleted
-            sql = """
-                SELECT TP.TPID, TP.Titre, TP.DateLimite, 
-                       ISNULL(G.NomGroupe, 'No Group') as GroupName, 
-                       ISNULL(M.NomModule, 'General') as ModuleName, 
-                       ISNULL(U.Nom, 'System') as Nom, 
-                       ISNULL(U.Prenom, 'Admin') as Prenom
-                FROM TP 
-                LEFT JOIN Groupe G ON TP.GroupeID = G.GroupeID 
-                LEFT JOIN Module M ON TP.ModuleID = M.ModuleID 
-                LEFT JOIN Utilisateur U ON TP.FormateurID = U.UserID
-                ORDER BY TP.DateLimite DESC
-            """
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            
-            return [{
-                "id": r.TPID, 
-                "titre": r.Titre, 
-                "deadline": str(r.DateLimite)[:16] if r.DateLimite else "No Deadline", 
-                "group": r.GroupName, 
-                "module": r.ModuleName, 
-                "teacher": f"{r.Nom} {r.Prenom}"
-            } for r in rows]
+        # LEFT JOINs: TPs show up even if a Group/Module was deleted (queries.TPS_GLOBAL)
+        return self._rows(queries.TPS_GLOBAL)
 
     def get_presence_stats(self, formateur_id=None):
+        """ Daily rate per group, read from the PresenceAgg rollup """
         if not self.conn: return []
-        with self.conn.cursor() as cursor:
-            where_sql = "WHERE S.FormateurID = ?" if formateur_id else ""
-            sql = f"""
-                SELECT CAST(S.DateDebut AS DATE) as Day, 
-                       ISNULL(G.NomGroupe, 'N/A') as GroupName, 
-                       COUNT(CASE WHEN LOWER(P.Etat) = 'present' THEN 1 END) as Present, 
-                       COUNT(P.PresenceID) as Total
-                FROM Seance S 
-                LEFT JOIN Groupe G ON S.GroupeID = G.GroupeID 
-                LEFT JOIN Presence P ON S.SeanceID = P.SeanceID 
-                {where_sql} 
-                GROUP BY CAST(S.DateDebut AS DATE), G.NomGroupe
-            """
-            if formateur_id: cursor.execute(sql, (formateur_id,))
-            else: cursor.execute(sql)
-            
-            rows = cursor.fetchall()
-            return [{"date": str(r.Day), "group": r.GroupName, "rate": round((r.Present/r.Total*100), 1) if r.Total > 0 else 0} for r in rows]
+        if formateur_id: return self._rows(queries.PRESENCE_STATS, (formateur_id,), 'teacher')
+        return self._rows(queries.PRESENCE_STATS, (), 'all')
 
-    def get_absent_report(self, formateur_id=None):
+    def get_absent_report(self, formateur_id=None, limit=ABSENT_REPORT_ROWS):
+        """ The `limit` student/module rows with the most absences (None = all). Counts come from
+            AbsenceCounter; the dates are then read for the students of those rows only """
         if not self.conn: return []
-        with self.conn.cursor() as cursor:
-            where_sql = "AND S.FormateurID = ?" if formateur_id else ""
-            sql = f"""
-                SELECT U.Nom, U.Prenom, E.CNE, G.NomGroupe, M.NomModule, S.DateDebut 
-                FROM Presence P 
-                JOIN Seance S ON P.SeanceID = S.SeanceID 
-                JOIN Etudiant E ON P.EtudiantID = E.EtudiantID 
-                JOIN Utilisateur U ON E.EtudiantID = U.UserID 
-                LEFT JOIN Groupe G ON S.GroupeID = G.GroupeID 
-                LEFT JOIN Module M ON S.ModuleID = M.ModuleID 
-                WHERE LOWER(P.Etat) = 'absent' {where_sql}
-            """
-            if formateur_id: cursor.execute(sql, (formateur_id,))
-            else: cursor.execute(sql)
-            
-            rows = cursor.fetchall()
-            rep = {}
-            for r in rows:
-                k = f"{r.CNE}-{r.NomModule}"
-                if k not in rep: rep[k] = {"name": f"{r.Nom} {r.Prenom}", "cne": r.CNE, "group": r.NomGroupe, "module": r.NomModule, "count": 0, "dates": []}
-                rep[k]["count"] += 1; rep[k]["dates"].append(r.DateDebut.strftime("%d %b"))
-            return sorted(list(rep.values()), key=lambda x: x['count'], reverse=True)
+        variant, params = ('teacher', (formateur_id,)) if formateur_id else ('all', ())
+        rep = {}
+        for sid, mid, name, cne, group, module, cnt in queries.iter_rows(self._query(queries.ABSENCE_COUNTS, params, variant)):
+            item = rep.get((sid, mid))
+            if item is None:
+                item = rep[(sid, mid)] = {"name": name, "cne": cne, "group": group, "module": module, "count": 0, "dates": []}
+            item["count"] += cnt
+        top = sorted(rep, key=lambda k: rep[k]['count'], reverse=True)[:limit]
+        if not top: return []
+
+        for sid, mid, fid, shown in self._query_ids(queries.ABSENCE_DATES, sorted({sid for sid, _ in top})):
+            if formateur_id and str(fid) != str(formateur_id): continue
+            item = rep.get((sid, mid))
+            if item: item["dates"].append(shown)
+        return [rep[k] for k in top]
+
+    def rebuild_attendance_aggregates(self):
+        """ Regenerates PresenceAgg and AbsenceCounter from scratch in one transaction """
+        if not self.conn: return False
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("DELETE FROM PresenceAgg")
+            cursor.execute("DELETE FROM AbsenceCounter")
+            cursor.execute("""
+                INSERT INTO PresenceAgg (Jour, GroupeID, FormateurID, ModuleID, Presents, Total)
+                SELECT CAST(S.DateDebut AS DATE), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0), ISNULL(S.ModuleID, 0),
+                       SUM(CASE WHEN P.Etat = 'Present' THEN 1 ELSE 0 END), COUNT(*)
+                FROM Presence P JOIN Seance S ON P.SeanceID = S.SeanceID
+                GROUP BY CAST(S.DateDebut AS DATE), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0), ISNULL(S.ModuleID, 0)
+            """)
+            cursor.execute("""
+                INSERT INTO AbsenceCounter (EtudiantID, ModuleID, GroupeID, FormateurID, Absences)
+                SELECT P.EtudiantID, ISNULL(S.ModuleID, 0), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0), COUNT(*)
+                FROM Presence P JOIN Seance S ON P.SeanceID = S.SeanceID
+                WHERE P.Etat = 'Absent'
+                GROUP BY P.EtudiantID, ISNULL(S.ModuleID, 0), ISNULL(S.GroupeID, 0), ISNULL(S.FormateurID, 0)
+            """)
+            self.conn.commit()
+            cache.invalidate('analytics')
+            return True
+        except Exception as e:
+            logger.error(f"❌ Aggregate rebuild error: {e}")
+            self.conn.rollback(); return False
         
+    # --- EXPORTS (streamed by exports.py: header row, then data rows via fetchmany) ---
+    def _stream_rows(self, cursor, header):
+        yield header
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH)
+            if not rows: break
+            yield from (tuple(r) for r in rows)
+
+    def export_attendance(self, date_from, date_to, group_id=None, formateur_id=None):
+        """ One row per student per séance in [date_from, date_to] (dates as 'YYYY-MM-DD') """
+        where, params = ["S.DateDebut >= ?", "S.DateDebut < DATEADD(day, 1, ?)"], [date_from, date_to]
+        if group_id: where.append("S.GroupeID = ?"); params.append(group_id)
+        if formateur_id: where.append("S.FormateurID = ?"); params.append(formateur_id)
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT S.DateDebut, G.NomGroupe, M.NomModule, CONCAT(T.Nom, ' ', T.Prenom), U.Nom, U.Prenom, E.CNE, P.Etat
+            FROM Seance S
+            JOIN Presence P ON P.SeanceID = S.SeanceID
+            JOIN Etudiant E ON P.EtudiantID = E.EtudiantID
+            JOIN Utilisateur U ON E.EtudiantID = U.UserID
+            LEFT JOIN Utilisateur T ON S.FormateurID = T.UserID
+            LEFT JOIN Groupe G ON S.GroupeID = G.GroupeID
+            LEFT JOIN Module M ON S.ModuleID = M.ModuleID
+            WHERE {' AND '.join(where)}
+            ORDER BY S.DateDebut, G.NomGroupe, U.Nom, U.Prenom
+        """, params)
+        return self._stream_rows(cursor, ('Date', 'Group', 'Module', 'Formateur', 'Nom', 'Prenom', 'CNE', 'Status'))
+
+    def export_absences(self, formateur_id=None, group_id=None):
+        """ Absence totals per student and module, from the AbsenceCounter rollup """
+        where, params = ["C.Absences > 0"], []
+        if formateur_id: where.append("C.FormateurID = ?"); params.append(formateur_id)
+        if group_id: where.append("C.GroupeID = ?"); params.append(group_id)
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT G.NomGroupe, U.Nom, U.Prenom, E.CNE, M.NomModule, SUM(C.Absences) AS Cnt
+            FROM AbsenceCounter C
+            JOIN Etudiant E ON C.EtudiantID = E.EtudiantID
+            JOIN Utilisateur U ON E.EtudiantID = U.UserID
+            LEFT JOIN Groupe G ON C.GroupeID = G.GroupeID
+            LEFT JOIN Module M ON C.ModuleID = M.ModuleID
+            WHERE {' AND '.join(where)}
+            GROUP BY G.NomGroupe, U.Nom, U.Prenom, E.CNE, M.NomModule
+            ORDER BY G.NomGroupe, U.Nom, U.Prenom, M.NomModule
+        """, params)
+        return self._stream_rows(cursor, ('Group', 'Nom', 'Prenom', 'CNE', 'Module', 'Absences'))
+
+    def export_grades(self, tp_id, formateur_id=None):
+        """ Grade sheet of a TP: every student of its group, with or without a submission """
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT U.Nom, U.Prenom, E.CNE, S.DateSoumission, S.Note, S.Commentaire, S.FichierNom
+            FROM TP
+            JOIN Etudiant E ON E.GroupeID = TP.GroupeID
+            JOIN Utilisateur U ON E.EtudiantID = U.UserID
+            LEFT JOIN Soumission S ON S.TPID = TP.TPID AND S.EtudiantID = E.EtudiantID
+            WHERE TP.TPID = ? {'AND TP.FormateurID = ?' if formateur_id else ''}
+            ORDER BY U.Nom, U.Prenom
+        """, (tp_id, formateur_id) if formateur_id else (tp_id,))
+        return self._stream_rows(cursor, ('Nom', 'Prenom', 'CNE', 'Submitted', 'Grade', 'Comment', 'File'))
+
     def get_global_kpis(self, formateur_id=None):
         if not self.conn: return {"total_sessions": 0, "avg_rate": 0}
-        cursor = self.conn.cursor()
-        where_sql = "WHERE FormateurID = ?" if formateur_id else ""
-        
         if formateur_id:
-            cursor.execute(f"SELECT COUNT(*) FROM Seance {where_sql}", (formateur_id,))
+            total = self._query(queries.SEANCE_COUNT, (formateur_id,), 'teacher').fetchone()[0]
         else:
-            cursor.execute(f"SELECT COUNT(*) FROM Seance {where_sql}")
-            
-        total = cursor.fetchone()[0]
+            total = self._query(queries.SEANCE_COUNT, (), 'all').fetchone()[0]
         return {"total_sessions": total, "avg_rate": 0}
 
     # --- 5. TPs & BLOBs ---
     def create_tp_with_blob(self, titre, desc, f_bytes, f_name, f_type, deadline, mid, fid, gid):
+        return bool(self.create_tp_stream(titre, desc, iter_chunks(f_bytes), f_name, f_type, deadline, mid, fid, gid))
+
+    def create_tp_stream(self, titre, desc, chunks, f_name, f_type, deadline, mid, fid, gid):
+        """ Inserts a TP with its file (blob store, or appended chunk by chunk in the DB). Returns the TPID or None """
         cursor = self.conn.cursor()
         try:
-            sql = "INSERT INTO TP (Titre, Description, FichierData, FichierNom, FichierType, DateLimite, ModuleID, FormateurID, GroupeID) VALUES (?,?,?,?,?,?,?,?,?)"
-            cursor.execute(sql, (titre, desc, pyodbc.Binary(f_bytes), f_name, f_type, deadline.replace('T', ' '), mid, fid, gid))
-            self.conn.commit(); return True
-        except Exception: return False
+            blob = self._put_blob(chunks)
+            sql = f"INSERT INTO TP (Titre, Description, FichierData, FichierHash, FichierNom, FichierType, DateLimite, ModuleID, FormateurID, GroupeID) OUTPUT INSERTED.TPID VALUES (?,?,{'NULL' if blob else '0x'},?,?,?,?,?,?,?)"
+            cursor.execute(sql, (titre, desc, blob[0] if blob else None, f_name, f_type, deadline.replace('T', ' '), mid, fid, gid))
+            tp_id = cursor.fetchone()[0]
+            if blob: self._ref_blob(cursor, *blob)
+            else: self._append_blob(cursor, 'tp', tp_id, chunks)
+            self.conn.commit()
+            fragments.bump('tps')
+            bus.publish('tp', {'tp_id': tp_id, 'titre': titre, 'deadline': deadline, 'module_id': mid, 'group_id': gid},
+                        [f"group:{gid}", f"teacher:{fid}", f"tp:{tp_id}"])
+            return tp_id
+        except Exception:
+            logger.exception("❌ TP upload error")
+            self.conn.rollback(); return None
 
     def get_tp_file_content(self, tp_id):
+        info = self.get_blob_info('tp', tp_id)
+        if not info: return None
+        return {"data": b''.join(self.iter_blob('tp', tp_id, 0, info["size"])), "name": info["name"]}
+
+    # Whitelisted BLOB locations: kind -> (table, key, data column, hash column, name column, type column)
+    BLOB_TABLES = {
+        'tp': ('TP', 'TPID', 'FichierData', 'FichierHash', 'FichierNom', 'FichierType'),
+        'submission': ('Soumission', 'SoumissionID', 'FichierData', 'FichierHash', 'FichierNom', 'FichierType'),
+        'annonce': ('Annonce', 'AnnonceID', 'ImageBin', 'ImageHash', 'NULL', 'NULL'),
+    }
+
+    def _put_blob(self, chunks):
+        """ Streams the file into the blob store: (sha256, size), or None when files stay in the DB """
+        store = get_blob_store()
+        return store.put_stream(chunks) if store else None
+
+    def _ref_blob(self, cursor, sha, size, delta=1):
+        cursor.execute("""
+            MERGE Blob WITH (HOLDLOCK) AS T
+            USING (SELECT ? AS Hash, ? AS Taille) AS S ON T.Hash = S.Hash
+            WHEN MATCHED THEN UPDATE SET RefCount = T.RefCount + ?
+            WHEN NOT MATCHED THEN INSERT (Hash, Taille, RefCount) VALUES (S.Hash, S.Taille, ?);
+        """, (sha, size, delta, max(delta, 0)))
+
+    def _append_blob(self, cursor, kind, row_id, chunks):
+        """ Appends each chunk with varbinary(max).WRITE so only one chunk is in flight """
+        table, key, data = self.BLOB_TABLES[kind][:3]
+        sql = f"UPDATE {table} SET {data}.WRITE(?, NULL, NULL) WHERE {key}=?"
+        for chunk in chunks:
+            cursor.execute(sql, (pyodbc.Binary(chunk), row_id))
+
+    def get_blob_info(self, kind, row_id):
+        """ Size, name, type and content hash of a stored file without reading its content """
+        table, key, data, hcol, name, ftype = self.BLOB_TABLES[kind]
         cursor = self.conn.cursor()
-        cursor.execute("SELECT FichierData, FichierNom FROM TP WHERE TPID=?", (tp_id,))
+        cursor.execute(f"SELECT ISNULL(B.Taille, DATALENGTH(T.{data})), {name}, {ftype}, T.{hcol} FROM {table} T LEFT JOIN Blob B ON B.Hash = T.{hcol} WHERE T.{key}=?", (row_id,))
         row = cursor.fetchone()
-        return {"data": row.FichierData, "name": row.FichierNom} if row else None
+        if not row: return None
+        return {"size": row[0] or 0, "name": row[1], "type": row[2], "hash": row[3]}
+
+    def can_read_file(self, kind, row_id, user):
+        """ Whether user ({'id', 'role'}) may download this file: Direction always, otherwise see queries.FILE_ACCESS """
+        if not user or kind not in self.BLOB_TABLES: return False
+        if user.get('role') == 'Direction': return True
+        uid = user['id']
+        return self._query(queries.FILE_ACCESS, (row_id, uid, uid, uid), kind).fetchone()[0] > 0
+
+    def can_manage_seance(self, seance_id, user):
+        """ Whether user may read and mark this séance's attendance (Direction, or see queries.SEANCE_ACCESS) """
+        if not user: return False
+        if user.get('role') == 'Direction': return True
+        return self._query(queries.SEANCE_ACCESS, (seance_id, user['id'], user['id'])).fetchone()[0] > 0
+
+    def teaches_group(self, group_id, user):
+        """ Whether user may follow this group's events (Direction, or see queries.GROUP_ACCESS) """
+        if not user: return False
+        if user.get('role') == 'Direction': return True
+        uid = user['id']
+        return self._query(queries.GROUP_ACCESS, (uid, group_id, uid, group_id)).fetchone()[0] > 0
+
+    def iter_blob(self, kind, row_id, start=0, end=None, chunk_size=None):
+        """ Yields bytes [start, end) of a stored file: mmap reads from the blob store,
+            or BLOB_CHUNK bytes per round trip for files still in the DB """
+        table, key, data = self.BLOB_TABLES[kind][:3]
+        chunk_size = chunk_size or BLOB_CHUNK
+        info = self.get_blob_info(kind, row_id)
+        if not info: return
+        end = info["size"] if end is None else min(end, info["size"])
+        store = get_blob_store()
+        if info["hash"] and store:
+            yield from store.iter_range(info["hash"], info["size"], start, end, chunk_size)
+            return
+        cursor = self.conn.cursor()
+        sql = f"SELECT SUBSTRING({data}, ?, ?) FROM {table} WHERE {key}=?"
+        pos = start
+        while pos < end:
+            n = min(chunk_size, end - pos)
+            cursor.execute(sql, (pos + 1, n, row_id))  # SUBSTRING is 1-based
+            row = cursor.fetchone()
+            if not row or not row[0]: break
+            yield bytes(row[0])
+            pos += len(row[0])
+
+    # --- BLOB STORE MAINTENANCE (see migrate_blobs.py) ---
+    def migrate_blob_to_store(self, kind, row_id):
+        """ Moves one in-DB file into the blob store and clears the column. Returns the hash or None """
+        store = get_blob_store()
+        table, key, data, hcol = self.BLOB_TABLES[kind][:4]
+        try:
+            sha, size = store.put_stream(self.iter_blob(kind, row_id))
+            cursor = self.conn.cursor()
+            cursor.execute(f"UPDATE {table} SET {hcol}=?, {data}=NULL WHERE {key}=? AND {hcol} IS NULL", (sha, row_id))
+            if cursor.rowcount: self._ref_blob(cursor, sha, size)
+            self.conn.commit(); return sha
+        except Exception as e:
+            logger.error(f"❌ Blob migration error ({kind} {row_id}): {e}")
+            self.conn.rollback(); return None
 
-    def get_tps_for_student(self, gid):
+    def iter_unmigrated_blobs(self, kind):
+        table, key, data, hcol = self.BLOB_TABLES[kind][:4]
         cursor = self.conn.cursor()
-        cursor.execute("SELECT TPID, Titre, Description, DateLimite, NomModule FROM TP JOIN Module ON TP.ModuleID=Module.ModuleID WHERE GroupeID=? ORDER BY DateLimite DESC", (gid,))
-        return [{"id": r.TPID, "titre": r.Titre, "description": r.Description, "deadline": str(r.DateLimite), "module": r.NomModule} for r in cursor.fetchall()]
+        cursor.execute(f"SELECT {key} FROM {table} WHERE {data} IS NOT NULL AND {hcol} IS NULL")
+        return [r[0] for r in cursor.fetchall()]
+
+    def collect_blobs(self, grace_seconds=3600):
+        """ Recounts references, drops unreferenced Blob rows older than the grace period
+            and returns their (hash, size) so the caller can delete the files """
+        cursor = self.conn.cursor()
+        try:
+            refs = " + ".join(f"(SELECT COUNT(*) FROM {t[0]} WHERE {t[3]} = Blob.Hash)" for t in self.BLOB_TABLES.values())
+            cursor.execute(f"UPDATE Blob SET RefCount = {refs}")
+            cursor.execute("DELETE FROM Blob OUTPUT DELETED.Hash, DELETED.Taille WHERE RefCount = 0 AND CreeLe < DATEADD(second, -?, GETDATE())", (grace_seconds,))
+            dead = [(r[0], r[1]) for r in cursor.fetchall()]
+            cursor.execute("SELECT Hash FROM Blob")
+            live = {r[0] for r in cursor.fetchall()}
+            self.conn.commit()
+            return dead, live
+        except Exception as e:
+            logger.error(f"❌ Blob GC error: {e}")
+            self.conn.rollback(); return [], None
+
+    def blob_referenced(self, sha):
+        """ Whether a committed row points to this hash (checked again right before a file is deleted) """
+        cursor = self.conn.cursor()
+        refs = " UNION ALL ".join(f"SELECT 1 FROM {t[0]} WHERE {t[3]} = ?" for t in self.BLOB_TABLES.values())
+        cursor.execute(f"SELECT COUNT(*) FROM ({refs}) R", (sha,) * len(self.BLOB_TABLES))
+        return cursor.fetchone()[0] > 0
+
+    def get_tps_for_student(self, gid):
+        return self._rows(queries.STUDENT_TPS, (gid,))
+
+    def get_student_tps_since(self, student_id, since=0):
+        """ One round trip: group lookup + TPs of that group changed after the `since` rowversion.
+            Returns (tps, cursor); an unchanged poll is a single seek on IX_TP_Groupe_RowVer """
+        if not self.conn: return [], since
+        since = int(since or 0)
+        rows = list(queries.iter_rows(self._query(queries.STUDENT_TPS_SINCE, (student_id, since))))
+        project = queries.STUDENT_TPS_SINCE.project
+        return [project(r) for r in rows], max([r[5] for r in rows], default=since)
 
     def submit_rapport_file(self, tpid, uid, f_bytes, f_name, f_type):
+        return bool(self.submit_rapport_stream(tpid, uid, iter_chunks(f_bytes), f_name, f_type))
+
+    def submit_rapport_stream(self, tpid, uid, chunks, f_name, f_type):
+        """ Inserts a submission with its file (blob store, or appended chunk by chunk in the DB). Returns the SoumissionID or None """
         cursor = self.conn.cursor()
         try:
-            sql = "INSERT INTO Soumission (TPID, EtudiantID, FichierData, FichierNom, FichierType, DateSoumission) VALUES (?,?,?,?,?,GETDATE())"
-            cursor.execute(sql, (tpid, uid, pyodbc.Binary(f_bytes), f_name, f_type))
-            self.conn.commit(); return True
-        except Exception: return False
+            blob = self._put_blob(chunks)
+            sql = f"INSERT INTO Soumission (TPID, EtudiantID, FichierData, FichierHash, FichierNom, FichierType, DateSoumission) OUTPUT INSERTED.SoumissionID VALUES (?,?,{'NULL' if blob else '0x'},?,?,?,GETDATE())"
+            cursor.execute(sql, (tpid, uid, blob[0] if blob else None, f_name, f_type))
+            sid = cursor.fetchone()[0]
+            if blob: self._ref_blob(cursor, *blob)
+            else: self._append_blob(cursor, 'submission', sid, chunks)
+            cursor.execute("SELECT FormateurID FROM TP WHERE TPID=?", (tpid,))
+            owner = cursor.fetchone()
+            self.conn.commit()
+            bus.publish('submission', {'submission_id': sid, 'tp_id': tpid, 'student_id': uid, 'file_name': f_name},
+                        [f"tp:{tpid}", f"student:{uid}"] + ([f"teacher:{owner[0]}"] if owner else []))
+            return sid
+        except Exception:
+            logger.exception("❌ Submission upload error")
+            self.conn.rollback(); return None
 
     def get_submissions_for_tp(self, tpid):
-        cursor = self.conn.cursor()
-        sql = "SELECT S.SoumissionID, U.Nom, U.Prenom, S.DateSoumission, S.Note, S.FichierNom FROM Soumission S JOIN Utilisateur U ON S.EtudiantID=U.UserID WHERE S.TPID=? ORDER BY U.Nom"
-        cursor.execute(sql, (tpid,))
-        return [{"id": r.SoumissionID, "student": f"{r.Nom} {r.Prenom}", "date": r.DateSoumission.strftime("%d %b %H:%M"), "grade": r.Note if r.Note is not None else "", "file_name": r.FichierNom} for r in cursor.fetchall()]
+        return self._rows(queries.SUBMISSIONS_FOR_TP, (tpid,))
 
     def save_grade(self, sid, grade):
+        return self.save_grades(None, [{'submission_id': sid, 'grade': grade}])[0]['result'] == 'updated'
+
+    @staticmethod
+    def _grade_value(value):
+        """ Grade as a float in [0, GRADE_MAX] (accepts '12,5'), or None if invalid """
         try:
-            self.conn.cursor().execute("UPDATE Soumission SET Note=? WHERE SoumissionID=?", (grade, sid))
-            self.conn.commit(); return True
-        except Exception: return False
+            grade = float(str(value).replace(',', '.'))
+        except (TypeError, ValueError):
+            return None
+        return grade if 0 <= grade <= GRADE_MAX else None
+
+    def save_grades(self, tp_id, grades):
+        """ Grades several submissions of one TP in ONE set-based UPDATE and one transaction.
+        grades: [{'submission_id', 'grade', 'comment' (optional)}] or [sid, grade, comment?] lists.
+        tp_id=None skips the TP check. Returns [{'submission_id', 'result'}] with result in
+        updated/invalid/not_found/error (not_found: no such submission for this TP) """
+        results, rows = [], {}
+        for g in grades:
+            if isinstance(g, dict):
+                sid, grade, comment = g.get('submission_id'), g.get('grade'), g.get('comment')
+            else:
+                sid, grade, comment = (list(g) + [None, None, None])[:3]
+            value = self._grade_value(grade)
+            try:
+                sid = int(sid)
+            except (TypeError, ValueError):
+                value = None
+            if value is None:
+                results.append({'submission_id': sid, 'result': 'invalid'})
+                continue
+            rows[sid] = (value, str(comment)[:1000] if comment not in (None, '') else None)  # last entry wins
+        if not rows: return results
+        if not self.conn:
+            return results + [{'submission_id': sid, 'result': 'error'} for sid in rows]
 
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("IF OBJECT_ID('tempdb..#GradeStage') IS NOT NULL DROP TABLE #GradeStage")
+            cursor.execute("CREATE TABLE #GradeStage (SoumissionID INT NOT NULL PRIMARY KEY, Note DECIMAL(5,2) NOT NULL, Commentaire NVARCHAR(1000) NULL)")
+            cursor.fast_executemany = True
+            cursor.executemany("INSERT INTO #GradeStage (SoumissionID, Note, Commentaire) VALUES (?,?,?)",
+                               [(sid, v[0], v[1]) for sid, v in rows.items()])
+            cursor.fast_executemany = False
+            cursor.execute(f"""
+                UPDATE S SET Note = G.Note, Commentaire = ISNULL(G.Commentaire, S.Commentaire)
+                OUTPUT INSERTED.SoumissionID, INSERTED.TPID, INSERTED.EtudiantID
+                FROM Soumission S JOIN #GradeStage G ON S.SoumissionID = G.SoumissionID
+                {'WHERE S.TPID = ?' if tp_id is not None else ''}
+            """, (tp_id,) if tp_id is not None else ())
+            updated = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+            cursor.execute("DROP TABLE #GradeStage")
+            self.conn.commit()
+        except Exception:
+            logger.exception("❌ Grading error")
+            self.conn.rollback()
+            return results + [{'submission_id': sid, 'result': 'error'} for sid in rows]
+        # Committed: from here on a failure must not turn the rows into errors
+        try:
+            # Grades go to the student and the TP's teacher only (tp:/group: topics are shared with the class)
+            owners = dict(self._query_ids(queries.TP_OWNERS, {tpid for tpid, _ in updated.values()}))
+            for sid, (tpid, uid) in updated.items():
+                bus.publish('grade', {'submission_id': sid, 'tp_id': tpid, 'student_id': uid, 'grade': rows[sid][0]},
+                            [f"student:{uid}"] + ([f"teacher:{owners[tpid]}"] if tpid in owners else []))
+        except Exception as e:
+            logger.error(f"❌ Grade events not published: {e}")
+        return results + [{'submission_id': sid, 'result': 'updated' if sid in updated else 'not_found'} for sid in rows]
+
+    @cached('teacher_modules')
     def get_teacher_modules(self, formateur_id):
         """ Fetches the classes a teacher is assigned to """
         if not self.conn: return []
-        with self.conn.cursor() as cursor:
-            sql = """
-                SELECT M.ModuleID, M.NomModule, G.GroupeID, G.NomGroupe 
-                FROM Affectation A 
-                JOIN Module M ON A.ModuleID = M.ModuleID 
-                JOIN Groupe G ON A.GroupeID = G.GroupeID 
-                WHERE A.FormateurID = ?
-            """
-            cursor.execute(sql, (formateur_id,))
-            return [{"module_id": r.ModuleID, "module_name": r.NomModule, 
-                     "group_id": r.GroupeID, "group_name": r.NomGroupe} for r in cursor.fetchall()]
+        return self._rows(queries.TEACHER_MODULES, (formateur_id,))
+
     
     def get_formateur_history_mixed(self, formateur_id):
         """ Fetches both TPs and Announcements for the teacher's history table """
         if not self.conn: return []
-        with self.conn.cursor() as cursor:
-            sql = """
-                SELECT TPID as ID, Titre, DateLimite as D, 'TP' as T, G.NomGroupe, M.NomModule 
-                FROM TP 
-                LEFT JOIN Groupe G ON TP.GroupeID = G.GroupeID 
-                LEFT JOIN Module M ON TP.ModuleID = M.ModuleID 
-                WHERE FormateurID = ?
-                UNION ALL
-                SELECT AnnonceID, Titre, DatePublication, 'Annonce', G.NomGroupe, M.NomModule 
-                FROM Annonce 
-                LEFT JOIN Groupe G ON Annonce.GroupeID = G.GroupeID 
-                LEFT JOIN Module M ON Annonce.ModuleID = M.ModuleID 
-                WHERE FormateurID = ?
-                ORDER BY D DESC
-            """
-            cursor.execute(sql, (formateur_id, formateur_id))
-            return [{"id": r.ID, "title": r.Titre, "date": str(r.D)[:16], "type": r.T, 
-                     "group": r.NomGroupe or "N/A", "module": r.NomModule or "N/A"} for r in cursor.fetchall()]
+        return self._rows(queries.FORMATEUR_HISTORY, (formateur_id, formateur_id))
+
     
     def create_annonce(self, titre, contenu, image_bytes, formateur_id, groupe_id, module_id):
         try:
-            sql = "INSERT INTO Annonce (Titre, Contenu, ImageBin, FormateurID, GroupeID, ModuleID, DatePublication) VALUES (?,?,?,?,?,?,GETDATE())"
-            self.conn.cursor().execute(sql, (titre, contenu, pyodbc.Binary(image_bytes) if image_bytes else None, formateur_id, groupe_id, module_id))
-            self.conn.commit(); return True
-        except Exception: return False
+            cursor = self.conn.cursor()
+            blob = self._put_blob(iter_chunks(image_bytes)) if image_bytes else None
+            if blob or not image_bytes:
+                sql = "INSERT INTO Annonce (Titre, Contenu, ImageHash, FormateurID, GroupeID, ModuleID, DatePublication) OUTPUT INSERTED.AnnonceID VALUES (?,?,?,?,?,?,GETDATE())"
+                cursor.execute(sql, (titre, contenu, blob[0] if blob else None, formateur_id, groupe_id, module_id))
+                aid = cursor.fetchone()[0]
+                if blob: self._ref_blob(cursor, *blob)
+            else:
+                sql = "INSERT INTO Annonce (Titre, Contenu, ImageBin, FormateurID, GroupeID, ModuleID, DatePublication) OUTPUT INSERTED.AnnonceID VALUES (?,?,?,?,?,?,GETDATE())"
+                cursor.execute(sql, (titre, contenu, pyodbc.Binary(image_bytes), formateur_id, groupe_id, module_id))
+                aid = cursor.fetchone()[0]
+            self.conn.commit()
+            bus.publish('annonce', {'annonce_id': aid, 'titre': titre, 'group_id': groupe_id, 'module_id': module_id},
+                        [f"group:{groupe_id}", f"teacher:{formateur_id}"])
+            return True
+        except Exception:
+            self.conn.rollback(); return False
 
     def get_or_create_seance(self, fid, gid, mid, date_str):
+        """ SeanceID of the teacher's séance for (group, module, day), created if missing.
+            Known slots come from seance_index; otherwise one index seek, then one atomic insert """
+        day = datetime.date.fromisoformat(str(date_str)[:10]).isoformat()
+        if not _seance_index_warm: self.warm_seance_index()
+        key = make_key('seance', (fid, gid, mid, day))
+        sid = seance_index.get(key, None)
+        if sid is not None: return sid
+        row = self._query(queries.SEANCE_LOOKUP, (fid, gid, mid, day, day)).fetchone()
+        for attempt in range(2):
+            if row is not None: break
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(SEANCE_UPSERT_SQL, (f"{day} 08:00:00", f"{day} 10:00:00", mid, fid, gid, fid, gid, mid, day, day))
+                row = cursor.fetchone()
+                if row is None:  # created by someone else since the lookup
+                    row = self._query(queries.SEANCE_LOOKUP, (fid, gid, mid, day, day)).fetchone()
+                else:
+                    cache.invalidate('analytics')  # total_sessions KPI changed
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback(); raise
+        if row is None:  # the other creator's séance is gone again (manual delete): give up
+            raise LookupError(f"séance of teacher {fid}, group {gid}, module {mid} on {day} could not be created")
+        seance_index.set(key, row[0])
+        return row[0]
+
+    def warm_seance_index(self, days=SEANCE_INDEX_DAYS):
+        """ Loads the séances from `days` ago to `days` ahead into seance_index (startup) """
+        global _seance_index_warm
+        today = datetime.date.today()
+        window = (str(today - datetime.timedelta(days=days)), str(today + datetime.timedelta(days=days + 1)))
+        n = 0
+        for sid, fid, gid, mid, day in queries.iter_rows(self._query(queries.SEANCE_WINDOW, window)):
+            seance_index.set(make_key('seance', (fid, gid, mid, day)), sid)
+            n += 1
+        _seance_index_warm = True
+        return n
+
+    def pregenerate_seances(self, date_from, date_to, weekdays=None, formateur_id=None, group_id=None):
+        """ Creates the missing séances of every assignment (or one teacher's / group's) for the
+            selected weekdays (0 = Monday) between two dates, in one transaction.
+            Returns {'created', 'from', 'to'}, or None on error """
+        start, end = datetime.date.fromisoformat(str(date_from)[:10]), datetime.date.fromisoformat(str(date_to)[:10])
+        if end < start or (end - start).days > PREGENERATE_MAX_DAYS:
+            raise ValueError(f"date range must be 0..{PREGENERATE_MAX_DAYS} days")
+        mask = sum(1 << int(d) for d in set(SEANCE_WEEKDAYS if weekdays is None else weekdays) if 0 <= int(d) <= 6)
         cursor = self.conn.cursor()
-        cursor.execute("SELECT SeanceID FROM Seance WHERE FormateurID=? AND GroupeID=? AND ModuleID=? AND CAST(DateDebut AS DATE)=?", (fid, gid, mid, date_str))
-        row = cursor.fetchone()
-        if row: return row[0]
-        cursor.execute("INSERT INTO Seance (DateDebut, DateFin, Salle, ModuleID, FormateurID, GroupeID) VALUES (?,?,'Virtual',?,?,?)", (f"{date_str} 08:00:00", f"{date_str} 10:00:00", mid, fid, gid))
-        self.conn.commit(); cursor.execute("SELECT @@IDENTITY"); return cursor.fetchone()[0]
+        try:
+            cursor.execute(SEANCE_PREGENERATE_SQL, (start.isoformat(), end.isoformat(), mask,
+                                                    formateur_id, formateur_id, group_id, group_id))
+            rows = cursor.fetchall()
+            self.conn.commit()
+        except Exception:
+            logger.exception("❌ Séance pre-generation error")
+            self.conn.rollback(); return None
+        for sid, fid, gid, mid, debut in rows:
+            seance_index.set(make_key('seance', (fid, gid, mid, str(debut)[:10])), sid)
+        if rows: cache.invalidate('analytics')
+        return {'created': len(rows), 'from': start.isoformat(), 'to': end.isoformat()}
 
     def get_students_with_presence(self, gid, sid):
-        cursor = self.conn.cursor()
-        sql = "SELECT E.EtudiantID, U.Nom, U.Prenom, E.CNE, P.Etat FROM Etudiant E JOIN Utilisateur U ON E.EtudiantID=U.UserID LEFT JOIN Presence P ON E.EtudiantID=P.EtudiantID AND P.SeanceID=? WHERE E.GroupeID=? ORDER BY U.Nom"
-        cursor.execute(sql, (sid, gid))
-        return [{"id": r.EtudiantID, "name": f"{r.Nom} {r.Prenom}", "cne": r.CNE, "status": r.Etat or "Pending"} for r in cursor.fetchall()]
+        return self._rows(queries.STUDENTS_WITH_PRESENCE, (sid, gid))
 
     def save_bulk_presence(self, sid, p_list):
+        """ Saves one séance's attendance. Returns per-student outcomes (see save_presence_batch) """
+        return self.save_presence_batch([{'seance_id': sid, 'presence': p_list}])
+
+    def save_presence_batch(self, seances):
+        """ Upserts attendance for several séances in ONE transaction.
+        seances: [{'seance_id': .., 'presence': [{'student_id': .., 'status': ..}, ...]}, ...]
+        Returns [{'seance_id', 'student_id', 'result'}] with result in inserted/updated/invalid/error """
+        results, rows = [], {}
+        for s in seances:
+            s = s if isinstance(s, dict) else {}
+            for item in s.get('presence') or []:
+                item = item if isinstance(item, dict) else {}
+                status = str(item.get('status') or '').strip().capitalize()
+                try:
+                    key = (int(s.get('seance_id')), int(item.get('student_id')))
+                except (TypeError, ValueError):
+                    key = None
+                if not status or key is None:
+                    results.append({'seance_id': s.get('seance_id'), 'student_id': item.get('student_id'), 'result': 'invalid'})
+                    continue
+                # Last entry wins if a student is sent twice (MERGE rejects duplicate sources)
+                rows[key] = status
+        if not rows: return results
+        if not self.conn:
+            return results + [{'seance_id': k[0], 'student_id': k[1], 'result': 'error'} for k in rows]
+
         cursor = self.conn.cursor()
         try:
-            for item in p_list:
-                cursor.execute("UPDATE Presence SET Etat=?, DateEnregistrement=GETDATE() WHERE SeanceID=? AND EtudiantID=?", (item['status'], sid, item['student_id']))
-                if cursor.rowcount == 0: cursor.execute("INSERT INTO Presence (SeanceID, EtudiantID, Etat) VALUES (?,?,?)", (sid, item['student_id'], item['status']))
-            self.conn.commit(); return True
-        except Exception: return False
\ No newline at end of file
+            cursor.execute("IF OBJECT_ID('tempdb..#PresenceStage') IS NOT NULL DROP TABLE #PresenceStage")
+            cursor.execute("CREATE TABLE #PresenceStage (SeanceID INT NOT NULL, EtudiantID INT NOT NULL, Etat NVARCHAR(50) NOT NULL)")
+            cursor.fast_executemany = True
+            cursor.executemany("INSERT INTO #PresenceStage (SeanceID, EtudiantID, Etat) VALUES (?,?,?)",
+                               [(k[0], k[1], v) for k, v in rows.items()])
+            cursor.fast_executemany = False
+            cursor.execute("IF OBJECT_ID('tempdb..#PresenceDelta') IS NOT NULL DROP TABLE #PresenceDelta")
+            cursor.execute("CREATE TABLE #PresenceDelta (Action NVARCHAR(10), SeanceID INT, EtudiantID INT, Ancien NVARCHAR(50) NULL, Nouveau NVARCHAR(50))")
+            cursor.execute("""
+                MERGE Presence WITH (HOLDLOCK) AS T
+                USING #PresenceStage AS S ON T.SeanceID = S.SeanceID AND T.EtudiantID = S.EtudiantID
+                WHEN MATCHED THEN UPDATE SET Etat = S.Etat, DateEnregistrement = GETDATE()
+                WHEN NOT MATCHED THEN INSERT (SeanceID, EtudiantID, Etat) VALUES (S.SeanceID, S.EtudiantID, S.Etat)
+                OUTPUT $action, inserted.SeanceID, inserted.EtudiantID, deleted.Etat, inserted.Etat INTO #PresenceDelta;
+            """)
+            cursor.execute("SELECT Action, SeanceID, EtudiantID FROM #PresenceDelta")
+            saved = [{'seance_id': r[1], 'student_id': r[2], 'result': 'inserted' if r[0] == 'INSERT' else 'updated'}
+                     for r in cursor.fetchall()]
+            # Same transaction: fold the before/after states into the rollups
+            cursor.execute(PRESENCE_AGG_DELTA_SQL)
+            cursor.execute(ABSENCE_COUNTER_DELTA_SQL)
+            cursor.execute("DROP TABLE #PresenceStage; DROP TABLE #PresenceDelta")
+            self.conn.commit()
+        except Exception:
+            logger.exception("❌ Attendance save error")
+            self.conn.rollback()
+            return results + [{'seance_id': k[0], 'student_id': k[1], 'result': 'error'} for k in rows]
+        # Rows are only reported saved once the commit went through
+        cache.invalidate('analytics')
+        return results + saved
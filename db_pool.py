@@ -0,0 +1,315 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class BackendUnavailable(Exception):
+    """ The database cannot be reached right now (circuit open, connect failed, pool exhausted) """
+
+
+class CircuitOpen(BackendUnavailable):
+    """ Rejected without trying: the breaker is open """
+
+
+class PoolTimeout(BackendUnavailable):
+    """ Raised when no connection could be checked out before acquire_timeout """
+
+
+class CircuitBreaker:
+    """ Fails connection attempts fast once the DB looks down.
+
+    After failure_threshold consecutive connect errors the circuit opens: callers get
+    BackendUnavailable immediately and a background thread probes the server every
+    probe_interval seconds. The first successful probe closes the circuit again. """
+
+    def __init__(self, probe, failure_threshold=2, probe_interval=5):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stats = {"opens": 0, "rejected": 0, "probes": 0}
+
+    def check(self):
+        """ Raises right away while the circuit is open """
+        if self.state == 'open':
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise CircuitOpen(f"circuit open: {self.last_error}")
+
+    def call(self, fn):
+        self.check()
+        try:
+            result = fn()
+        except Exception as e:
+            self._record_failure(e)
+            raise BackendUnavailable(str(e)) from e
+        with self._lock:
+            self.failures = 0
+        return result
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == 'open' or self.failures < self.failure_threshold:
+                return
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._stats["opens"] += 1
+        logger.error(f"❌ DB circuit opened after {self.failures} failures: {error}")
+        threading.Thread(target=self._probe_loop, name="db-circuit-probe", daemon=True).start()
+
+    def _probe_loop(self):
+        while self.state == 'open':
+            time.sleep(self.probe_interval)
+            with self._lock:
+                self._stats["probes"] += 1
+            try:
+                self.probe()
+            except Exception as e:
+                self.last_error = e
+                continue
+            with self._lock:
+                self.state, self.failures = 'closed', 0
+            logger.info("✅ DB reachable again, circuit closed")
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"state": self.state, "failures": self.failures,
+                         "open_for": round(time.monotonic() - self.opened_at, 1) if self.state == 'open' else 0})
+        return data
+
+
+class PooledConnection:
+    """ A raw DB-API connection plus the bookkeeping the pool needs """
+    __slots__ = ('conn', 'created_at', 'last_used', 'cursors')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.cursors = {}  # (statement, variant) -> cursor kept prepared on this connection
+
+
+class ConnectionPool:
+    """ Thread-safe pool of DB connections (min/max size, lifetime, idle reaping) """
+
+    def __init__(self, factory, min_size=1, max_size=5, max_lifetime=1800,
+                 idle_timeout=300, acquire_timeout=15, check_after=30, breaker=None):
+        self.factory = factory
+        self.breaker = breaker
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        # Connections idle for less than this are trusted without a ping
+        self.check_after = check_after
+
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._reaper = None
+        self._closed = False
+        self._stats = {"checkouts": 0, "waits": 0, "creates": 0, "closes": 0,
+                       "timeouts": 0, "failed_checks": 0, "rollback_errors": 0}
+
+    # --- CHECKOUT / RETURN ---
+    def acquire(self):
+        """ Returns a healthy PooledConnection, creating one if below max_size """
+        if self.breaker:
+            self.breaker.check()  # don't hand out idle connections to a dead server
+        deadline = time.monotonic() + self.acquire_timeout
+        self._start_reaper()
+        while True:
+            with self._cond:
+                pooled = None
+                while pooled is None:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                    elif self._size < self.max_size:
+                        self._size += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["timeouts"] += 1
+                            raise PoolTimeout(f"no DB connection available after {self.acquire_timeout}s")
+                        self._stats["waits"] += 1
+                        self._cond.wait(remaining)
+
+            if pooled is None:
+                # A slot was reserved above: open the connection outside the lock
+                try:
+                    pooled = PooledConnection(self._create())
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self._stats["creates"] += 1
+                    self._stats["checkouts"] += 1
+                return pooled
+
+            if self._expired(pooled) or not self._healthy(pooled):
+                self._discard(pooled)
+                continue
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return pooled
+
+    def release(self, pooled, discard=False):
+        """ Rolls back any open transaction and puts the connection back """
+        if pooled is None:
+            return
+        if not discard:
+            try:
+                pooled.conn.rollback()
+            except Exception as e:
+                logger.warning(f"Pool rollback failed, dropping connection: {e}")
+                with self._cond:
+                    self._stats["rollback_errors"] += 1
+                discard = True
+        if discard or self._closed or self._expired(pooled):
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    # --- MAINTENANCE ---
+    def warm(self):
+        """ Opens connections up to min_size (used at startup) """
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = PooledConnection(self._create())
+            except Exception as e:
+                self._forget()
+                logger.error(f"Pool warm-up failed: {e}")
+                return
+            with self._cond:
+                self._stats["creates"] += 1
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def reap_idle(self):
+        """ Closes connections idle longer than idle_timeout, keeping min_size open """
+        now = time.monotonic()
+        victims = []
+        with self._cond:
+            keep = deque()
+            for pooled in self._idle:
+                too_old = now - pooled.created_at > self.max_lifetime
+                too_idle = now - pooled.last_used > self.idle_timeout
+                if (too_old or too_idle) and self._size - len(victims) > self.min_size:
+                    victims.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+        for pooled in victims:
+            self._discard(pooled)
+        return len(victims)
+
+    def close_all(self):
+        """ Closes every idle connection; checked-out ones close on release """
+        self._closed = True
+        with self._cond:
+            victims, self._idle = list(self._idle), deque()
+        for pooled in victims:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update({"size": self._size, "idle": len(self._idle),
+                         "in_use": self._size - len(self._idle),
+                         "min_size": self.min_size, "max_size": self.max_size})
+        if self.breaker:
+            data.update({f"circuit_{k}": v for k, v in self.breaker.stats().items()})
+        return data
+
+    # --- INTERNALS ---
+    def _create(self):
+        return self.breaker.call(self.factory) if self.breaker else self.factory()
+
+    def _expired(self, pooled):
+        return time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _healthy(self, pooled):
+        if time.monotonic() - pooled.last_used < self.check_after:
+            return True
+        try:
+            cursor = pooled.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.warning(f"Pool health check failed: {e}")
+            with self._cond:
+                self._stats["failed_checks"] += 1
+            return False
+
+    def _discard(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        self._forget()
+        with self._cond:
+            self._stats["closes"] += 1
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _start_reaper(self):
+        if self._reaper is not None or not self.idle_timeout:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(self.idle_timeout / 2, 5)
+        while not self._closed:
+            time.sleep(interval)
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.error(f"Pool reaper error: {e}")
+
+
+def pool_settings():
+    """ Pool sizing from the environment (.env), tuned for the Pi by default """
+    return {
+        "min_size": int(os.getenv('DB_POOL_MIN', '1')),
+        "max_size": int(os.getenv('DB_POOL_MAX', '4')),
+        "max_lifetime": float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+        "idle_timeout": float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300')),
+        "acquire_timeout": float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '15')),
+        "check_after": float(os.getenv('DB_POOL_CHECK_AFTER', '30')),
+    }
+
+
+def breaker_settings():
+    return {
+        "failure_threshold": int(os.getenv('DB_CIRCUIT_THRESHOLD', '2')),
+        "probe_interval": float(os.getenv('DB_CIRCUIT_PROBE_INTERVAL', '5')),
+    }
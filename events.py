@@ -0,0 +1,334 @@
+""" Change feed for submissions, grades, TPs and announcements.
+
+SchoolDB write paths publish an event after their commit; clients receive them through
+GET /events (Server-Sent Events) or the wait_events long-poll RPC instead of re-running
+their queries on a timer. Waiting clients hold no DB connection.
+
+Each event has topics such as 'teacher:7', 'group:3', 'tp:12', 'student:41'; a client
+subscribes to a set of topics (none = everything). Event ids are '<epoch>-<seq>', seq only
+grows, so a client resumes with its last id (SSE Last-Event-ID or `after`). If that id is
+older than the buffer (EVENTS_BUFFER events) or carries another epoch, the reply says
+reset: refetch the full state, then continue from the returned cursor.
+
+The feed is shared by the worker processes through one SQLite file (EVENTS_DB): publish()
+appends to it, and each process mirrors new rows into its in-memory buffer (one PRAGMA every
+EVENTS_POLL seconds while someone waits), so a cursor is valid on any worker. The epoch
+belongs to the file. EVENTS_BACKEND=local keeps the feed in the process (random epoch per
+process); serve.py then refuses several workers. EVENTS_FEED=0 turns the feed off.
+
+Subscribing needs a session or token. Students only get their own student: topic and
+their group's; grades are only published on the student's and the teacher's topics.
+wait_async() is the asyncio flavour of wait(): async_server serves the feed with it, so
+a waiting client holds no executor thread.
+"""
+import os
+import json
+import time
+import logging
+import asyncio
+import secrets
+import sqlite3
+import tempfile
+import threading
+from collections import deque
+
+import metrics
+from cache import TTLCache, make_key
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('EVENTS_FEED', '1') == '1'
+BACKEND = os.getenv('EVENTS_BACKEND', 'sqlite')  # 'local': this process only
+EVENTS_PATH = os.getenv('EVENTS_DB', os.path.join(tempfile.gettempdir(), 'rpc_events.db'))
+POLL = float(os.getenv('EVENTS_POLL', '0.2'))
+BUFFER = int(os.getenv('EVENTS_BUFFER', '1000'))
+MAX_WAIT = float(os.getenv('EVENTS_MAX_WAIT', '25'))
+BATCH = 100
+
+PUBLISHED = metrics.Counter('events_published_total', 'Events published on the change feed', ('type',))
+metrics.REGISTRY.append(PUBLISHED)
+
+
+class FeedDisabled(Exception):
+    pass
+
+
+class EventLog:
+    """ The feed shared by the worker processes through one SQLite file. It keeps the last
+        `size` events; its epoch is drawn once, when the file is created """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS event (
+        seq    INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind   TEXT NOT NULL,
+        topics TEXT NOT NULL,
+        data   TEXT NOT NULL,
+        ts     REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS feed (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.after_fork()
+
+    def after_fork(self):
+        """ In a forked worker: own SQLite handle (opened on first use) """
+        self._lock = threading.Lock()
+        self._db = None
+        self._version = None
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')  # a lost event only means a reset
+            self._db.executescript(self.SCHEMA)
+            self._db.execute("INSERT OR IGNORE INTO feed (name, value) VALUES ('epoch', ?)", (secrets.token_hex(4),))
+        return self._db
+
+    def append(self, kind, data, topics, size):
+        with self._lock:
+            db = self._conn()
+            seq = db.execute("INSERT INTO event (kind, topics, data, ts) VALUES (?,?,?,?)",
+                             (kind, json.dumps(sorted(topics)), json.dumps(data), time.time())).lastrowid
+            db.execute("DELETE FROM event WHERE seq <= ?", (seq - size,))
+        return seq
+
+    def read(self, after, force=False):
+        """ (epoch, rows after seq `after`), or None when no other process wrote since the last call """
+        with self._lock:
+            db = self._conn()
+            version = db.execute('PRAGMA data_version').fetchone()[0]  # moves on other connections' commits
+            if version == self._version and not force:
+                return None
+            self._version = version
+            epoch = db.execute("SELECT value FROM feed WHERE name = 'epoch'").fetchone()[0]
+            last = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'event'").fetchone()
+            rows = db.execute("SELECT seq, kind, topics, data, ts FROM event WHERE seq > ? ORDER BY seq", (after,)).fetchall()
+        return epoch, last[0] if last else 0, rows
+
+
+class EventBus:
+    def __init__(self, size=BUFFER, log=None):
+        self._size = size
+        self._log = log
+        self._reset()
+
+    def _reset(self):
+        self._buffer = deque(maxlen=self._size)  # (seq, event)
+        self._cond = threading.Condition(threading.Lock())
+        self.epoch = None if self._log else secrets.token_hex(4)
+        self._last = 0
+        self._floor = 0  # every event up to here is gone from the buffer
+        self._waiting = 0
+        self._async_waiters = set()  # (loop, asyncio.Event) of wait_async() callers
+        self._poller = None
+
+    def after_fork(self):
+        """ In a forked worker: fresh locks and buffer, re-read from the shared log """
+        if self._log: self._log.after_fork()
+        self._reset()
+
+    def _add(self, seq, event):
+        """ Appends one event to the buffer; the caller holds _cond """
+        if len(self._buffer) == self._buffer.maxlen:
+            self._floor = self._buffer[0][0]
+        self._buffer.append((seq, event))
+        self._last = seq
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, wake in waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # loop closed
+
+    def publish(self, kind, data, topics):
+        if not ENABLED:
+            return None
+        if self._log is not None:
+            seq = self._log.append(kind, data, topics, self._size)
+            self.sync(force=True)
+            PUBLISHED.inc(kind)
+            return self.cursor(seq)
+        with self._cond:
+            event = {'id': self.cursor(self._last + 1), 'type': kind, 'topics': sorted(topics), 'data': data, 'ts': time.time()}
+            self._add(self._last + 1, event)
+        self._wake()
+        PUBLISHED.inc(kind)
+        return event['id']
+
+    def sync(self, force=False):
+        """ Mirrors what the other processes published since the last call (shared log only) """
+        if self._log is None:
+            return
+        with self._cond:
+            after = self._last
+        read = self._log.read(after, force)
+        if read is None:
+            return
+        epoch, last, rows = read
+        with self._cond:
+            if epoch != self.epoch:  # first read, or the file was replaced: start over from it
+                self.epoch = epoch
+                self._buffer.clear()
+                self._last = self._floor = rows[0][0] - 1 if rows else last
+            rows = [r for r in rows if r[0] > self._last]
+            if not rows:
+                return
+            if rows[0][0] > self._last + 1:  # pruned before we read them: older cursors must reset
+                self._buffer.clear()
+                self._floor = rows[0][0] - 1
+            for seq, kind, topics, data, ts in rows:
+                self._add(seq, {'id': self.cursor(seq), 'type': kind, 'topics': json.loads(topics), 'data': json.loads(data), 'ts': ts})
+        self._wake()
+
+    def _watch(self):
+        """ Starts this process's poller of the shared log (once someone waits) """
+        if self._log is None or self._poller is not None:
+            return
+        with self._cond:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=self._poll, name='events-poller', daemon=True)
+        self._poller.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(POLL)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"❌ Event feed sync error: {e}")
+
+    def cursor(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def _seq(self, cursor):
+        """ seq of one of our ids, None for another epoch's (or garbage) """
+        epoch, _, seq = str(cursor).partition('-')
+        return int(seq) if epoch == self.epoch and seq.isdigit() else None
+
+    def wait(self, topics=None, after=None, timeout=MAX_WAIT):
+        """ Events matching any of topics after the id `after`, blocking up to timeout for the first one.
+            topics=None means all topics. Returns (events, cursor, reset); after=None starts from now """
+        topics = set(topics) if topics is not None else None
+        deadline = time.monotonic() + min(max(float(timeout), 0), MAX_WAIT)
+        self.sync()
+        self._watch()
+        with self._cond:
+            seq = self._seq(after) if after else self._last
+            if seq is None or seq < self._floor or seq > self._last:
+                return [], self.cursor(self._last), True
+            self._waiting += 1
+            try:
+                while True:
+                    events = [e for n, e in self._buffer if n > seq and (topics is None or topics.intersection(e['topics']))]
+                    if len(events) > BATCH:
+                        return events[:BATCH], events[BATCH - 1]['id'], False
+                    if events:
+                        return events, self.cursor(self._last), False
+                    # Nothing for us yet: skip past unrelated events on the next scan
+                    seq = self._last
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return [], self.cursor(self._last), False
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    async def wait_async(self, topics=None, after=None, timeout=MAX_WAIT):
+        """ Same as wait(), awaiting instead of blocking a thread """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(max(float(timeout), 0), MAX_WAIT)
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._cond:
+                self._async_waiters.add(waiter)  # before the scan: a publish in between still wakes us
+            try:
+                found, cursor, reset = self.wait(topics, after, 0)
+                remaining = deadline - loop.time()
+                if found or reset or remaining <= 0:
+                    return found, cursor, reset
+                after = cursor
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+
+    def stats(self):
+        with self._cond:
+            return {"last_id": self._last, "buffered": len(self._buffer), "waiting": self._waiting + len(self._async_waiters)}
+
+
+bus = EventBus(log=EventLog(EVENTS_PATH) if BACKEND != 'local' else None)
+os.register_at_fork(after_in_child=bus.after_fork)
+
+
+_groups = TTLCache(max_entries=4096, ttl=300)
+_groups.enabled = True
+
+
+def _student_group(student_id):
+    key = make_key('group_of', (student_id,))
+    gid = _groups.get(key, None)
+    if gid is None:
+        from db_manager import SchoolDB
+        with SchoolDB() as db:
+            u = db.get_user_details(student_id)
+        gid = (u or {}).get('groupe_id') or ''
+        _groups.set(key, gid)
+    return gid
+
+
+def _teacher_may(user, kind, ident):
+    """ Whether a Formateur may follow group:<ident> / tp:<ident>: the same rules as reading
+        that group's séances or that TP's files (SchoolDB.teaches_group / can_read_file) """
+    if kind not in ('group', 'tp') or not ident.isdigit():
+        return False
+    key = make_key('teacher_topic', (user['id'], kind, ident))
+    allowed = _groups.get(key, None)
+    if allowed is None:
+        from db_manager import SchoolDB
+        with SchoolDB() as db:
+            allowed = db.teaches_group(int(ident), user) if kind == 'group' else db.can_read_file('tp', int(ident), user)
+        _groups.set(key, allowed)
+    return allowed
+
+
+def allowed_topics(user, topics):
+    """ The topics this user may wait on, None meaning everything (Direction only).
+        Formateurs get their own teacher: topic and the group:/tp: topics of the classes they teach;
+        students get their own student: topic and their group's, nothing else (tp: topics carry
+        classmates' submissions) """
+    if user.get('role') == 'Direction':
+        return list(topics) if topics else None
+    if user.get('role') == 'Etudiant':
+        gid = _student_group(user['id'])
+        own = [f"student:{user['id']}"] + ([f"group:{gid}"] if gid != '' else [])
+        return [t for t in topics if str(t) in own] if topics else own
+    if user.get('role') != 'Formateur':
+        return []
+    if not topics:
+        return [f"teacher:{user['id']}"]
+    out = []
+    for t in topics:
+        kind, _, ident = str(t).partition(':')
+        if (kind == 'teacher' and ident == str(user['id'])) or _teacher_may(user, kind, ident):
+            out.append(t)
+    return out
+
+
+def sse(found, cursor, reset):
+    """ One wait() result as Server-Sent Events text """
+    out = f"id: {cursor}\nevent: reset\ndata: {{}}\n\n" if reset else ''
+    for e in found:
+        out += f"id: {e['id']}\nevent: {e['type']}\ndata: {json.dumps(e['data'])}\n\n"
+    return out or ": keepalive\n\n"
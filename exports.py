@@ -0,0 +1,73 @@
+""" Streaming CSV / XLSX writers for the export routes.
+
+The SchoolDB.export_* methods yield a header row then data rows fetched EXPORT_FETCH at a
+time; these writers turn them into response chunks without ever holding the whole
+result. CSV goes straight to the client. XLSX (optional openpyxl) is written in
+write-only mode to a temp file and streamed from it, so memory stays flat there too.
+"""
+import io
+import os
+import csv
+import datetime
+import tempfile
+
+FLUSH_BYTES = 64 * 1024
+READ_BLOCK = 256 * 1024
+
+FORMATS = {'csv': 'text/csv; charset=utf-8',
+           'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+
+
+def _value(v):
+    if isinstance(v, datetime.datetime):
+        return v.strftime('%Y-%m-%d %H:%M')
+    if isinstance(v, datetime.date):
+        return v.isoformat()
+    return v
+
+
+def csv_stream(rows):
+    """ ';'-separated UTF-8 with BOM so Excel (FR locale) opens it directly """
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    buf.write('\ufeff')
+    for row in rows:
+        writer.writerow([_value(v) for v in row])
+        if buf.tell() >= FLUSH_BYTES:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def _workbook():
+    """ openpyxl is optional and slow to import: loaded on the first XLSX export """
+    try:
+        from openpyxl import Workbook
+    except ImportError:  # optional: pip install openpyxl (XLSX exports)
+        return None
+    return Workbook
+
+
+def xlsx_stream(rows, title='Export'):
+    wb = _workbook()(write_only=True)
+    ws = wb.create_sheet(title[:31])
+    for row in rows:
+        ws.append([_value(v) for v in row])
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        wb.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK)
+                if not block: break
+                yield block
+    finally:
+        os.remove(path)
+
+
+def stream(rows, fmt, title='Export'):
+    """ Returns the chunk generator for fmt ('csv' or 'xlsx'), or None if unavailable """
+    if fmt == 'xlsx':
+        return xlsx_stream(rows, title) if _workbook() is not None else None
+    return csv_stream(rows)
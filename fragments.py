@@ -0,0 +1,55 @@
+""" Versioned HTML fragments for the admin dashboard.
+
+Each section of /admin (users, groups, modules, tps) has a version number. The rendered
+section is cached under (section, version), so a visit only rebuilds the sections whose
+version moved. SchoolDB mutations call bump() after their commit for the sections they
+affect. The versions live in a small memory-mapped file (FRAGMENT_STATE), shared by every
+worker process, so a change made through one worker is seen by the others. A worker that
+sees a new version also drops its own cached rows for that section (DATA) before
+rebuilding it.
+
+The versions also make the page's ETag (etag()), which lets a reload get a 304 answer
+without touching the DB.
+"""
+import os
+import time
+import tempfile
+
+from cache import cache, make_key, Versions
+
+SECTIONS = ('users', 'groups', 'modules', 'tps')
+# SchoolDB cache namespaces a section is built from
+DATA = {'users': (), 'groups': ('groups_by_filiere',), 'modules': ('all_modules',), 'tps': ()}
+
+FRAGMENT_TTL = float(os.getenv('FRAGMENT_TTL', '600'))
+STATE_PATH = os.getenv('FRAGMENT_STATE', os.path.join(tempfile.gettempdir(), 'rpc_fragments.ver'))
+
+versions = Versions(STATE_PATH, SECTIONS)
+_seen = {}
+
+
+def bump(*sections):
+    """ Call after the commit of a change shown in these sections """
+    versions.bump(*sections)
+
+
+def render(section, build):
+    """ The section's cached value for its current version; build() makes it on a miss.
+        The version is read first: a change committed while building bumps it again """
+    version = versions.get(section)
+    if _seen.get(section) != version:
+        for namespace in DATA[section]:
+            cache.invalidate(namespace, local=True)  # every worker does this on its own
+        _seen[section] = version
+    key = make_key('fragment', (section, version))
+    value = cache.get(key, None)
+    if value is None:
+        value = build()
+        cache.set(key, value, FRAGMENT_TTL)
+    return value
+
+
+def etag(sections=SECTIONS):
+    """ Changes with any section's version, and at least every FRAGMENT_TTL (groups and
+        modules are edited outside the app) """
+    return '-'.join([str(versions.get(s)) for s in sections] + [str(int(time.time() // FRAGMENT_TTL))])
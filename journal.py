@@ -0,0 +1,308 @@
+""" Write-behind journal for classroom writes (attendance, grades).
+
+When WRITE_JOURNAL points to a file, save_attendance / grade_submission(s) append to a local
+SQLite journal and return at once (same shape as a direct write, with result 'queued'); a background flusher replays pending entries to
+SchoolDB in batches. Entries carry an idempotency key (client supplied, or generated),
+so a client retrying the same call is only applied once. Malformed writes are refused
+by record() (JournalError) before they are acknowledged. Entries that can never apply
+(unknown submission or séance, a replay that raises, too many failed attempts) are marked
+'conflict' and listed by journal_conflicts; when a batch fails, its entries are replayed
+one by one so a bad entry cannot hold back the others. The servers start the flusher at startup
+(app.py, async_server, serve.py workers), so entries left pending by a restart replay without
+waiting for the next write.
+
+With several worker processes, every worker records into the same file but only one
+replays it: the flusher that holds the lock on <journal>.lock, until its process exits.
+Entries are thus replayed once and in order, whichever worker acknowledged them.
+
+The flusher deletes 'done' entries JOURNAL_RETENTION seconds after they were recorded (default
+one day): a client retrying with the same key inside that window is still recognised as a
+duplicate, and the file does not grow forever. Conflicts are kept until someone looks at them.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev box: a single process, it always flushes
+    fcntl = None
+
+from db_pool import BackendUnavailable
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.getenv('WRITE_JOURNAL', '')
+FLUSH_INTERVAL = float(os.getenv('JOURNAL_FLUSH_INTERVAL', '2'))
+BATCH_SIZE = int(os.getenv('JOURNAL_BATCH_SIZE', '100'))
+MAX_ATTEMPTS = int(os.getenv('JOURNAL_MAX_ATTEMPTS', '20'))
+RETENTION = float(os.getenv('JOURNAL_RETENTION', '86400'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    kind     TEXT NOT NULL,
+    payload  TEXT NOT NULL,
+    created  REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status   TEXT NOT NULL DEFAULT 'pending',
+    detail   TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_journal_status ON journal (status, seq);
+"""
+
+
+class JournalError(Exception):
+    pass
+
+
+def _check_int(value, what):
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        raise JournalError(f"invalid {what}: {value!r}")
+
+
+def validate(kind, payload):
+    """ Raises JournalError unless every row of the write can be replayed """
+    if kind == 'attendance':
+        seances = payload.get('seances') if isinstance(payload, dict) else None
+        if not isinstance(seances, list):
+            raise JournalError("attendance needs a list of séances")
+        for s in seances:
+            if not isinstance(s, dict) or not isinstance(s.get('presence') or [], list):
+                raise JournalError("each séance needs seance_id and a presence list")
+            _check_int(s.get('seance_id'), 'seance_id')
+            for item in s.get('presence') or []:
+                if not isinstance(item, dict) or not str(item.get('status') or '').strip():
+                    raise JournalError("each presence row needs student_id and status")
+                _check_int(item.get('student_id'), 'student_id')
+    elif kind == 'grade':
+        from db_manager import SchoolDB
+        grades = payload.get('grades') if isinstance(payload, dict) else None
+        if not isinstance(grades, list):
+            raise JournalError("grades must be a list")
+        if payload.get('tp_id') is not None:
+            _check_int(payload['tp_id'], 'tp_id')
+        for g in grades:
+            if isinstance(g, dict):
+                sid, grade = g.get('submission_id'), g.get('grade')
+            elif isinstance(g, (list, tuple)):
+                sid, grade = (list(g) + [None, None])[:2]
+            else:
+                raise JournalError(f"invalid grade row: {g!r}")
+            _check_int(sid, 'submission_id')
+            if SchoolDB._grade_value(grade) is None:
+                raise JournalError(f"invalid grade for submission {sid}: {grade!r}")
+    else:
+        raise JournalError(f"unknown write kind: {kind}")
+
+
+class WriteJournal:
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, retention=RETENTION):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        self._leader = None
+        self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=FULL')  # acknowledged means on disk
+        self._db.executescript(SCHEMA)
+
+    def after_fork(self):
+        """ In a forked worker: own SQLite handle, lock and flusher (the parent's are not ours) """
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        if self._leader is not None:
+            os.close(self._leader)  # the lock itself stays with the parent
+            self._leader = None
+        self._open()
+
+    # --- WRITE SIDE ---
+    def record(self, kind, payload, idem_key=None):
+        """ Durably queues a write. Returns {'queued', 'key', 'duplicate'}; JournalError if malformed """
+        validate(kind, payload)
+        key = str(idem_key) if idem_key else uuid.uuid4().hex
+        with self._lock:
+            cur = self._db.execute("INSERT OR IGNORE INTO journal (idem_key, kind, payload, created) VALUES (?,?,?,?)",
+                                   (key, kind, json.dumps(payload), time.time()))
+        self.start()
+        self._wake.set()
+        return {'queued': True, 'key': key, 'duplicate': cur.rowcount == 0}
+
+    def status(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT kind, status, attempts, detail, created FROM journal WHERE idem_key=?", (key,)).fetchone()
+        if not row: return None
+        return {'key': key, 'kind': row[0], 'status': row[1], 'attempts': row[2],
+                'detail': json.loads(row[3]) if row[3] else None, 'created': row[4]}
+
+    def conflicts(self, limit=100):
+        with self._lock:
+            rows = self._db.execute("SELECT idem_key, kind, payload, detail, created FROM journal WHERE status='conflict' ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+        return [{'key': r[0], 'kind': r[1], 'payload': json.loads(r[2]), 'detail': json.loads(r[3]) if r[3] else None, 'created': r[4]} for r in rows]
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall()
+        return dict(rows)
+
+    # --- FLUSHER ---
+    def start(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._run, name='journal-flusher', daemon=True)
+        self._flusher.start()
+
+    def _leads(self):
+        """ True in the one process allowed to replay; another one takes over when it exits """
+        if fcntl is None or self._leader is not None:
+            return True
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._leader = fd
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._leads():
+                continue  # another worker replays; it sees our entries on its next tick
+            try:
+                while self.flush_once() == self.batch_size:
+                    pass  # backlog: keep draining
+            except BackendUnavailable:
+                pass  # DB down: entries stay pending, retry next tick
+            except Exception as e:
+                logger.error(f"❌ Journal flush error: {e}")
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"❌ Journal prune error: {e}")
+
+    def prune(self, now=None):
+        """ Deletes the done entries recorded more than retention seconds ago. Returns how many """
+        with self._lock:
+            cur = self._db.execute("DELETE FROM journal WHERE status='done' AND created < ?",
+                                   ((now or time.time()) - self.retention,))
+        return cur.rowcount
+
+    def flush_once(self):
+        """ Replays up to batch_size pending entries in one DB session. Returns how many were handled """
+        from db_manager import SchoolDB
+        with self._lock:
+            rows = self._db.execute("SELECT seq, kind, payload, attempts FROM journal WHERE status='pending' ORDER BY seq LIMIT ?",
+                                    (self.batch_size,)).fetchall()
+        if not rows: return 0
+        entries = [{'seq': r[0], 'kind': r[1], 'payload': json.loads(r[2]), 'attempts': r[3]} for r in rows]
+        with SchoolDB() as db:
+            outcomes = {}
+            outcomes.update(self._replay(db, self._replay_attendance, [e for e in entries if e['kind'] == 'attendance']))
+            outcomes.update(self._replay(db, self._replay_grades, [e for e in entries if e['kind'] == 'grade']))
+        with self._lock:
+            for e in entries:
+                status, detail = outcomes.get(e['seq'], ('conflict', {'error': 'unknown kind'}))
+                if status == 'retry' and e['attempts'] + 1 >= MAX_ATTEMPTS:
+                    status = 'conflict'
+                self._db.execute("UPDATE journal SET status=?, attempts=attempts+1, detail=? WHERE seq=?",
+                                 ('pending' if status == 'retry' else status, json.dumps(detail) if detail else None, e['seq']))
+        return len(entries)
+
+    def _replay(self, db, replay, entries):
+        """ Replays entries as one batch. Entries of a failed batch are replayed alone, so only the
+            bad one stays in retry; an entry whose replay raises on its own is a conflict """
+        if not entries: return {}
+        try:
+            out = replay(db, entries)
+        except BackendUnavailable:
+            raise
+        except Exception as e:
+            if len(entries) == 1:
+                logger.error(f"❌ Journal entry {entries[0]['seq']} cannot be replayed: {e}")
+                return {entries[0]['seq']: ('conflict', {'error': str(e)})}
+            out = {e['seq']: ('retry', None) for e in entries}
+        if len(entries) > 1:
+            for e in entries:
+                if out[e['seq']][0] == 'retry':
+                    out.update(self._replay(db, replay, [e]))
+        return out
+
+    def _replay_attendance(self, db, entries):
+        """ All pending attendance entries go through ONE save_presence_batch (one transaction) """
+        if not entries: return {}
+        seances, owner = [], {}
+        for e in entries:
+            for s in e['payload']['seances']:
+                seances.append(s)
+                for item in s.get('presence') or []:
+                    owner[(str(s.get('seance_id')), str(item.get('student_id')))] = e['seq']
+        results = db.save_presence_batch(seances)
+        bad = {}
+        for r in results:
+            seq = owner.get((str(r['seance_id']), str(r['student_id'])))
+            if seq is not None and r['result'] in ('invalid', 'error'):
+                bad.setdefault(seq, []).append(r)
+        out = {}
+        for e in entries:
+            rows = bad.get(e['seq'])
+            if not rows:
+                out[e['seq']] = ('done', None)
+            elif all(r['result'] == 'error' for r in rows):
+                out[e['seq']] = ('retry', {'rows': rows})
+            else:
+                out[e['seq']] = ('conflict', {'rows': rows})
+        return out
+
+    def _replay_grades(self, db, entries):
+        """ One save_grades (one transaction) per TP among the pending grade entries """
+        by_tp, owner = {}, {}
+        for e in entries:
+            p = e['payload']
+            if 'sid' in p:  # entries queued before batch grading
+                p = {'tp_id': None, 'grades': [{'submission_id': p['sid'], 'grade': p['grade']}]}
+            by_tp.setdefault(p['tp_id'], []).extend(p['grades'])
+            for g in p['grades']:
+                sid = g.get('submission_id') if isinstance(g, dict) else (list(g) or [None])[0]
+                owner.setdefault((p['tp_id'], str(sid)), []).append(e['seq'])
+        bad = {}
+        for tp_id, grades in by_tp.items():
+            for r in db.save_grades(tp_id, grades):
+                if r['result'] != 'updated':
+                    for seq in owner.get((tp_id, str(r['submission_id'])), []):
+                        bad.setdefault(seq, []).append(r)
+        out = {}
+        for e in entries:
+            rows = bad.get(e['seq'])
+            if not rows:
+                out[e['seq']] = ('done', None)
+            elif all(r['result'] == 'error' for r in rows):
+                out[e['seq']] = ('retry', {'rows': rows})
+            else:
+                out[e['seq']] = ('conflict', {'rows': rows})
+        return out
+
+
+journal = WriteJournal(JOURNAL_PATH) if JOURNAL_PATH else None
+if journal:
+    os.register_at_fork(after_in_child=journal.after_fork)
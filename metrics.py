@@ -0,0 +1,220 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+
+slow_log = logging.getLogger('slow_query')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))  # 0 = slow-query log off
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+# --- METRIC TYPES ---
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            yield f"{self.name}{_labels(self.labels, lv)} {v}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(label_values)
+            if v is None:
+                v = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(lv, list(v)) for lv, v in self._values.items()]
+        for lv, v in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, v):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), lv + (repr(float(bound)),))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labels + ('le',), lv + ('+Inf',))} {v[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, lv)} {v[-2]}"
+            yield f"{self.name}_count{_labels(self.labels, lv)} {v[-1]}"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+RPC_LATENCY = Histogram('rpc_request_duration_seconds', 'XML-RPC method latency', ('method',))
+RPC_ERRORS = Counter('rpc_errors_total', 'XML-RPC methods that raised', ('method',))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'Flask route latency', ('endpoint', 'status'))
+DB_LATENCY = Histogram('db_query_duration_seconds', 'cursor.execute latency per SchoolDB method', ('statement',))
+DB_ERRORS = Counter('db_errors_total', 'Failed cursor.execute calls', ('statement',))
+DB_ROWS = Counter('db_rows_fetched_total', 'Rows fetched per SchoolDB method', ('statement',))
+DB_ROUNDTRIPS = Histogram('db_roundtrips_per_request', 'DB round trips per HTTP request', ('endpoint',),
+                          buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+DB_ACQUIRE = Histogram('db_pool_acquire_seconds', 'Time to check a connection out of the pool')
+
+REGISTRY = [RPC_LATENCY, RPC_ERRORS, HTTP_LATENCY, DB_LATENCY, DB_ERRORS, DB_ROWS, DB_ROUNDTRIPS, DB_ACQUIRE]
+
+
+# Filled by serve.py: import cost per module and time to the first ready worker (ms)
+STARTUP = {}
+
+
+def render(gauges=None):
+    """ Prometheus text format. gauges: {name: {label_value: number}} sampled at scrape time """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, values in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        for key, v in values.items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                continue
+            lines.append(f'{name}{{key="{key}"}} {v}')
+    return "\n".join(lines) + "\n"
+
+
+# --- PER-REQUEST DB COUNTERS ---
+_local = threading.local()
+
+def begin_request():
+    _local.roundtrips = 0
+
+def request_roundtrips():
+    return getattr(_local, 'roundtrips', 0)
+
+
+# --- INSTRUMENTED DB-API WRAPPERS ---
+# SchoolDB helpers that run queries for their caller: label with the caller instead
+_PASSTHROUGH = {'_query', '_rows'}
+
+def _statement_name():
+    """ Label = the SchoolDB method that issued the query (bounded cardinality) """
+    f = sys._getframe(2)
+    for _ in range(6):
+        if f is None: break
+        if f.f_code.co_filename.endswith('db_manager.py') and f.f_code.co_name not in _PASSTHROUGH:
+            return f.f_code.co_name
+        f = f.f_back
+    return 'other'
+
+
+def _param_types(params):
+    """ Types only: values include password hashes (a working login), emails and grades """
+    return [f"<{len(p)} bytes>" if isinstance(p, (bytes, bytearray, memoryview)) else type(p).__name__ for p in params]
+
+
+class InstrumentedCursor:
+    """ Times execute/executemany and counts fetched rows; everything else is delegated """
+    __slots__ = ('_cursor', '_stmt')
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_stmt', 'other')
+
+    def _timed(self, fn, sql, params):
+        stmt = _statement_name()
+        object.__setattr__(self, '_stmt', stmt)
+        _local.roundtrips = getattr(_local, 'roundtrips', 0) + 1
+        start = time.perf_counter()
+        try:
+            return fn(sql, *params)
+        except Exception:
+            DB_ERRORS.inc(stmt)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_LATENCY.observe(elapsed, stmt)
+            if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+                if fn.__name__ == 'executemany':
+                    shown = '(batch)'
+                else:
+                    shown = _param_types(params[0] if len(params) == 1 and isinstance(params[0], (list, tuple)) else params)
+                slow_log.warning(f"{elapsed * 1000:.0f} ms [{stmt}] {' '.join(str(sql).split())} params={shown}")
+
+    def execute(self, sql, *params):
+        self._timed(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, *params):
+        self._timed(self._cursor.executemany, sql, params)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None: DB_ROWS.inc(self._stmt)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        DB_ROWS.inc(self._stmt, amount=len(rows))
+        return rows
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size) if size else self._cursor.fetchmany()
+        DB_ROWS.inc(self._stmt, amount=len(rows))
+        return rows
+
+    def __iter__(self):
+        n = 0
+        for row in self._cursor:
+            n += 1
+            yield row
+        DB_ROWS.inc(self._stmt, amount=n)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
@@ -0,0 +1,49 @@
+# migrate_blobs.py : move in-DB files to the blob store (BLOB_STORE_DIR) and collect unused blobs
+#   python migrate_blobs.py migrate   -> stream every TP / submission / annonce file out of the DB
+#   python migrate_blobs.py gc        -> drop blobs no row references anymore
+import sys
+import time
+from db_manager import SchoolDB
+from blob_store import get_blob_store
+
+GRACE = 3600  # files younger than this may belong to an upload that is still committing
+
+def gc(db, store, grace=GRACE):
+    """ Deletes the files of dropped Blob rows and the orphans of uploads that never committed.
+        Returns (dropped Blob rows, files removed), or None if the DB side failed """
+    dead, live = db.collect_blobs(grace)
+    if live is None:
+        return None
+    limit = time.time() - grace
+    # Files written by uploads whose DB transaction never committed
+    candidates = dict(dead)
+    candidates.update((sha, size) for sha, size, mtime in store.walk() if sha not in live and mtime < limit)
+    removed = 0
+    for sha, size in candidates.items():
+        # An upload may have reused the file since (dedup hit touches it, its row commits later): look again
+        mtime = store.mtime(sha, size)
+        if mtime is None or mtime >= limit or db.blob_referenced(sha):
+            continue
+        removed += store.delete(sha, size)
+    store.sweep_tmp(grace)
+    return len(dead), removed
+
+if __name__ == '__main__':
+    store = get_blob_store()
+    if not store:
+        sys.exit("❌ ERROR: set BLOB_STORE_DIR first.")
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    with SchoolDB() as db:
+        if cmd == 'migrate':
+            for kind in SchoolDB.BLOB_TABLES:
+                ids = db.iter_unmigrated_blobs(kind)
+                moved = sum(1 for row_id in ids if db.migrate_blob_to_store(kind, row_id))
+                print(f"✅ {kind}: {moved}/{len(ids)} files moved to {store.root}")
+        elif cmd == 'gc':
+            result = gc(db, store)
+            if result is None:
+                sys.exit("❌ ERROR: blob GC failed (see log).")
+            print(f"✅ {result[0]} unreferenced blobs dropped, {result[1]} files removed.")
+        else:
+            sys.exit(f"❌ ERROR: unknown command {cmd}")
@@ -0,0 +1,39 @@
+-- Incrementally maintained attendance aggregates (see SchoolDB.save_presence_batch)
+-- Fill / repair with: python rebuild_aggregates.py
+-- NULL group/module/teacher ids on Seance are stored as 0.
+
+IF OBJECT_ID('PresenceAgg') IS NULL
+CREATE TABLE PresenceAgg (
+    Jour        DATE NOT NULL,
+    GroupeID    INT  NOT NULL,
+    FormateurID INT  NOT NULL,
+    ModuleID    INT  NOT NULL,
+    Presents    INT  NOT NULL DEFAULT 0,
+    Total       INT  NOT NULL DEFAULT 0,
+    CONSTRAINT PK_PresenceAgg PRIMARY KEY (Jour, GroupeID, FormateurID, ModuleID)
+);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_PresenceAgg_Formateur')
+CREATE INDEX IX_PresenceAgg_Formateur ON PresenceAgg (FormateurID, Jour) INCLUDE (GroupeID, Presents, Total);
+GO
+
+IF OBJECT_ID('AbsenceCounter') IS NULL
+CREATE TABLE AbsenceCounter (
+    EtudiantID  INT NOT NULL,
+    ModuleID    INT NOT NULL,
+    GroupeID    INT NOT NULL,
+    FormateurID INT NOT NULL,
+    Absences    INT NOT NULL DEFAULT 0,
+    CONSTRAINT PK_AbsenceCounter PRIMARY KEY (EtudiantID, ModuleID, GroupeID, FormateurID)
+);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_AbsenceCounter_Formateur')
+CREATE INDEX IX_AbsenceCounter_Formateur ON AbsenceCounter (FormateurID) INCLUDE (Absences);
+GO
+
+-- Sargable "Etat = 'Absent'" lookups for the absence dates (no more LOWER(P.Etat))
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Presence_Etat')
+CREATE INDEX IX_Presence_Etat ON Presence (Etat, SeanceID) INCLUDE (EtudiantID);
+GO
@@ -0,0 +1,32 @@
+-- Content-addressed file storage (see blob_store.py, BLOB_STORE_DIR)
+-- Files are kept on disk under their SHA-256; rows point to them by hash.
+-- Move existing in-DB files with: python migrate_blobs.py migrate
+
+IF OBJECT_ID('Blob') IS NULL
+CREATE TABLE Blob (
+    Hash     CHAR(64) NOT NULL CONSTRAINT PK_Blob PRIMARY KEY,
+    Taille   BIGINT   NOT NULL,
+    RefCount INT      NOT NULL DEFAULT 0,
+    CreeLe   DATETIME NOT NULL DEFAULT GETDATE()
+);
+GO
+
+IF COL_LENGTH('TP', 'FichierHash') IS NULL
+ALTER TABLE TP ADD FichierHash CHAR(64) NULL;
+GO
+
+IF COL_LENGTH('Soumission', 'FichierHash') IS NULL
+ALTER TABLE Soumission ADD FichierHash CHAR(64) NULL;
+GO
+
+IF COL_LENGTH('Annonce', 'ImageHash') IS NULL
+ALTER TABLE Annonce ADD ImageHash CHAR(64) NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_TP_FichierHash')
+CREATE INDEX IX_TP_FichierHash ON TP (FichierHash) WHERE FichierHash IS NOT NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Soumission_FichierHash')
+CREATE INDEX IX_Soumission_FichierHash ON Soumission (FichierHash) WHERE FichierHash IS NOT NULL;
+GO
@@ -0,0 +1,10 @@
+-- Version stamp on TP for delta polling (see SchoolDB.get_student_tps_since)
+-- rpc_get_student_tps(student_id, since) returns only TPs whose RowVer is above the cursor.
+
+IF COL_LENGTH('TP', 'RowVer') IS NULL
+ALTER TABLE TP ADD RowVer ROWVERSION;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_TP_Groupe_RowVer')
+CREATE INDEX IX_TP_Groupe_RowVer ON TP (GroupeID, RowVer) INCLUDE (ModuleID, DateLimite);
+GO
@@ -0,0 +1,5 @@
+-- Optional teacher comment stored with the grade (see SchoolDB.save_grades)
+
+IF COL_LENGTH('Soumission', 'Commentaire') IS NULL
+ALTER TABLE Soumission ADD Commentaire NVARCHAR(1000) NULL;
+GO
@@ -0,0 +1,12 @@
+-- Séance resolution (SchoolDB.get_or_create_seance / pregenerate_seances).
+-- Lookups are sargable day ranges on DateDebut inside one (FormateurID, GroupeID, ModuleID) slot,
+-- so the UPDLOCK, HOLDLOCK range lock of the upsert covers a single slot-day.
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Seance_Slot')
+CREATE INDEX IX_Seance_Slot ON Seance (FormateurID, GroupeID, ModuleID, DateDebut);
+GO
+
+-- Startup warm-up of the in-memory séance index (séances around today)
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Seance_DateDebut')
+CREATE INDEX IX_Seance_DateDebut ON Seance (DateDebut) INCLUDE (FormateurID, GroupeID, ModuleID);
+GO
@@ -0,0 +1,6 @@
+-- Absence report dates (SchoolDB.get_absent_report): only the students shown in the report are
+-- read, as EtudiantID IN (...) seeks instead of a scan of every absent row.
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Presence_Etudiant')
+CREATE INDEX IX_Presence_Etudiant ON Presence (EtudiantID, Etat) INCLUDE (SeanceID);
+GO
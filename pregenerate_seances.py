@@ -0,0 +1,15 @@
+# pregenerate_seances.py : create a term's séances from Affectation in one transaction
+#   python pregenerate_seances.py 2026-09-14 2027-01-29 [weekdays, e.g. 0,1,2,3,4 with 0 = Monday]
+import sys
+from db_manager import SchoolDB
+
+if len(sys.argv) < 3:
+    sys.exit("usage: python pregenerate_seances.py DATE_FROM DATE_TO [WEEKDAYS]")
+weekdays = [int(d) for d in sys.argv[3].split(',')] if len(sys.argv) > 3 else None
+
+with SchoolDB() as db:
+    result = db.pregenerate_seances(sys.argv[1], sys.argv[2], weekdays)
+    if result is not None:
+        print(f"✅ {result['created']} séances created ({result['from']} -> {result['to']}).")
+    else:
+        print("❌ ERROR: pre-generation failed (see log).")
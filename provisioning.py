@@ -0,0 +1,181 @@
+""" Bulk account import for the admin dashboard (CSV or XLSX roster).
+
+The roster is read row by row from the upload (never fully in memory), validated, and
+inserted IMPORT_BATCH rows per transaction through SchoolDB.insert_users_batch. Group
+names are resolved with one lookup for the whole file and passwords are hashed on a
+small worker pool. Rejected rows go to a CSV error report served by /admin/import_report.
+
+Columns (header names are matched loosely, accents/case ignored):
+    nom, prenom, email, password, role, groupe (name) or groupe_id, cne, matricule
+"""
+import os
+import csv
+import time
+import uuid
+import codecs
+import tempfile
+import itertools
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from db_manager import SchoolDB, hash_password
+
+IMPORT_DIR = os.getenv('IMPORT_DIR', os.path.join(tempfile.gettempdir(), 'rpc_imports'))
+IMPORT_BATCH = int(os.getenv('IMPORT_BATCH', '100'))
+REPORT_TTL = 24 * 3600
+
+hash_pool = ThreadPoolExecutor(max_workers=int(os.getenv('IMPORT_HASH_WORKERS', '2')), thread_name_prefix='pw-hash')
+
+ALIASES = {
+    'nom': 'nom', 'lastname': 'nom', 'name': 'nom',
+    'prenom': 'prenom', 'firstname': 'prenom',
+    'email': 'email', 'mail': 'email',
+    'password': 'password', 'motdepasse': 'password', 'mdp': 'password',
+    'role': 'role',
+    'groupe': 'groupe', 'group': 'groupe', 'nomgroupe': 'groupe', 'groupeid': 'groupe_id',
+    'cne': 'cne', 'matricule': 'matricule',
+}
+ROLES = {'etudiant': 'Etudiant', 'student': 'Etudiant', 'formateur': 'Formateur', 'teacher': 'Formateur', 'direction': 'Direction'}
+REQUIRED = ('nom', 'prenom', 'email', 'password')
+
+
+class RosterError(Exception):
+    """ The file as a whole cannot be imported (format, header) """
+
+
+def _norm(header):
+    text = unicodedata.normalize('NFKD', str(header or '')).encode('ascii', 'ignore').decode()
+    return ''.join(ch for ch in text.lower() if ch.isalnum())
+
+
+def _cell(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Excel turns CNE / matricule into floats
+    return str(value).strip()
+
+
+def _iter_csv(stream):
+    text = codecs.getreader('utf-8-sig')(stream)
+    first = text.readline()
+    delimiter = ';' if first.count(';') > first.count(',') else ','  # Excel FR exports use ';'
+    return csv.reader(itertools.chain([first], text), delimiter=delimiter)
+
+
+def _iter_xlsx(stream):
+    try:
+        from openpyxl import load_workbook  # optional, and slow to import: only on the first XLSX roster
+    except ImportError:
+        raise RosterError('XLSX import needs openpyxl (pip install openpyxl); upload a CSV instead')
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_roster(stream, filename):
+    """ Yields (line number, {column: value}) for each non-empty row """
+    rows = _iter_xlsx(stream) if filename.lower().endswith('.xlsx') else _iter_csv(stream)
+    header = next(rows, None)
+    if not header:
+        raise RosterError('empty file')
+    keys = [ALIASES.get(_norm(h)) for h in header]
+    missing = [c for c in REQUIRED if c not in keys]
+    if missing:
+        raise RosterError('missing columns: ' + ', '.join(missing))
+    for line, values in enumerate(rows, start=2):
+        row = {k: _cell(v) for k, v in zip(keys, values) if k and v is not None}
+        if any(row.values()):
+            yield line, row
+
+
+def _validate(row, default_role, groups, seen):
+    """ Returns (user, None) or (None, error) """
+    role = ROLES.get(_norm(row.get('role'))) if row.get('role') else default_role
+    if not role:
+        return None, f"unknown role '{row.get('role')}'"
+    for col in REQUIRED:
+        if not row.get(col):
+            return None, f"missing {col}"
+    email = row['email'].lower()
+    if '@' not in email:
+        return None, 'invalid email'
+    if email in seen:
+        return None, 'duplicate email in file'
+    user = {'nom': row['nom'], 'prenom': row['prenom'], 'email': email, 'password': row['password'], 'role': role,
+            'cne': row.get('cne'), 'matricule': row.get('matricule'), 'groupe_id': None}
+    if role == 'Etudiant':
+        name = row.get('groupe', '').lower()
+        gid = groups.get(name) if name else (int(row['groupe_id']) if row.get('groupe_id', '').isdigit() else None)
+        if gid is None or gid not in groups.values():
+            return None, f"unknown group '{row.get('groupe') or row.get('groupe_id') or ''}'"
+        user['groupe_id'] = gid
+    seen.add(email)
+    return user, None
+
+
+def _insert(db, ready, report):
+    """ Inserts one batch; if the transaction fails, retries row by row to isolate the bad ones """
+    try:
+        db.insert_users_batch([u for _, u in ready])
+        return len(ready)
+    except Exception as e:
+        if len(ready) == 1:
+            line, user = ready[0]
+            report.append((line, user['email'], f'database error: {e}'))
+            return 0
+        return sum(_insert(db, [item], report) for item in ready)
+
+
+def run_import(stream, filename, default_role='Etudiant'):
+    """ Imports a roster. Returns {'created', 'errors', 'report_id'} """
+    report, created, seen = [], 0, set()
+    with SchoolDB() as db:
+        groups = db.get_group_ids_by_name()
+        rows = iter_roster(stream, filename)
+        while True:
+            batch = list(itertools.islice(rows, IMPORT_BATCH))
+            if not batch:
+                break
+            ready = []
+            for line, row in batch:
+                user, error = _validate(row, default_role, groups, seen)
+                if error:
+                    report.append((line, row.get('email', ''), error))
+                else:
+                    ready.append((line, user))
+            taken = db.existing_emails([u['email'] for _, u in ready])
+            for line, user in [item for item in ready if item[1]['email'] in taken]:
+                report.append((line, user['email'], 'email already registered'))
+            ready = [item for item in ready if item[1]['email'] not in taken]
+            if not ready:
+                continue
+            hashes = hash_pool.map(hash_password, [u.pop('password') for _, u in ready])
+            for (_, user), hashed in zip(ready, hashes):
+                user['password_hash'] = hashed
+            created += _insert(db, ready, report)
+    return {'created': created, 'errors': len(report), 'report_id': write_report(report) if report else None}
+
+
+# --- ERROR REPORTS ---
+def write_report(report):
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    limit = time.time() - REPORT_TTL
+    for name in os.listdir(IMPORT_DIR):
+        path = os.path.join(IMPORT_DIR, name)
+        if os.stat(path).st_mtime < limit:
+            os.remove(path)
+    report_id = uuid.uuid4().hex
+    with open(os.path.join(IMPORT_DIR, report_id + '.csv'), 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(('line', 'email', 'error'))
+        writer.writerows(sorted(report))
+    return report_id
+
+
+def report_path(report_id):
+    """ Path of a report, or None if the id is malformed or expired """
+    if len(report_id) != 32 or any(ch not in '0123456789abcdef' for ch in report_id):
+        return None
+    path = os.path.join(IMPORT_DIR, report_id + '.csv')
+    return path if os.path.exists(path) else None
@@ -0,0 +1,385 @@
+""" Named read statements for SchoolDB and their row -> dict projections.
+
+Each statement is declared once: its SQL, the column order of its SELECT list, and the
+result fields, either as (key, column) / (key, column, converter) pairs or as a plain
+function of the row. At import time
+
+  * every variant (e.g. unfiltered / per teacher) is rendered to a fixed SQL string, so
+    the same text is sent each time and the driver can keep it prepared;
+  * (key, column) fields become one operator.itemgetter over the column positions (no
+    per-row attribute lookups, no per-row dict building code in db_manager).
+
+Names are concatenated and dates formatted by SQL Server (CONVERT styles / DAY / MONTH, independent of the
+login language) instead of strftime on every row. SchoolDB._query keeps one cursor per
+(statement, variant) on each pooled connection; fetch() reads FETCH_SIZE rows at a time.
+"""
+import os
+import operator
+import itertools
+
+FETCH_SIZE = int(os.getenv('DB_FETCH_SIZE', '200'))
+# IN (?, ...) lists are padded to one of these lengths: a few fixed statements instead of one per count
+ID_LIST_SIZES = (10, 50, 200)
+
+STATEMENTS = {}
+
+_MONTHS = 'JanFebMarAprMayJunJulAugSepOctNovDec'
+
+
+# --- SQL FORMATTING HELPERS ---
+def iso_minutes(col):
+    """ 'YYYY-MM-DD HH:MM' """
+    return f"CONVERT(VARCHAR(16), {col}, 120)"
+
+
+def iso_seconds(col):
+    """ 'YYYY-MM-DD HH:MM:SS' """
+    return f"CONVERT(VARCHAR(19), {col}, 120)"
+
+
+def iso_date(col):
+    """ 'YYYY-MM-DD' """
+    return f"CONVERT(VARCHAR(10), {col}, 23)"
+
+
+def day_month(col):
+    """ '05 Mar' (what strftime('%d %b') gave, whatever the session language) """
+    return (f"CONCAT(CASE WHEN DAY({col}) < 10 THEN '0' ELSE '' END, DAY({col}), ' ', "
+            f"SUBSTRING('{_MONTHS}', MONTH({col}) * 3 - 2, 3))")
+
+
+def day_month_time(col):
+    """ '05 Mar 14:30' (strftime('%d %b %H:%M')) """
+    return f"CONCAT({day_month(col)}, ' ', CONVERT(VARCHAR(5), {col}, 108))"
+
+
+# --- PROJECTIONS ---
+def blank(value):
+    """ NULL -> '' (what the templates show for a missing grade) """
+    return '' if value is None else value
+
+
+def projection(columns, fields):
+    """ fields ((key, column[, converter]), ...) -> function row -> dict. The columns are read
+        with one itemgetter; a converter only sees its own value """
+    index = {c: i for i, c in enumerate(columns)}
+    keys = tuple(f[0] for f in fields)
+    positions = [index[f[1]] for f in fields]
+    pick = operator.itemgetter(*positions) if len(positions) > 1 else (lambda r: (r[positions[0]],))
+    converters = tuple((f[0], f[2]) for f in fields if len(f) > 2)
+
+    def project(r):
+        row = dict(zip(keys, pick(r)))
+        for key, convert in converters:
+            row[key] = convert(row[key])
+        return row
+    return project
+
+
+# --- REGISTRY ---
+class Statement:
+    __slots__ = ('name', 'columns', 'variants', 'project')
+
+    def __init__(self, name, sql, columns, fields=None, variants=None):
+        self.name = name
+        self.columns = tuple(columns)
+        # variants: {'name': {placeholder: SQL fragment}} rendered into sql once
+        self.variants = {v: sql.format(**parts) for v, parts in variants.items()} if variants else {'default': sql}
+        # fields: a function of the row, or (key, column[, converter]) pairs; none = the raw tuple
+        self.project = fields if callable(fields) else projection(self.columns, fields) if fields else tuple
+
+    def sql(self, variant='default'):
+        return self.variants[variant]
+
+    def __repr__(self):
+        return f"<Statement {self.name} {sorted(self.variants)}>"
+
+
+def statement(name, sql, columns, fields=None, variants=None):
+    if name in STATEMENTS:
+        raise ValueError(f"statement {name} declared twice")
+    STATEMENTS[name] = stmt = Statement(name, sql, columns, fields, variants)
+    return stmt
+
+
+def filter_variants(placeholder, filters):
+    """ One variant per combination of optional WHERE conditions, named 'a+b' in declaration
+        order ('all' = none): filters is [(name, condition), ...] """
+    out = {}
+    for n in range(len(filters) + 1):
+        for combo in itertools.combinations(filters, n):
+            name = '+'.join(k for k, _ in combo) or 'all'
+            out[name] = {placeholder: ('WHERE ' + ' AND '.join(c for _, c in combo)) if combo else ''}
+    return out
+
+
+def id_list(ids):
+    """ (variant, params) for an 'in<n>' statement: ids padded with the first one to the next
+        ID_LIST_SIZES length (at most the last one) """
+    ids = list(ids)
+    size = next(n for n in ID_LIST_SIZES if n >= len(ids))
+    return f"in{size}", ids + ids[:1] * (size - len(ids))
+
+
+def fetch(cursor, project, size=None):
+    """ All remaining rows of cursor, projected, read size rows per round trip """
+    out = []
+    size = size or FETCH_SIZE
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return out
+        out.extend(map(project, batch))
+
+
+def iter_rows(cursor, size=None):
+    """ Raw rows of cursor without holding the whole result """
+    size = size or FETCH_SIZE
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return
+        yield from batch
+
+
+# --- USERS ---
+def _user(r):
+    """ Directory row; SchoolDB fills teacher_groups """
+    return {'id': r[0], 'name': r[2], 'email': r[3], 'role': r[4], 'student_group': r[5],
+            'matricule': r[6], 'cne': r[7], 'teacher_groups': []}
+
+
+USERS_ALL = statement('users_all', """
+    SELECT U.UserID, U.Nom, CONCAT(U.Nom, ' ', U.Prenom), U.Email, U.Role, G.NomGroupe, F.Matricule, E.CNE
+    FROM Utilisateur U
+    LEFT JOIN Etudiant E ON U.UserID = E.EtudiantID
+    LEFT JOIN Groupe G ON E.GroupeID = G.GroupeID
+    LEFT JOIN Formateur F ON U.UserID = F.FormateurID
+    ORDER BY U.Role, U.Nom
+""", ('UserID', 'Nom', 'Name', 'Email', 'Role', 'NomGroupe', 'Matricule', 'CNE'), _user)
+
+# Keyset page ordered by (Role, Nom, UserID); the variant names the filters in use
+USERS_PAGE = statement('users_page', """
+    SELECT TOP (?) U.UserID, U.Nom, CONCAT(U.Nom, ' ', U.Prenom), U.Email, U.Role, G.NomGroupe, F.Matricule, E.CNE
+    FROM Utilisateur U
+    LEFT JOIN Etudiant E ON U.UserID = E.EtudiantID
+    LEFT JOIN Groupe G ON E.GroupeID = G.GroupeID
+    LEFT JOIN Formateur F ON U.UserID = F.FormateurID
+    {where}
+    ORDER BY U.Role, U.Nom, U.UserID
+""", USERS_ALL.columns, _user, variants=filter_variants('where', [
+    ('after', "(U.Role > ? OR (U.Role = ? AND (U.Nom > ? OR (U.Nom = ? AND U.UserID > ?))))"),
+    ('role', "U.Role = ?"),
+    ('group', "(E.GroupeID = ? OR EXISTS (SELECT 1 FROM Affectation A WHERE A.FormateurID = U.UserID AND A.GroupeID = ?))"),
+    ('q', "(U.Nom LIKE ? OR U.Prenom LIKE ? OR U.Email LIKE ? OR E.CNE LIKE ?)"),
+]))
+
+def _user_details(r):
+    """ Student fields only for students, the matricule only for formateurs ('' otherwise) """
+    uid, nom, prenom, email, role, student, cne, group, teacher, matricule = r
+    student = role == 'Etudiant' and student is not None
+    teacher = role == 'Formateur' and teacher is not None
+    return {'id': uid, 'nom': nom, 'prenom': prenom, 'email': email, 'role': role, 'cne': cne if student else '',
+            'matricule': matricule if teacher else '', 'groupe_id': group if student else ''}
+
+
+USER_DETAILS = statement('user_details', """
+    SELECT U.UserID, U.Nom, U.Prenom, U.Email, U.Role, E.EtudiantID, E.CNE, E.GroupeID, F.FormateurID, F.Matricule
+    FROM Utilisateur U
+    LEFT JOIN Etudiant E ON U.UserID = E.EtudiantID
+    LEFT JOIN Formateur F ON U.UserID = F.FormateurID
+    WHERE U.UserID = ?
+""", ('UserID', 'Nom', 'Prenom', 'Email', 'Role', 'EtudiantID', 'CNE', 'GroupeID', 'FormateurID', 'Matricule'),
+    _user_details)
+
+# MotDePasse is compared (stripped) by SchoolDB.login, never returned
+LOGIN = statement('login', "SELECT UserID, CONCAT(Nom, ' ', Prenom), Role, MotDePasse FROM Utilisateur WHERE Email = ?",
+                  ('UserID', 'Name', 'Role', 'MotDePasse'),
+                  (('id', 'UserID'), ('name', 'Name'), ('role', 'Role'), ('hash', 'MotDePasse')))
+
+TEACHER_GROUP_LABELS = statement('teacher_group_labels', """
+    SELECT A.FormateurID, CONCAT(G.NomGroupe, ' (', M.NomModule, ')')
+    FROM Affectation A JOIN Groupe G ON A.GroupeID = G.GroupeID JOIN Module M ON A.ModuleID = M.ModuleID
+""", ('FormateurID', 'Label'))
+
+TEACHER_GROUP_LABELS_FOR = statement('teacher_group_labels_for', """
+    SELECT A.FormateurID, CONCAT(G.NomGroupe, ' (', M.NomModule, ')')
+    FROM Affectation A JOIN Groupe G ON A.GroupeID = G.GroupeID JOIN Module M ON A.ModuleID = M.ModuleID
+    WHERE A.FormateurID IN ({ids})
+""", ('FormateurID', 'Label'), variants={f"in{n}": {'ids': ', '.join('?' * n)} for n in ID_LIST_SIZES})
+
+GROUPS_BY_FILIERE = statement('groups_by_filiere', """
+    SELECT F.NomFiliere, G.GroupeID, G.NomGroupe FROM Groupe G JOIN Filiere F ON G.FiliereID = F.FiliereID
+""", ('NomFiliere', 'GroupeID', 'NomGroupe'))
+
+ALL_MODULES = statement('all_modules', "SELECT ModuleID, NomModule FROM Module",
+                        ('ModuleID', 'NomModule'), (('id', 'ModuleID'), ('name', 'NomModule')))
+
+ALL_TEACHERS = statement('all_teachers', "SELECT UserID, CONCAT(Nom, ' ', Prenom) FROM Utilisateur WHERE Role='Formateur'",
+                         ('UserID', 'Name'), (('id', 'UserID'), ('name', 'Name')))
+
+TEACHER_ASSIGNMENTS = statement('teacher_assignments', """
+    SELECT A.AffectationID, G.NomGroupe, M.NomModule
+    FROM Affectation A JOIN Groupe G ON A.GroupeID=G.GroupeID JOIN Module M ON A.ModuleID=M.ModuleID
+    WHERE A.FormateurID=?
+""", ('AffectationID', 'NomGroupe', 'NomModule'), (('id', 'AffectationID'), ('group', 'NomGroupe'), ('module', 'NomModule')))
+
+TEACHER_MODULES = statement('teacher_modules', """
+    SELECT M.ModuleID, M.NomModule, G.GroupeID, G.NomGroupe
+    FROM Affectation A
+    JOIN Module M ON A.ModuleID = M.ModuleID
+    JOIN Groupe G ON A.GroupeID = G.GroupeID
+    WHERE A.FormateurID = ?
+""", ('ModuleID', 'NomModule', 'GroupeID', 'NomGroupe'),
+    (('module_id', 'ModuleID'), ('module_name', 'NomModule'), ('group_id', 'GroupeID'), ('group_name', 'NomGroupe')))
+
+# --- CONTENT ---
+TPS_GLOBAL = statement('tps_global', f"""
+    SELECT TP.TPID, TP.Titre, ISNULL({iso_minutes('TP.DateLimite')}, 'No Deadline'),
+           ISNULL(G.NomGroupe, 'No Group'), ISNULL(M.NomModule, 'General'),
+           CONCAT(ISNULL(U.Nom, 'System'), ' ', ISNULL(U.Prenom, 'Admin'))
+    FROM TP
+    LEFT JOIN Groupe G ON TP.GroupeID = G.GroupeID
+    LEFT JOIN Module M ON TP.ModuleID = M.ModuleID
+    LEFT JOIN Utilisateur U ON TP.FormateurID = U.UserID
+    ORDER BY TP.DateLimite DESC
+""", ('TPID', 'Titre', 'Deadline', 'GroupName', 'ModuleName', 'Teacher'),
+    (('id', 'TPID'), ('titre', 'Titre'), ('deadline', 'Deadline'), ('group', 'GroupName'), ('module', 'ModuleName'),
+     ('teacher', 'Teacher')))
+
+_STUDENT_TP_FIELDS = (('id', 'TPID'), ('titre', 'Titre'), ('description', 'Description'), ('deadline', 'Deadline'),
+                      ('module', 'NomModule'))
+
+STUDENT_TPS = statement('student_tps', f"""
+    SELECT TP.TPID, TP.Titre, TP.Description, {iso_seconds('TP.DateLimite')}, M.NomModule
+    FROM TP JOIN Module M ON TP.ModuleID = M.ModuleID
+    WHERE TP.GroupeID = ?
+    ORDER BY TP.DateLimite DESC
+""", ('TPID', 'Titre', 'Description', 'Deadline', 'NomModule'), _STUDENT_TP_FIELDS)
+
+# Rows below MIN_ACTIVE_ROWVERSION are committed: a slower writer can't slip in behind the cursor
+STUDENT_TPS_SINCE = statement('student_tps_since', f"""
+    SELECT TP.TPID, TP.Titre, TP.Description, {iso_seconds('TP.DateLimite')}, M.NomModule, CAST(TP.RowVer AS BIGINT)
+    FROM Etudiant E
+    JOIN TP ON TP.GroupeID = E.GroupeID
+    JOIN Module M ON TP.ModuleID = M.ModuleID
+    WHERE E.EtudiantID = ? AND TP.RowVer > CONVERT(BINARY(8), CAST(? AS BIGINT)) AND TP.RowVer < MIN_ACTIVE_ROWVERSION()
+    ORDER BY TP.DateLimite DESC
+""", ('TPID', 'Titre', 'Description', 'Deadline', 'NomModule', 'Ver'), _STUDENT_TP_FIELDS)
+
+TP_OWNERS = statement('tp_owners', "SELECT TPID, FormateurID FROM TP WHERE TPID IN ({ids})", ('TPID', 'FormateurID'),
+                      variants={f"in{n}": {'ids': ', '.join('?' * n)} for n in ID_LIST_SIZES})
+
+# Who may read a stored file: its teacher, a teacher assigned to its group and module, or the student
+# it belongs to (their own submission, their group's TP / annonce). Params: row id, then the user id 3 times
+FILE_ACCESS = statement('file_access', """
+    SELECT COUNT(*) FROM {source}
+    WHERE {key} = ? AND (X.FormateurID = ?
+        OR EXISTS (SELECT 1 FROM Affectation A WHERE A.FormateurID = ? AND A.GroupeID = X.GroupeID AND A.ModuleID = X.ModuleID)
+        OR {student})
+""", ('Allowed',), variants={
+    'tp': {'source': 'TP X', 'key': 'X.TPID',
+           'student': 'EXISTS (SELECT 1 FROM Etudiant E WHERE E.EtudiantID = ? AND E.GroupeID = X.GroupeID)'},
+    'submission': {'source': 'Soumission S JOIN TP X ON S.TPID = X.TPID', 'key': 'S.SoumissionID',
+                   'student': 'S.EtudiantID = ?'},
+    'annonce': {'source': 'Annonce X', 'key': 'X.AnnonceID',
+                'student': 'EXISTS (SELECT 1 FROM Etudiant E WHERE E.EtudiantID = ? AND E.GroupeID = X.GroupeID)'},
+})
+
+SUBMISSIONS_FOR_TP = statement('submissions_for_tp', f"""
+    SELECT S.SoumissionID, CONCAT(U.Nom, ' ', U.Prenom), {day_month_time('S.DateSoumission')}, S.Note, S.FichierNom
+    FROM Soumission S JOIN Utilisateur U ON S.EtudiantID=U.UserID
+    WHERE S.TPID=?
+    ORDER BY U.Nom
+""", ('SoumissionID', 'Name', 'Submitted', 'Note', 'FichierNom'),
+    (('id', 'SoumissionID'), ('student', 'Name'), ('date', 'Submitted'), ('grade', 'Note', blank), ('file_name', 'FichierNom')))
+
+FORMATEUR_HISTORY = statement('formateur_history', f"""
+    SELECT TPID AS ID, Titre, DateLimite AS D, {iso_minutes('DateLimite')} AS Shown, 'TP' AS T,
+           ISNULL(G.NomGroupe, 'N/A'), ISNULL(M.NomModule, 'N/A')
+    FROM TP
+    LEFT JOIN Groupe G ON TP.GroupeID = G.GroupeID
+    LEFT JOIN Module M ON TP.ModuleID = M.ModuleID
+    WHERE FormateurID = ?
+    UNION ALL
+    SELECT AnnonceID, Titre, DatePublication, {iso_minutes('DatePublication')}, 'Annonce',
+           ISNULL(G.NomGroupe, 'N/A'), ISNULL(M.NomModule, 'N/A')
+    FROM Annonce
+    LEFT JOIN Groupe G ON Annonce.GroupeID = G.GroupeID
+    LEFT JOIN Module M ON Annonce.ModuleID = M.ModuleID
+    WHERE FormateurID = ?
+    ORDER BY D DESC
+""", ('ID', 'Titre', 'D', 'Shown', 'T', 'NomGroupe', 'NomModule'),
+    (('id', 'ID'), ('title', 'Titre'), ('date', 'Shown'), ('type', 'T'), ('group', 'NomGroupe'), ('module', 'NomModule')))
+
+# --- ATTENDANCE ---
+STUDENTS_WITH_PRESENCE = statement('students_with_presence', """
+    SELECT E.EtudiantID, CONCAT(U.Nom, ' ', U.Prenom), E.CNE, ISNULL(P.Etat, 'Pending')
+    FROM Etudiant E JOIN Utilisateur U ON E.EtudiantID=U.UserID
+    LEFT JOIN Presence P ON E.EtudiantID=P.EtudiantID AND P.SeanceID=?
+    WHERE E.GroupeID=?
+    ORDER BY U.Nom
+""", ('EtudiantID', 'Name', 'CNE', 'Etat'), (('id', 'EtudiantID'), ('name', 'Name'), ('cne', 'CNE'), ('status', 'Etat')))
+
+PRESENCE_STATS = statement('presence_stats', f"""
+    SELECT {iso_date('A.Jour')}, ISNULL(G.NomGroupe, 'N/A'),
+           ISNULL(CAST(ROUND(SUM(A.Presents) * 100.0 / NULLIF(SUM(A.Total), 0), 1) AS FLOAT), 0)
+    FROM PresenceAgg A
+    LEFT JOIN Groupe G ON A.GroupeID = G.GroupeID
+    {{where}}
+    GROUP BY A.Jour, G.NomGroupe
+""", ('Day', 'GroupName', 'Rate'), (('date', 'Day'), ('group', 'GroupName'), ('rate', 'Rate')),
+    variants={'all': {'where': ''}, 'teacher': {'where': 'WHERE A.FormateurID = ?'}})
+
+ABSENCE_COUNTS = statement('absence_counts', """
+    SELECT C.EtudiantID, C.ModuleID, CONCAT(U.Nom, ' ', U.Prenom), E.CNE, G.NomGroupe, M.NomModule, SUM(C.Absences)
+    FROM AbsenceCounter C
+    JOIN Etudiant E ON C.EtudiantID = E.EtudiantID
+    JOIN Utilisateur U ON E.EtudiantID = U.UserID
+    LEFT JOIN Groupe G ON C.GroupeID = G.GroupeID
+    LEFT JOIN Module M ON C.ModuleID = M.ModuleID
+    WHERE C.Absences > 0 {filter}
+    GROUP BY C.EtudiantID, C.ModuleID, U.Nom, U.Prenom, E.CNE, G.NomGroupe, M.NomModule
+""", ('EtudiantID', 'ModuleID', 'Name', 'CNE', 'NomGroupe', 'NomModule', 'Cnt'),
+    variants={'all': {'filter': ''}, 'teacher': {'filter': 'AND C.FormateurID = ?'}})
+
+# Dates of the students shown in the absence report only (IX_Presence_Etudiant)
+ABSENCE_DATES = statement('absence_dates', f"""
+    SELECT P.EtudiantID, ISNULL(S.ModuleID, 0), ISNULL(S.FormateurID, 0), {day_month('S.DateDebut')}
+    FROM Presence P
+    JOIN Seance S ON P.SeanceID = S.SeanceID
+    WHERE P.EtudiantID IN ({{ids}}) AND P.Etat = 'Absent'
+    ORDER BY S.DateDebut
+""", ('EtudiantID', 'ModuleID', 'FormateurID', 'Shown'),
+    variants={f"in{n}": {'ids': ', '.join('?' * n)} for n in ID_LIST_SIZES})
+
+# Sessions held so far: pre-generated séances (pregenerate_seances) only count once they start
+SEANCE_COUNT = statement('seance_count', "SELECT COUNT(*) FROM Seance WHERE DateDebut <= GETDATE() {filter}", ('Total',),
+                         variants={'all': {'filter': ''}, 'teacher': {'filter': 'AND FormateurID = ?'}})
+
+# A séance's attendance is kept by its teacher or a teacher assigned to its group and module
+SEANCE_ACCESS = statement('seance_access', """
+    SELECT COUNT(*) FROM Seance X
+    WHERE X.SeanceID = ? AND (X.FormateurID = ?
+        OR EXISTS (SELECT 1 FROM Affectation A WHERE A.FormateurID = ? AND A.GroupeID = X.GroupeID AND A.ModuleID = X.ModuleID))
+""", ('Allowed',))
+
+# A teacher works with a group they are assigned to (any module) or have set a TP for. Params: teacher, group, twice
+GROUP_ACCESS = statement('group_access', """
+    SELECT (SELECT COUNT(*) FROM Affectation WHERE FormateurID = ? AND GroupeID = ?)
+         + (SELECT COUNT(*) FROM TP WHERE FormateurID = ? AND GroupeID = ?)
+""", ('Allowed',))
+
+# Séance slots: sargable day ranges on DateDebut (IX_Seance_Slot / IX_Seance_DateDebut, migrations/005)
+SEANCE_LOOKUP = statement('seance_lookup', """
+    SELECT TOP 1 SeanceID FROM Seance
+    WHERE FormateurID = ? AND GroupeID = ? AND ModuleID = ? AND DateDebut >= ? AND DateDebut < DATEADD(day, 1, ?)
+    ORDER BY SeanceID
+""", ('SeanceID',))
+
+SEANCE_WINDOW = statement('seance_window', f"""
+    SELECT SeanceID, FormateurID, GroupeID, ModuleID, {iso_date('DateDebut')}
+    FROM Seance
+    WHERE DateDebut >= ? AND DateDebut < ?
+    ORDER BY SeanceID DESC
+""", ('SeanceID', 'FormateurID', 'GroupeID', 'ModuleID', 'Day'))
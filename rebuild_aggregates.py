@@ -0,0 +1,8 @@
+# rebuild_aggregates.py : regenerate PresenceAgg / AbsenceCounter from Presence x Seance
+from db_manager import SchoolDB
+
+with SchoolDB() as db:
+    if db.rebuild_attendance_aggregates():
+        print("✅ Attendance aggregates rebuilt.")
+    else:
+        print("❌ ERROR: rebuild failed (see log).")
@@ -0,0 +1,356 @@
+""" RPC sessions: signed tokens, in-memory session store, login throttling.
+
+login returns a token "<uid>.<role>.<issued ms>.<expires>.<session id>.<hmac>". Clients
+send it back in the X-RPC-Token header; it is checked locally (HMAC + expiry + the
+session store), never against the DB. With RPC_REQUIRE_TOKEN=1 every method except the
+PUBLIC ones needs a valid token.
+
+A call that carries a token (always, with RPC_REQUIRE_TOKEN=1) is held to METHODS: the
+roles allowed to call the method, and the arguments that must name the caller or
+something they own (their own student / teacher id, a TP, submission or séance of their
+classes). Direction may pass any id. Without RPC_REQUIRE_TOKEN=1, calls without a token
+are still served as before: app.py warns about it at startup.
+
+Logins themselves go through authenticate(): successful credentials are cached for
+RPC_CRED_TTL, wrong ones are negatively cached for RPC_NEGATIVE_TTL, and more than
+RPC_LOGIN_MAX_FAILURES failures for one email from one client address within
+RPC_LOGIN_WINDOW lock further attempts at that email from that address out. The address
+alone is never throttled: every RPC login comes from the Django server and every web login
+from the ngrok tunnel, so other users keep logging in. A successful login clears the count.
+
+Revocations (update_user / delete_user / logout) are written to a SQLite file shared by
+every worker process (RPC_REVOCATIONS); each process mirrors it and re-reads it only when
+another process has written to it since, so validate() stays free of DB round trips.
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import sqlite3
+import tempfile
+import threading
+import contextlib
+import contextvars
+
+from cache import TTLCache, make_key
+
+TOKEN_TTL = int(os.getenv('RPC_TOKEN_TTL', str(8 * 3600)))
+REQUIRE_TOKEN = os.getenv('RPC_REQUIRE_TOKEN', '0') == '1'
+CRED_TTL = float(os.getenv('RPC_CRED_TTL', '300'))
+NEGATIVE_TTL = float(os.getenv('RPC_NEGATIVE_TTL', '30'))
+MAX_FAILURES = int(os.getenv('RPC_LOGIN_MAX_FAILURES', '5'))
+LOGIN_WINDOW = float(os.getenv('RPC_LOGIN_WINDOW', '300'))
+# Shared by every worker process: set it explicitly when running several
+SECRET = (os.getenv('RPC_TOKEN_SECRET') or os.getenv('FLASK_SECRET_KEY') or secrets.token_hex(32)).encode()
+REVOCATIONS_PATH = os.getenv('RPC_REVOCATIONS', os.path.join(tempfile.gettempdir(), 'rpc_revocations.db'))
+
+PUBLIC = {'login', 'logout', 'whoami', 'system.listMethods', 'system.methodHelp', 'system.methodSignature', 'system.multicall'}
+
+ANYONE = ('Direction', 'Formateur', 'Etudiant')
+STUDENT = ('Direction', 'Etudiant')
+TEACHER = ('Direction', 'Formateur')
+
+# method -> (roles allowed, {argument: what it must name}), see _owns(). Unlisted methods: ANYONE
+METHODS = {
+    'wait_events': (ANYONE, {}),
+    'get_student_tps': (STUDENT, {'student_id': 'self'}),
+    'get_student_portal': (STUDENT, {'student_id': 'self'}),
+    'submit_rapport': (STUDENT, {'student_id': 'self', 'tp_id': 'tp'}),
+    'get_teacher_data': (TEACHER, {'fid': 'self'}),
+    'get_teacher_portal': (TEACHER, {'fid': 'self', 'tp_id': 'tp'}),
+    'get_submissions': (TEACHER, {'tp_id': 'tp'}),
+    'grade_submission': (TEACHER, {'sid': 'submission'}),
+    'grade_submissions': (TEACHER, {'tp_id': 'tp', 'grades': 'grades'}),
+    'resolve_seance': (TEACHER, {'formateur_id': 'self'}),
+    'pregenerate_seances': (TEACHER, {}),
+    'get_session_students': (TEACHER, {'seance_id': 'seance'}),
+    'get_attendance_sheet': (TEACHER, {'seance_id': 'seance'}),
+    'save_attendance': (TEACHER, {'seance_id': 'seances'}),
+    'begin_upload': (ANYONE, {'meta': 'upload'}),
+    'journal_conflicts': (TEACHER, {}),
+}
+
+
+class AuthRequired(Exception):
+    """ Missing, forged, expired or revoked token """
+
+
+class RateLimited(Exception):
+    """ Too many failed logins for this email / client """
+
+
+def _store(max_entries, ttl):
+    store = TTLCache(max_entries=max_entries, ttl=ttl)
+    store.enabled = True  # not subject to CACHE_DISABLED / the admin debug toggle
+    return store
+
+sessions = _store(int(os.getenv('RPC_SESSIONS_MAX', '5000')), TOKEN_TTL)
+credentials = _store(2048, CRED_TTL)
+failures = _store(4096, LOGIN_WINDOW)
+revoked = _store(100000, TOKEN_TTL)
+
+_revoked_users = {}  # user id -> time.time() of the last change
+_lock = threading.Lock()
+_context = contextvars.ContextVar('rpc_auth', default=(None, None))
+
+
+class RevocationLog:
+    """ Logouts and user revocations shared by the worker processes through one SQLite file """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS revocation (
+        seq  INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,  -- 'logout' (key: session id) or 'user' (key: user id)
+        key  TEXT NOT NULL,
+        at   REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.after_fork()
+
+    def after_fork(self):
+        """ In a forked worker: own SQLite handle (opened on first use) and a full re-read """
+        self._lock = threading.Lock()
+        self._db = None
+        self._version = None
+        self._seq = 0
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(self.SCHEMA)
+        return self._db
+
+    def add(self, kind, key, at):
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM revocation WHERE at < ?", (at - TOKEN_TTL,))  # their tokens have expired
+            db.execute("INSERT INTO revocation (kind, key, at) VALUES (?,?,?)", (kind, key, at))
+
+    def sync(self):
+        """ Applies what was revoked since the last call. One PRAGMA when no other process wrote """
+        with self._lock:
+            db = self._conn()
+            version = db.execute('PRAGMA data_version').fetchone()[0]  # moves on other connections' commits
+            if version == self._version:
+                return
+            self._version = version
+            rows = db.execute("SELECT seq, kind, key, at FROM revocation WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+            if rows: self._seq = rows[-1][0]
+        for _, kind, key, at in rows:
+            _apply(kind, key, at)
+
+
+revocations = RevocationLog(REVOCATIONS_PATH)
+os.register_at_fork(after_in_child=revocations.after_fork)
+
+
+def _apply(kind, key, at):
+    if kind == 'logout':
+        revoked.set(make_key('logout', (key,)), True, ttl=max(at + TOKEN_TTL - time.time(), 1))
+        sessions.invalidate('session', key)
+    else:
+        with _lock:
+            _revoked_users[key] = max(_revoked_users.get(key, 0), at)
+
+
+# --- TOKENS ---
+def _sign(body):
+    digest = hmac.new(SECRET, body.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def issue(user):
+    """ New token for a logged-in user dict (id, role, ...) """
+    sid = secrets.token_urlsafe(12)
+    now = time.time()
+    body = f"{user['id']}.{user['role']}.{int(now * 1000)}.{int(now + TOKEN_TTL)}.{sid}"
+    sessions.set(make_key('session', (sid,)), user)
+    return body + '.' + _sign(body)
+
+
+def validate(token):
+    """ The session's user dict, or None. No DB access """
+    parts = str(token or '').split('.')
+    if len(parts) != 6:
+        return None
+    body, sig = '.'.join(parts[:5]), parts[5]
+    if not hmac.compare_digest(sig, _sign(body)):
+        return None
+    uid, role, issued, expires, sid = parts[:5]
+    if int(expires) < time.time():
+        return None
+    revocations.sync()
+    if revoked.get(make_key('logout', (sid,)), None):
+        return None
+    if _revoked_users.get(uid, 0) * 1000 >= int(issued):
+        return None
+    key = make_key('session', (sid,))
+    user = sessions.get(key, None)
+    if user is None:
+        # Signed by us but not in this process's store (restart, other worker, LRU eviction)
+        user = {'id': int(uid), 'role': role}
+        sessions.set(key, user, ttl=max(int(expires) - time.time(), 1))
+    return user
+
+
+def logout(token):
+    parts = str(token or '').split('.')
+    if len(parts) != 6 or validate(token) is None:
+        return False
+    now = time.time()
+    revocations.add('logout', parts[4], now)
+    _apply('logout', parts[4], now)
+    return True
+
+
+def revoke_user(user_id):
+    """ Drops every token and cached credential of a user (password/role change, deletion) """
+    now = time.time()
+    revocations.add('user', str(user_id), now)
+    _apply('user', str(user_id), now)
+
+
+# --- LOGIN ---
+def _locked(keys):
+    return any(failures.get(k, 0) >= MAX_FAILURES for k in keys)
+
+
+def _record_failure(keys):
+    with _lock:
+        for k in keys:
+            failures.set(k, failures.get(k, 0) + 1)
+
+
+def _clear_failures(keys):
+    with _lock:
+        for k in keys:
+            failures.invalidate(*k)
+
+
+def authenticate(email, password, client=None):
+    """ Checks credentials (password in clear or as its SHA-256). Returns the user or None.
+        Raises RateLimited once this email has failed too often from this client """
+    email = str(email or '').strip()
+    login = email.lower()
+    pw_hash = password if len(password) == 64 else hashlib.sha256(password.encode()).hexdigest()
+    keys = [make_key('login', (login, client or ''))]
+    if _locked(keys):
+        raise RateLimited(f"too many failed logins, retry in {int(LOGIN_WINDOW)}s")
+
+    hit = credentials.get(make_key('cred', (login,)), None)
+    if hit: revocations.sync()
+    if hit and hmac.compare_digest(hit[0], pw_hash) and _revoked_users.get(str(hit[1]['id']), 0) < hit[2]:
+        _clear_failures(keys)
+        return hit[1]
+    if credentials.get(make_key('bad', (login, pw_hash)), None):
+        user = None
+    else:
+        from db_manager import SchoolDB
+        with SchoolDB() as db:
+            user = db.login(email, pw_hash)
+        if user:
+            credentials.set(make_key('cred', (login,)), (pw_hash, user, time.time()))
+        else:
+            credentials.set(make_key('bad', (login, pw_hash)), True, ttl=NEGATIVE_TTL)
+    if not user:
+        _record_failure(keys)
+        return None
+    _clear_failures(keys)
+    return user
+
+
+# --- REQUEST BINDING ---
+@contextlib.contextmanager
+def bound(token, client=None):
+    """ Makes the request's token / client address visible to check() and the handlers """
+    reset = _context.set((token, client))
+    try:
+        yield
+    finally:
+        _context.reset(reset)
+
+
+def call_with_token(token, client, fn, *args):
+    with bound(token, client):
+        return fn(*args)
+
+
+def current_token():
+    return _context.get()[0]
+
+
+def current_client():
+    return _context.get()[1]
+
+
+def current_user():
+    token = current_token()
+    return validate(token) if token else None
+
+
+def require_role(*roles):
+    """ The calling user if their token carries one of roles, else AuthRequired """
+    user = current_user()
+    if user is None or user.get('role') not in roles:
+        raise AuthRequired(f"needs a valid X-RPC-Token for: {', '.join(roles)}")
+    return user
+
+
+def _owns(db, user, kind, value, args):
+    """ Whether the argument value (of kind, see METHODS) is the caller's own """
+    if kind == 'self':
+        return str(value) == str(user['id'])
+    if kind in ('tp', 'submission'):
+        return db.can_read_file(kind, value, user)
+    if kind == 'seance':
+        return db.can_manage_seance(value, user)
+    if kind == 'seances':  # save_attendance(seance_id, ...) or save_attendance([{'seance_id', 'presence'}, ...])
+        ids = {s.get('seance_id') for s in value if isinstance(s, dict)} if isinstance(value, list) else {value}
+        return all(db.can_manage_seance(sid, user) for sid in ids)
+    if kind == 'grades':  # with a tp_id, save_grades only touches that TP's submissions
+        if args.get('tp_id') is not None: return True
+        sids = {g.get('submission_id') if isinstance(g, dict) else (list(g) or [None])[0] for g in value or []}
+        return all(db.can_read_file('submission', sid, user) for sid in sids)
+    if kind == 'upload':  # begin_upload meta: a submission of the caller / a TP of the caller's classes
+        meta = value if isinstance(value, dict) else {}
+        if user['role'] == 'Etudiant':
+            return str(meta.get('student_id')) == str(user['id']) and db.can_read_file('tp', meta.get('tp_id'), user)
+        return user['role'] == 'Formateur' and str(meta.get('formateur_id')) == str(user['id'])
+    raise ValueError(f"unknown ownership kind: {kind}")
+
+
+def check(method, args=None):
+    """ Raises AuthRequired when this call's token is missing (tokens mandatory) or does not allow it:
+        wrong role for the method, or an id argument naming someone else (see METHODS) """
+    if method in PUBLIC:
+        return
+    user = current_user()
+    if user is None:
+        if REQUIRE_TOKEN:
+            raise AuthRequired(f"{method} needs a valid X-RPC-Token")
+        return
+    roles, owned = METHODS.get(method, (ANYONE, {}))
+    if user.get('role') not in roles:
+        raise AuthRequired(f"{method} is not allowed for {user.get('role')}")
+    if user['role'] == 'Direction':
+        return
+    args = args or {}
+    checks = [(name, kind) for name, kind in owned.items() if args.get(name) is not None]
+    if not checks:
+        return
+    from db_manager import SchoolDB
+    with SchoolDB() as db:
+        for name, kind in checks:
+            if not _owns(db, user, kind, args[name], args):
+                raise AuthRequired(f"{method}: {name} is not yours")
+
+
+def stats():
+    return {"sessions": sessions.stats()["entries"], "failed_logins": failures.stats()["entries"],
+            "cached_credentials": credentials.stats()["entries"], "revoked_users": len(_revoked_users)}
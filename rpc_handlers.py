@@ -1,53 +1,216 @@
-from db_manager import SchoolDB
-
-# --- AUTHENTICATION ---
-def rpc_login(email, password_hash):
-    with SchoolDB() as db: 
-        return db.login(email, password_hash)
-
-# --- STUDENT PORTAL FUNCTIONS ---
-def rpc_get_student_tps(student_id):
-    """ Returns TPs specific to the student's group """
-    with SchoolDB() as db:
-        u = db.get_user_details(student_id)
-        if u and u.get('groupe_id'):
-            return db.get_tps_for_student(u['groupe_id'])
-        return []
-
-def rpc_submit_rapport(tp_id, student_id, file_data_base64, file_name, file_type):
-    """ RPC version of TP submission (accepts base64 from Django) """
-    import base64
-    try:
-        file_bytes = base64.b64decode(file_data_base64)
-        with SchoolDB() as db:
-            return db.submit_rapport_file(tp_id, student_id, file_bytes, file_name, file_type)
-    except Exception:
-        return False
-
-# --- FORMATEUR PORTAL FUNCTIONS ---
-def rpc_get_teacher_data(fid):
-    """ Returns both assignments (for selectors) and history (for the table) """
-    with SchoolDB() as db:
-        assignments = db.get_teacher_modules(fid)
-        history = db.get_formateur_history_mixed(fid)
-        return {'assignments': assignments, 'history': history}
-
-def rpc_get_submissions(tp_id):
-    """ Get student reports for a specific TP to be graded """
-    with SchoolDB() as db: 
-        return db.get_submissions_for_tp(tp_id)
-
-def rpc_grade_submission(sid, grade):
-    """ Save a grade for a student submission """
-    with SchoolDB() as db: 
-        return db.save_grade(sid, grade)
-
-def rpc_get_session_students(group_id, seance_id):
-    """ Used for the presence marking interface """
-    with SchoolDB() as db:
-        return db.get_students_with_presence(group_id, seance_id)
-
-def rpc_save_attendance(seance_id, presence_list):
-    """ Saves bulk attendance data """
-    with SchoolDB() as db:
-        return db.save_bulk_presence(seance_id, presence_list)
\ No newline at end of file
+from xmlrpc.client import Binary
+from db_manager import SchoolDB, BLOB_CHUNK
+from db_pool import BackendUnavailable
+from transfers import uploads, as_bytes
+from journal import journal
+import rpc_auth
+import events
+
+# --- AUTHENTICATION ---
+def rpc_login(email, password_hash):
+    """ Returns the user plus a session token to send back in the X-RPC-Token header, or None """
+    user = rpc_auth.authenticate(email, password_hash, rpc_auth.current_client())
+    if not user: return None
+    return dict(user, token=rpc_auth.issue(user), expires_in=rpc_auth.TOKEN_TTL)
+
+def rpc_logout(token=None):
+    """ Revokes the token (argument, or the X-RPC-Token header) """
+    return rpc_auth.logout(token or rpc_auth.current_token())
+
+def rpc_whoami():
+    """ The user behind the X-RPC-Token header, or None """
+    return rpc_auth.current_user()
+
+# --- CHANGE FEED ---
+def rpc_wait_events(topics=None, after=None, timeout=10):
+    """ Long-poll: blocks up to timeout seconds for events on topics ('teacher:7', 'group:3', 'tp:12',
+        'student:41'). Needs a token; topics are narrowed to what the caller may see (events.allowed_topics).
+        Pass the returned cursor as `after` next time; reset=True means refetch the state
+        (a cursor from another feed, e.g. a replaced EVENTS_DB, always resets). Ids and cursor are strings """
+    topics = feed_topics(topics)
+    return feed_reply(*events.bus.wait(topics, after or None, timeout))
+
+def feed_topics(topics=None):
+    """ The caller's allowed topics; AuthRequired without a token (also used by async_server) """
+    if not events.ENABLED:
+        raise events.FeedDisabled("change feed is off (EVENTS_FEED=0)")
+    return events.allowed_topics(rpc_auth.require_role('Direction', 'Formateur', 'Etudiant'), topics)
+
+def feed_reply(found, cursor, reset):
+    return {'events': found, 'cursor': cursor, 'reset': reset}
+
+# --- STUDENT PORTAL FUNCTIONS ---
+def rpc_get_student_tps(student_id, since=None):
+    """ Returns TPs specific to the student's group.
+        With `since` (the cursor of the previous poll, "0" the first time) returns
+        {'tps': only TPs added/changed since, 'cursor': pass it on the next poll} """
+    with SchoolDB() as db:
+        tps, cursor = db.get_student_tps_since(student_id, since or 0)
+    if since is None:
+        return tps
+    # rowversions overflow XML-RPC's 32-bit int: the cursor travels as a string
+    return {'tps': tps, 'cursor': str(cursor)}
+
+def rpc_submit_rapport(tp_id, student_id, file_data_base64, file_name, file_type):
+    """ RPC version of TP submission (base64 from Django, raw bytes over MessagePack) """
+    try:
+        file_bytes = as_bytes(file_data_base64)
+        with SchoolDB() as db:
+            return db.submit_rapport_file(tp_id, student_id, file_bytes, file_name, file_type)
+    except BackendUnavailable:
+        raise
+    except Exception:
+        return False
+
+# --- CHUNKED FILE TRANSFERS ---
+def rpc_begin_upload(kind, meta, total_size):
+    """ kind is 'submission' or 'tp'; meta holds the row fields. Returns {upload_id, received} """
+    return uploads.begin(kind, meta, total_size)
+
+def rpc_put_chunk(upload_id, offset, data):
+    """ Appends one chunk (Binary or base64). Resume by asking upload_status for 'received' """
+    return uploads.put_chunk(upload_id, offset, as_bytes(data))
+
+def rpc_upload_status(upload_id):
+    return uploads.get(upload_id).status()
+
+def rpc_abort_upload(upload_id):
+    return uploads.abort(upload_id)
+
+def rpc_commit_upload(upload_id, sha256_hex):
+    """ Verifies the checksum and writes the spooled file to the DB in chunks. Returns the new row id """
+    def store(up):
+        m = up.meta
+        with SchoolDB() as db:
+            if up.kind == 'submission':
+                return db.submit_rapport_stream(m['tp_id'], m['student_id'], up.iter_file(), m['file_name'], m['file_type'])
+            return db.create_tp_stream(m['titre'], m.get('description', ''), up.iter_file(), m['file_name'], m['file_type'],
+                                       m['deadline'], m['module_id'], m['formateur_id'], m['groupe_id'])
+    return uploads.commit(upload_id, sha256_hex, store)
+
+def _check_file_access(db, kind, file_id):
+    """ AuthRequired unless the caller's token may read the file (SchoolDB.can_read_file) """
+    user = rpc_auth.require_role('Direction', 'Formateur', 'Etudiant')
+    if not db.can_read_file(kind, file_id, user):
+        raise rpc_auth.AuthRequired(f"{kind} {file_id} is not readable with this token")
+
+def rpc_get_file_info(kind, file_id):
+    """ Size, name, type and hash of a file the caller may read (token required), None if missing """
+    with SchoolDB() as db:
+        info = db.get_blob_info(kind, file_id)
+        if info: _check_file_access(db, kind, file_id)
+        return info
+
+def rpc_read_file_chunk(kind, file_id, offset, length):
+    """ Range read of a stored TP/submission file the caller may read, returned as Binary. At most BLOB_CHUNK
+        bytes per call: read on from offset + len(data) until it comes back empty """
+    offset, length = int(offset), int(length)
+    if offset < 0 or length < 0:
+        raise ValueError("offset and length must be >= 0")
+    length = min(length, BLOB_CHUNK)
+    with SchoolDB() as db:
+        _check_file_access(db, kind, file_id)
+        return Binary(b''.join(db.iter_blob(kind, file_id, offset, offset + length)))
+
+# --- FORMATEUR PORTAL FUNCTIONS ---
+def rpc_get_teacher_data(fid):
+    """ Returns both assignments (for selectors) and history (for the table) """
+    with SchoolDB() as db:
+        assignments = db.get_teacher_modules(fid)
+        history = db.get_formateur_history_mixed(fid)
+        return {'assignments': assignments, 'history': history}
+
+# --- BATCHED PAGE BOOTSTRAP (one round trip, one DB session) ---
+def rpc_get_teacher_portal(fid, tp_id=None):
+    """ Everything the teacher page needs: assignments, history and (optionally) a TP's submissions """
+    with SchoolDB() as db:
+        data = {'assignments': db.get_teacher_modules(fid),
+                'history': db.get_formateur_history_mixed(fid),
+                'submissions': []}
+        if tp_id:
+            data['submissions'] = db.get_submissions_for_tp(tp_id)
+        return data
+
+def rpc_get_student_portal(student_id):
+    """ Student profile and the TPs of their group in a single call """
+    with SchoolDB() as db:
+        u = db.get_user_details(student_id)
+        tps = db.get_tps_for_student(u['groupe_id']) if u and u.get('groupe_id') else []
+        return {'profile': u, 'tps': tps}
+
+def rpc_get_attendance_sheet(group_id, seance_id):
+    """ Students of the group with their presence for the séance """
+    with SchoolDB() as db:
+        return {'seance_id': seance_id,
+                'students': db.get_students_with_presence(group_id, seance_id)}
+
+def rpc_get_submissions(tp_id):
+    """ Get student reports for a specific TP to be graded """
+    with SchoolDB() as db: 
+        return db.get_submissions_for_tp(tp_id)
+
+def _submission_id(g):
+    return g.get('submission_id') if isinstance(g, dict) else list(g)[0]
+
+def rpc_grade_submission(sid, grade, idem_key=None):
+    """ Save a grade for a student submission. With the write journal on, True means queued
+        (journal_status(idem_key) follows it) """
+    if journal:
+        journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': sid, 'grade': grade}]}, idem_key)
+        return True
+    result = rpc_grade_submissions(None, [{'submission_id': sid, 'grade': grade}])
+    return result[0]['result'] == 'updated'
+
+def rpc_grade_submissions(tp_id, grades, idem_key=None):
+    """ Grades a whole TP in one call: grades is a list of {'submission_id', 'grade', 'comment'}
+        (or [id, grade, comment] lists). Returns [{'submission_id', 'result'}], result 'queued'
+        for every row when the write journal is on """
+    if journal:
+        journal.record('grade', {'tp_id': tp_id, 'grades': grades}, idem_key)
+        return [{'submission_id': _submission_id(g), 'result': 'queued'} for g in grades]
+    with SchoolDB() as db:
+        return db.save_grades(tp_id, grades)
+
+def rpc_resolve_seance(formateur_id, group_id, module_id, date):
+    """ SeanceID for the teacher's group/module on date (YYYY-MM-DD), created if missing """
+    with SchoolDB() as db:
+        return db.get_or_create_seance(formateur_id, group_id, module_id, date)
+
+def rpc_pregenerate_seances(date_from, date_to, weekdays=None, formateur_id=None, group_id=None):
+    """ Creates a term's séances from the assignments in one transaction (weekdays: 0 = Monday).
+        Needs a Direction token, or a Formateur one (then only the caller's own séances).
+        Returns {'created', 'from', 'to'}, or {'error'} for bad dates/weekdays or a DB failure """
+    user = rpc_auth.require_role('Direction', 'Formateur')
+    if user['role'] == 'Formateur':
+        formateur_id = user['id']
+    try:
+        with SchoolDB() as db:
+            result = db.pregenerate_seances(date_from, date_to, weekdays, formateur_id, group_id)
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}
+    return result if result is not None else {'error': 'pre-generation failed'}
+
+def rpc_get_session_students(group_id, seance_id):
+    """ Used for the presence marking interface """
+    with SchoolDB() as db:
+        return db.get_students_with_presence(group_id, seance_id)
+
+def rpc_save_attendance(seance_id, presence_list=None, idem_key=None):
+    """ Saves bulk attendance data. Pass a list of {'seance_id', 'presence'} as the
+        only argument to sync several séances (e.g. a day of offline marking) at once.
+        Returns [{'seance_id', 'student_id', 'result'}], result 'queued' when the write journal is on """
+    seances = seance_id if isinstance(seance_id, list) else [{'seance_id': seance_id, 'presence': presence_list}]
+    if journal:
+        journal.record('attendance', {'seances': seances}, idem_key)
+        return [{'seance_id': s['seance_id'], 'student_id': item['student_id'], 'result': 'queued'}
+                for s in seances for item in s.get('presence') or []]
+    with SchoolDB() as db:
+        return db.save_presence_batch(seances)
+
+# --- WRITE-BEHIND JOURNAL ---
+def rpc_journal_status(idem_key):
+    """ pending / done / conflict for a queued write (None if unknown or journal off) """
+    return journal.status(idem_key) if journal else None
+
+def rpc_journal_conflicts():
+    return journal.conflicts() if journal else []
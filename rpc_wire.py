@@ -0,0 +1,136 @@
+""" JSON-RPC 2.0 and MessagePack front-ends for the functions registered on rpc_dispatcher.
+
+Both use the JSON-RPC 2.0 envelope ({"jsonrpc", "method", "params", "id"}, batches as lists).
+MessagePack carries bytes natively, so file uploads skip the base64 + XML inflation.
+"""
+import json
+import base64
+import inspect
+import functools
+import decimal
+import datetime
+import xmlrpc.client
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install msgpack
+    msgpack = None
+
+JSON_TYPES = ('application/json', 'application/json-rpc')
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INVALID_PARAMS, INTERNAL_ERROR = -32700, -32600, -32601, -32602, -32603
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+# --- ENCODING ---
+def _json_default(o):
+    if isinstance(o, xmlrpc.client.Binary):
+        return base64.b64encode(o.data).decode()
+    if isinstance(o, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(o)).decode()
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    raise TypeError(f"not serializable: {type(o).__name__}")
+
+
+def _msgpack_default(o):
+    if isinstance(o, xmlrpc.client.Binary):
+        return o.data
+    if isinstance(o, memoryview):
+        return bytes(o)
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    raise TypeError(f"not serializable: {type(o).__name__}")
+
+
+def codec_for(content_type):
+    """ Returns (name, loads, dumps, mimetype) for a request Content-Type, or None """
+    ctype = (content_type or '').split(';')[0].strip().lower()
+    if ctype in JSON_TYPES:
+        return ('json', json.loads,
+                lambda o: json.dumps(o, default=_json_default, separators=(',', ':')),
+                'application/json')
+    if ctype in MSGPACK_TYPES and msgpack is not None:
+        return ('msgpack', lambda b: msgpack.unpackb(b, raw=False),
+                lambda o: msgpack.packb(o, default=_msgpack_default, use_bin_type=True),
+                MSGPACK_TYPES[0])
+    return None
+
+
+# --- DISPATCH ---
+def _error(code, message, req_id=None):
+    return {'jsonrpc': '2.0', 'error': {'code': code, 'message': message}, 'id': req_id}
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(fn):
+    try:
+        return inspect.signature(fn)
+    except (TypeError, ValueError):  # no introspectable signature: let the call decide
+        return None
+
+
+def _bad_params(fn, params):
+    """ Why params don't fit fn's signature, or None. Only this maps to INVALID_PARAMS: a TypeError
+        raised inside the handler is a server bug, reported as INTERNAL_ERROR """
+    sig = _signature(fn)
+    try:
+        if sig is not None:
+            sig.bind(**params) if isinstance(params, dict) else sig.bind(*params)
+    except TypeError as e:
+        return str(e)
+    return None
+
+
+def _call(dispatcher, req):
+    if not isinstance(req, dict) or req.get('jsonrpc') != '2.0' or not isinstance(req.get('method'), str):
+        return _error(INVALID_REQUEST, 'Invalid Request')
+    req_id = req.get('id')
+    method, params = req['method'], req.get('params', [])
+    if method not in dispatcher.funcs:
+        return _error(METHOD_NOT_FOUND, f'method "{method}" is not supported', req_id)
+    if not isinstance(params, (dict, list)):
+        return _error(INVALID_PARAMS, 'params must be an array or an object', req_id)
+    bad = _bad_params(dispatcher.funcs[method], params)
+    if bad:
+        return _error(INVALID_PARAMS, bad, req_id)
+    try:
+        if isinstance(params, dict):
+            # Named params bypass _dispatch, so keep the timing/fault mapping in one place
+            result = dispatcher.call_named(method, params)
+        else:
+            result = dispatcher._dispatch(method, tuple(params))
+    except xmlrpc.client.Fault as f:
+        return _error(f.faultCode, f.faultString, req_id)
+    except Exception as e:
+        return _error(INTERNAL_ERROR, f"{type(e).__name__}: {e}", req_id)
+    if 'id' not in req:
+        return None  # notification
+    return {'jsonrpc': '2.0', 'result': result, 'id': req_id}
+
+
+def handle(dispatcher, body, codec):
+    """ Decodes a single or batch request, runs it and returns the encoded reply (b'' if nothing to send) """
+    _, loads, dumps, _ = codec
+    try:
+        payload = loads(body)
+    except Exception:
+        return dumps(_error(PARSE_ERROR, 'Parse error'))
+    if isinstance(payload, list):
+        if not payload:
+            return dumps(_error(INVALID_REQUEST, 'Invalid Request'))
+        replies = [r for r in (_call(dispatcher, req) for req in payload) if r is not None]
+        return dumps(replies) if replies else b''
+    reply = _call(dispatcher, payload)
+    return dumps(reply) if reply is not None else b''
@@ -0,0 +1,337 @@
+""" Production entry point: preforked workers sharing one listening socket.
+
+    python serve.py --port 5000 --workers 3
+
+The master binds the socket, imports the app once and forks the workers, which inherit
+it copy-on-write (gc.freeze() keeps the collector from dirtying the shared pages). A
+forked worker drops what must not cross a fork (DB pools, the journal's SQLite handle),
+warms its DB pool and serves threaded WSGI on the shared socket. Use app.py only for
+development (debug reloader, single process).
+
+Signals to the master:
+    HUP         reload: the master re-execs itself (new code), starts new workers, then
+                stops the old ones; the socket stays open so no connection is refused
+    TERM, INT   graceful stop: in-flight requests get SERVE_GRACEFUL_TIMEOUT seconds
+A worker retires after SERVE_MAX_REQUESTS requests (plus a random SERVE_MAX_REQUESTS_JITTER,
+so they don't all go at once); its replacement is started before it drains.
+
+The startup report (import cost per module, time until the first worker is ready) is
+logged, written to SERVE_STARTUP_REPORT if set and exported on /metrics as startup{key=...}.
+Workers share uploads (UPLOAD_DIR), revocations (RPC_REVOCATIONS), cache invalidations
+(CACHE_STATE), the admin fragment versions, the write journal, whose entries only one
+worker replays, and the change feed (EVENTS_DB). With EVENTS_BACKEND=local the feed stays in
+each worker, so the master refuses more than 1 worker (unless EVENTS_FEED=0).
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import select
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import threading
+
+logger = logging.getLogger('serve')
+
+WORKERS = int(os.getenv('SERVE_WORKERS', '1'))
+MAX_REQUESTS = int(os.getenv('SERVE_MAX_REQUESTS', '5000'))
+MAX_REQUESTS_JITTER = int(os.getenv('SERVE_MAX_REQUESTS_JITTER', '500'))
+GRACEFUL_TIMEOUT = float(os.getenv('SERVE_GRACEFUL_TIMEOUT', '30'))
+STARTUP_REPORT = os.getenv('SERVE_STARTUP_REPORT', '')
+
+# Imported in this order by the master; each entry's time excludes what earlier ones loaded
+PRELOAD = ('dotenv', 'pyodbc', 'flask', 'metrics', 'db_manager', 'rpc_handlers', 'app')
+
+_ENV_FD = 'SERVE_LISTEN_FD'
+_ENV_OLD = 'SERVE_OLD_WORKERS'
+
+
+# --- STARTUP ---
+def preload():
+    """ Imports PRELOAD, returns {module: ms} """
+    cost = {}
+    for name in PRELOAD:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        cost[name] = round((time.perf_counter() - start) * 1000, 1)
+    return cost
+
+
+def publish_report(imports, first_ready_ms, workers):
+    import metrics
+    report = {'imports_ms': imports, 'import_total_ms': round(sum(imports.values()), 1),
+              'first_ready_ms': first_ready_ms, 'workers': workers, 'pid': os.getpid(), 'started': time.time()}
+    slowest = sorted(imports.items(), key=lambda kv: kv[1], reverse=True)[:3]
+    logger.info(f"startup: imports {report['import_total_ms']} ms ({', '.join(f'{k} {v}' for k, v in slowest)}), "
+                f"first worker ready after {first_ready_ms} ms")
+    if STARTUP_REPORT:
+        with open(STARTUP_REPORT, 'w') as f:
+            json.dump(report, f, indent=1)
+    metrics.STARTUP.update({f"import_{k}_ms": v for k, v in imports.items()})
+    metrics.STARTUP.update(import_total_ms=report['import_total_ms'], first_ready_ms=first_ready_ms)
+    return report
+
+
+def listen(host, port, backlog=128):
+    """ The master's socket, or the one inherited across a HUP re-exec """
+    fd = os.environ.pop(_ENV_FD, None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+    return socket.create_server((host, port), backlog=backlog)
+
+
+# --- WORKER ---
+class _Closing:
+    """ Response iterable that reports when the server is done with it (streams included) """
+    def __init__(self, result, done):
+        self._result, self._done = result, done
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            self._done()
+
+
+class Worker:
+    """ Counts requests, retires after `limit`, drains in-flight requests on stop """
+    def __init__(self, app, limit, notify):
+        self.app = app
+        self.limit = limit
+        self.notify = notify
+        self.served = 0
+        self.active = 0
+        self.server = None
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.active += 1
+            self.served += 1
+            retire = self.limit and self.served == self.limit
+        if retire:
+            self.stop('retire')
+        try:
+            return _Closing(self.app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+    def _done(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def stop(self, reason=None):
+        """ Stops accepting; serve() then waits for in-flight requests """
+        with self._cond:
+            if self._stopping: return
+            self._stopping = True
+        if reason: self.notify(reason)
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def serve(self, sock, host, port):
+        from werkzeug.serving import make_server
+        self.server = make_server(host, port, self, threaded=True, fd=sock.fileno())
+        self.server.socket.setblocking(False)  # every worker polls the socket: losing the accept race must not block
+        self.notify('ready')
+        self.server.serve_forever(poll_interval=0.5)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        with self._cond:
+            while self.active > 0 and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            if self.active:
+                logger.warning(f"worker {os.getpid()}: {self.active} request(s) cut after {GRACEFUL_TIMEOUT}s")
+
+
+def run_worker(sock, args, status_fd):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C hits the whole group: the master decides
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    notify = lambda what: os.write(status_fd, f"{what} {os.getpid()}\n".encode())
+    app = importlib.import_module('app').app  # already loaded unless --no-preload
+    import db_manager
+    try:
+        db_manager.warm_pool()
+        with db_manager.SchoolDB() as db:
+            db.get_all_modules(); db.get_groups_by_filiere(); db.get_all_teachers()
+            db.warm_seance_index()
+    except Exception as e:
+        logger.warning(f"worker {os.getpid()}: warm-up skipped ({e})")  # DB down: serve anyway, the breaker handles it
+    from journal import journal
+    if journal:
+        journal.start()  # pending entries replay at startup; one worker replays, the others stand by
+    limit = args.max_requests + random.randint(0, args.max_requests_jitter) if args.max_requests else 0
+    worker = Worker(app, limit, notify)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.serve(sock, args.host, args.port)
+
+
+# --- MASTER ---
+class Master:
+    def __init__(self, sock, args, imports):
+        self.sock = sock
+        self.args = args
+        self.imports = imports
+        self.workers = {}    # pid -> spawn time, counted towards --workers
+        self.retiring = set()
+        self.old = {int(p) for p in os.environ.pop(_ENV_OLD, '').split(',') if p}
+        self.started = time.monotonic()
+        self.reported = False
+        self.stopping = False
+        self.signals = []
+        self.status_r, self.status_w = os.pipe()
+        os.set_blocking(self.status_r, False)
+        self._buffer = b''
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(self.status_r)
+                run_worker(self.sock, self.args, self.status_w)
+            except BaseException:
+                logger.exception("worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def on_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.on_signal)
+        gc.freeze()  # everything imported so far is shared with the workers
+        logger.info(f"master {os.getpid()} on {self.sock.getsockname()}, {self.args.workers} workers")
+        while True:
+            while self.signals:
+                self.handle(self.signals.pop(0))
+            if self.stopping:
+                return self.shutdown()
+            self.reap()
+            while len(self.workers) < self.args.workers:
+                self.spawn()
+            self.read_status(0.5)
+
+    def read_status(self, timeout):
+        try:
+            readable, _, _ = select.select([self.status_r], [], [], timeout)
+        except InterruptedError:
+            return
+        if not readable: return
+        try:
+            self._buffer += os.read(self.status_r, 4096)
+        except BlockingIOError:
+            return
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            what, _, pid = line.decode().partition(' ')
+            pid = int(pid)
+            if what == 'ready':
+                self.on_ready(pid)
+            elif what == 'retire' and pid in self.workers:
+                # Its replacement starts now, not once it has drained
+                del self.workers[pid]
+                self.retiring.add(pid)
+
+    def on_ready(self, pid):
+        if not self.reported:
+            self.reported = True
+            publish_report(self.imports, round((time.monotonic() - self.started) * 1000, 1), self.args.workers)
+        ready = sum(1 for p in self.workers if p not in self.old)
+        if self.old and ready >= self.args.workers:
+            logger.info(f"reload: stopping previous workers {sorted(self.old)}")
+            self.kill(self.old, signal.SIGTERM)
+            self.old = set()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            spawned = self.workers.pop(pid, None)
+            self.retiring.discard(pid)
+            self.old.discard(pid)
+            if spawned is not None and not self.stopping and os.waitstatus_to_exitcode(status) != 0:
+                logger.error(f"worker {pid} died (status {os.waitstatus_to_exitcode(status)})")
+                if time.monotonic() - spawned < 1:
+                    time.sleep(1)  # crash loop (bad code, port...): don't fork-bomb the Pi
+
+    def kill(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def handle(self, signum):
+        if signum == signal.SIGHUP:
+            self.reload()
+        else:
+            self.stopping = True
+
+    def reload(self):
+        """ exec() a fresh master with the same socket; the current workers keep serving until
+            the new ones are ready (they stay our children: same pid) """
+        logger.info("reload: re-executing master")
+        os.set_inheritable(self.sock.fileno(), True)
+        os.environ[_ENV_FD] = str(self.sock.fileno())
+        os.environ[_ENV_OLD] = ','.join(str(p) for p in set(self.workers) | self.retiring | self.old)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def shutdown(self):
+        children = set(self.workers) | self.retiring | self.old
+        logger.info(f"stopping {len(children)} worker(s)")
+        self.kill(children, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                time.sleep(0.2)
+        self.kill(children, signal.SIGKILL)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='0.0.0.0')
+    ap.add_argument('--port', type=int, default=5000)
+    ap.add_argument('--workers', type=int, default=WORKERS)
+    ap.add_argument('--max-requests', type=int, default=MAX_REQUESTS, help='0 = never recycle')
+    ap.add_argument('--max-requests-jitter', type=int, default=MAX_REQUESTS_JITTER)
+    ap.add_argument('--no-preload', action='store_true', help='each worker imports the app itself')
+    args = ap.parse_args(argv)
+    import events
+    if args.workers > 1 and events.ENABLED and events.BACKEND == 'local':
+        ap.error(f"--workers {args.workers}: EVENTS_BACKEND=local keeps the change feed per process, clients "
+                 "would miss events published by the other workers; use the shared backend or 1 worker")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(message)s')
+
+    # Tokens must verify in every worker, including with --no-preload and across reloads
+    if not (os.getenv('RPC_TOKEN_SECRET') or os.getenv('FLASK_SECRET_KEY')):
+        import secrets
+        os.environ['RPC_TOKEN_SECRET'] = secrets.token_hex(32)
+    sock = listen(args.host, args.port)
+    imports = {} if args.no_preload else preload()
+    Master(sock, args, imports).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+""" Tests run the app against the SQLite stand-in (bench/fake_pyodbc.py): no SQL Server needed.
+
+Every state file the modules open at import time goes to a throwaway directory, and each
+`school` test gets its own small generated school (see bench/datagen.py).
+"""
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from bench import install
+
+_STATE = tempfile.mkdtemp(prefix='rpc_tests_')
+os.environ.update({
+    'CACHE_STATE': os.path.join(_STATE, 'cache.ver'),
+    'FRAGMENT_STATE': os.path.join(_STATE, 'fragments.ver'),
+    'RPC_REVOCATIONS': os.path.join(_STATE, 'revocations.db'),
+    'EVENTS_DB': os.path.join(_STATE, 'events.db'),
+    'RPC_TOKEN_SECRET': 'tests',
+    'UPLOAD_DIR': os.path.join(_STATE, 'uploads'),
+    'IMPORT_DIR': os.path.join(_STATE, 'imports'),
+    'BENCH_DB': os.path.join(_STATE, 'school.db'),
+})
+install()
+
+import db_manager  # noqa: E402  (after install(): pyodbc is the stand-in)
+from bench import datagen  # noqa: E402
+from cache import cache  # noqa: E402
+
+
+def _reset():
+    for pool in db_manager._pools.values():
+        pool.close_all()
+    db_manager._pools.clear()
+    cache.clear()
+    db_manager.seance_index.clear()
+    db_manager._seance_index_warm = False
+
+
+@pytest.fixture
+def school(tmp_path, monkeypatch):
+    """ Path of a fresh school: 40 students in 4 groups, 4 teachers, 20 days of attendance """
+    path = str(tmp_path / 'school.db')
+    datagen.generate(path, students=40, groups=4, teachers=4, modules=6, days=20, tps_per_group=1)
+    monkeypatch.setenv('BENCH_DB', path)
+    _reset()
+    with db_manager.SchoolDB() as db:
+        assert db.rebuild_attendance_aggregates()
+    yield path
+    _reset()
+
+
+@pytest.fixture
+def sql(school):
+    """ Runs raw SQL on the test school: sql("SELECT ...", params) -> rows """
+    def run(query, params=()):
+        conn = sqlite3.connect(school)
+        try:
+            rows = conn.execute(query, params).fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+    return run
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+
+import async_server
+
+
+def _app(environ, start_response):
+    body = environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+async def _exchange(app, raw, read_timeout=5):
+    server = async_server.AsyncRPCServer(app, None, workers=2, queue_limit=2, deadline=5)
+    srv = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    try:
+        reader, writer = await asyncio.open_connection(*srv.sockets[0].getsockname()[:2])
+        writer.write(raw)
+        await writer.drain()
+        out = await asyncio.wait_for(reader.read(), read_timeout)
+        writer.close()
+        return out
+    finally:
+        srv.close()
+        server.executor.shutdown(wait=False)
+
+
+def test_body_is_read_by_content_length():
+    out = asyncio.run(_exchange(_app, b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello"))
+    assert out.startswith(b"HTTP/1.1 200") and out.endswith(b"hello")
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1e3', '\xb2', ' 5 5'])
+def test_bad_content_length_is_a_400(length):
+    raw = f"POST /echo HTTP/1.1\r\nContent-Length: {length}\r\n\r\nhello".encode('latin-1')
+    assert asyncio.run(_exchange(_app, raw)).startswith(b"HTTP/1.1 400")
+
+
+def test_stalled_body_drops_the_connection(monkeypatch):
+    monkeypatch.setattr(async_server, 'READ_TIMEOUT', 0.2)
+    assert asyncio.run(_exchange(_app, b"POST /echo HTTP/1.1\r\nContent-Length: 50\r\n\r\nhello")) == b''
+
+
+def test_stalled_stream_chunk_drops_the_connection_and_closes_later(monkeypatch):
+    monkeypatch.setattr(async_server, 'READ_TIMEOUT', 0.2)
+    release, closed = threading.Event(), threading.Event()
+
+    class Stream:
+        def __iter__(self):
+            yield b'first'
+            release.wait(5)
+            yield b'second'
+
+        def close(self):
+            closed.set()
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/csv')])
+        return Stream()
+
+    out = asyncio.run(_exchange(app, b"GET /export HTTP/1.1\r\n\r\n"))
+    assert out.endswith(b'first') and not closed.is_set()
+    release.set()
+    assert closed.wait(5)
+
+
+def test_timed_out_request_keeps_its_slot_until_the_worker_is_free():
+    release = threading.Event()
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            release.wait(5)
+        start_response('200 OK', [('Content-Length', '2')])
+        return [b'ok']
+
+    async def get(port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n".encode())
+        out = await reader.read()
+        writer.close()
+        return out.split(b' ', 2)[1]
+
+    async def scenario():
+        server = async_server.AsyncRPCServer(app, None, workers=1, queue_limit=0, deadline=0.2)
+        srv = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+        port = srv.sockets[0].getsockname()[1]
+        try:
+            assert await get(port, '/slow') == b'504'
+            assert await get(port, '/fast') == b'503'  # the only worker is still busy
+            release.set()
+            for _ in range(50):
+                if server.inflight == 0: break
+                await asyncio.sleep(0.02)
+            assert await get(port, '/fast') == b'200'
+        finally:
+            srv.close()
+            server.executor.shutdown(wait=False)
+
+    asyncio.run(scenario())
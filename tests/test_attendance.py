@@ -0,0 +1,64 @@
+from collections import Counter
+
+import db_manager
+from db_manager import SchoolDB
+
+
+def _seance(sql):
+    sid, gid = sql("SELECT SeanceID, GroupeID FROM Seance ORDER BY SeanceID LIMIT 1")[0]
+    students = [r[0] for r in sql("SELECT EtudiantID FROM Etudiant WHERE GroupeID = ? ORDER BY EtudiantID", (gid,))]
+    return sid, students
+
+
+def _rollups_match(sql):
+    assert sql("SELECT SUM(Total), SUM(Presents) FROM PresenceAgg") == \
+        sql("SELECT COUNT(*), SUM(CASE WHEN Etat = 'Present' THEN 1 ELSE 0 END) FROM Presence")
+    assert sql("SELECT SUM(Absences) FROM AbsenceCounter") == sql("SELECT COUNT(*) FROM Presence WHERE Etat = 'Absent'")
+
+
+def test_batch_save_updates_rows_and_rollups(school, sql):
+    sid, students = _seance(sql)
+    sql("DELETE FROM Presence WHERE SeanceID = ? AND EtudiantID = ?", (sid, students[0]))
+    with SchoolDB() as db:
+        db.rebuild_attendance_aggregates()
+        out = db.save_bulk_presence(sid, [{'student_id': s, 'status': 'absent'} for s in students] + [{'status': 'Present'}])
+    results = {r['student_id']: r['result'] for r in out}
+    assert results[students[0]] == 'inserted'
+    assert all(results[s] == 'updated' for s in students[1:])
+    assert results[None] == 'invalid'
+    assert sql("SELECT COUNT(*) FROM Presence WHERE SeanceID = ? AND Etat = 'Absent'", (sid,)) == [(len(students),)]
+    _rollups_match(sql)
+
+
+def test_failed_rollup_reports_each_row_once_as_error(school, sql):
+    sid, students = _seance(sql)
+    before = sql("SELECT EtudiantID, Etat FROM Presence WHERE SeanceID = ? ORDER BY EtudiantID", (sid,))
+    sql("DROP TABLE PresenceAgg")
+    with SchoolDB() as db:
+        out = db.save_bulk_presence(sid, [{'student_id': s, 'status': 'Absent'} for s in students])
+    assert Counter(r['student_id'] for r in out) == Counter(students)
+    assert {r['result'] for r in out} == {'error'}
+    assert sql("SELECT EtudiantID, Etat FROM Presence WHERE SeanceID = ? ORDER BY EtudiantID", (sid,)) == before
+
+
+def test_grades_rolled_back_are_only_errors(school, sql, monkeypatch):
+    subs = [r[0] for r in sql("SELECT SoumissionID FROM Soumission ORDER BY SoumissionID LIMIT 3")]
+    with SchoolDB() as db:
+        def broken():
+            raise db_manager.pyodbc.Error("commit failed")
+        monkeypatch.setattr(db.conn, 'commit', broken)
+        out = db.save_grades(None, [{'submission_id': s, 'grade': 15} for s in subs])
+    assert sorted((r['submission_id'], r['result']) for r in out) == [(s, 'error') for s in subs]
+
+
+def test_committed_grades_stay_updated_when_publishing_fails(school, sql, monkeypatch):
+    subs = [r[0] for r in sql("SELECT SoumissionID FROM Soumission ORDER BY SoumissionID LIMIT 3")]
+
+    def broken(*args):
+        raise RuntimeError("feed down")
+    monkeypatch.setattr(db_manager.bus, 'publish', broken)
+    with SchoolDB() as db:
+        out = db.save_grades(None, [{'submission_id': s, 'grade': '12,5'} for s in subs] + [{'submission_id': 'x', 'grade': 3}])
+    assert sorted((str(r['submission_id']), r['result']) for r in out) == \
+        sorted([(str(s), 'updated') for s in subs] + [('x', 'invalid')])
+    assert sql("SELECT Note FROM Soumission WHERE SoumissionID IN (?,?,?)", subs) == [(12.5,)] * 3
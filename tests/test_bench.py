@@ -0,0 +1,38 @@
+from bench import fake_pyodbc
+from db_manager import SchoolDB
+
+
+def test_merge_runs_as_update_then_insert(school, sql):
+    conn = fake_pyodbc.connect()
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE #Src (EtudiantID INT, Absences INT)")
+    cur.execute("INSERT INTO #Src VALUES (?, ?), (?, ?)", (2, 3, 99999, 1))
+    cur.execute("""
+        MERGE AbsenceCounter WITH (HOLDLOCK) AS T
+        USING #Src AS S ON T.EtudiantID = S.EtudiantID AND T.ModuleID = 0
+        WHEN MATCHED THEN UPDATE SET Absences = S.Absences
+        WHEN NOT MATCHED THEN INSERT (EtudiantID, ModuleID, GroupeID, FormateurID, Absences) VALUES (S.EtudiantID, 0, 0, 0, S.Absences);
+    """)
+    conn.commit()
+    conn.close()
+    assert sql("SELECT Absences FROM AbsenceCounter WHERE EtudiantID = 99999") == [(1,)]
+
+
+def test_rebuilt_rollups_match_presence(school, sql):
+    assert sql("SELECT SUM(Total) FROM PresenceAgg") == sql("SELECT COUNT(*) FROM Presence")
+    assert sql("SELECT SUM(Absences) FROM AbsenceCounter") == sql("SELECT COUNT(*) FROM Presence WHERE Etat = 'Absent'")
+    with SchoolDB() as db:
+        report = db.get_absent_report(limit=None)
+    assert sum(r['count'] for r in report) == sql("SELECT COUNT(*) FROM Presence WHERE Etat = 'Absent'")[0][0]
+
+
+def test_absent_report_reads_dates_for_the_rows_shown(school, sql):
+    with SchoolDB() as db:
+        full = db.get_absent_report(limit=None)
+        top = db.get_absent_report(limit=3)
+        fid = sql("SELECT FormateurID FROM Seance GROUP BY FormateurID ORDER BY COUNT(*) DESC LIMIT 1")[0][0]
+        mine = db.get_absent_report(fid, limit=None)
+    assert len(full) > 3 and top == full[:3]
+    assert all(len(r['dates']) == r['count'] for r in full + mine)
+    assert sum(r['count'] for r in mine) == sql("""SELECT COUNT(*) FROM Presence P JOIN Seance S ON P.SeanceID = S.SeanceID
+                                                   WHERE P.Etat = 'Absent' AND S.FormateurID = ?""", (fid,))[0][0]
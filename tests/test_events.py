@@ -0,0 +1,95 @@
+import time
+import threading
+
+import pytest
+
+import events
+import serve
+from events import EventBus, EventLog
+
+
+def test_resume_from_cursor():
+    bus = EventBus(size=10)
+    first = bus.publish('grade', {'n': 1}, ['student:1'])
+    bus.publish('grade', {'n': 2}, ['student:2'])
+    bus.publish('grade', {'n': 3}, ['student:1'])
+    found, cursor, reset = bus.wait(['student:1'], first, 0)
+    assert [e['data']['n'] for e in found] == [3] and not reset
+    assert bus.wait(['student:1'], cursor, 0) == ([], cursor, False)
+
+
+def test_foreign_or_stale_cursor_resets():
+    a, b = EventBus(size=2), EventBus(size=2)
+    for n in range(3):
+        a.publish('tp', {'n': n}, ['group:1'])
+        b.publish('tp', {'n': n}, ['group:1'])
+    assert a.epoch != b.epoch
+    # another worker's id is never taken for ours, even with the same sequence number
+    cursor = b.wait(None, None, 0)[1]
+    assert a.wait(None, cursor, 0) == ([], a.wait(None, None, 0)[1], True)
+    assert a.wait(None, f"{a.epoch}-0", 0)[2] is True       # event 1 fell out of the buffer
+    assert a.wait(None, '1700000000000', 0)[2] is True      # an old-style integer id
+    assert a.wait(None, f"{a.epoch}-1", 0)[2] is False
+
+
+def test_workers_share_the_feed(tmp_path):
+    # two workers: same file, their own connection and buffer
+    a, b = (EventBus(size=3, log=EventLog(str(tmp_path / 'events.db'))) for _ in range(2))
+    start = b.wait(None, None, 0)[1]
+    first = a.publish('grade', {'n': 1}, ['student:1'])
+    found, cursor, reset = b.wait(['student:1'], start, 2)
+    assert not reset and [(e['id'], e['data']) for e in found] == [(first, {'n': 1})]
+    assert a.epoch == b.epoch
+    for n in range(2, 6):
+        b.publish('grade', {'n': n}, ['student:1'])
+    assert a.wait(['student:1'], cursor, 0)[2] is True  # 2 fell out of the shared buffer
+    found, _, reset = a.wait(['student:1'], f"{a.epoch}-3", 0)
+    assert not reset and [e['data']['n'] for e in found] == [4, 5]
+    # a fresh file is a new epoch: old cursors reset
+    c = EventBus(log=EventLog(str(tmp_path / 'other.db')))
+    assert c.wait(None, cursor, 0)[2] is True
+
+
+def test_waiter_wakes_on_another_workers_publish(tmp_path, monkeypatch):
+    monkeypatch.setattr(events, 'POLL', 0.05)
+    a, b = (EventBus(log=EventLog(str(tmp_path / 'events.db'))) for _ in range(2))
+    start = b.wait(None, None, 0)[1]
+    threading.Timer(0.2, a.publish, ('tp', {'tp_id': 1}, ['group:1'])).start()
+    t0 = time.monotonic()
+    found, _, _ = b.wait(['group:1'], start, 5)
+    assert [e['data'] for e in found] == [{'tp_id': 1}] and time.monotonic() - t0 < 2
+
+
+class _Started(Exception):
+    pass
+
+
+@pytest.mark.parametrize('backend, refused', [('local', True), ('sqlite', False)])
+def test_serve_refuses_several_workers_only_with_a_local_feed(monkeypatch, backend, refused):
+    monkeypatch.setattr(serve, 'listen', lambda *a: (_ for _ in ()).throw(_Started()))
+    monkeypatch.setattr(serve, 'preload', lambda: {})
+    monkeypatch.setattr(events, 'ENABLED', True)
+    monkeypatch.setattr(events, 'BACKEND', backend)
+    with pytest.raises(SystemExit if refused else _Started):
+        serve.main(['--workers', '2'])
+
+
+def test_feed_off(monkeypatch):
+    from app import app
+    monkeypatch.setattr(events, 'ENABLED', False)
+    bus = EventBus()
+    assert bus.publish('tp', {}, ['group:1']) is None
+    assert app.test_client().get('/events').status_code == 404
+
+
+def test_teachers_only_follow_their_own_classes(school, sql):
+    events._groups.clear()
+    tp, teacher = sql("SELECT TPID, FormateurID FROM TP ORDER BY TPID LIMIT 1")[0]
+    group = sql("SELECT GroupeID FROM Affectation WHERE FormateurID = ? LIMIT 1", (teacher,))[0][0]
+    foreign_tp, foreign_group = sql("""SELECT TPID, GroupeID FROM TP X WHERE X.FormateurID <> ? AND NOT EXISTS
+                                       (SELECT 1 FROM Affectation A WHERE A.FormateurID = ? AND A.GroupeID = X.GroupeID)
+                                       LIMIT 1""", (teacher, teacher))[0]
+    user = {'id': teacher, 'role': 'Formateur'}
+    asked = [f"teacher:{teacher}", f"tp:{tp}", f"group:{group}", f"tp:{foreign_tp}", f"group:{foreign_group}",
+             f"teacher:{teacher + 1}", 'student:1', 'tp:x']
+    assert events.allowed_topics(user, asked) == [f"teacher:{teacher}", f"tp:{tp}", f"group:{group}"]
@@ -0,0 +1,61 @@
+import csv
+import io
+
+import db_manager
+import exports
+from app import app
+
+
+def _client(uid, role):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s.update({'user_id': uid, 'role': role, 'name': 'x'})
+    return client
+
+
+def _rows(body):
+    return list(csv.reader(io.StringIO(body.decode('utf-8-sig')), delimiter=';'))
+
+
+def test_csv_stream_is_chunked_and_lazy(monkeypatch):
+    monkeypatch.setattr(exports, 'FLUSH_BYTES', 100)
+    pulled = []
+
+    def rows():
+        yield ('Nom', 'Note')
+        for n in range(50):
+            pulled.append(n)
+            yield (f"élève {n}", n)
+
+    chunks = exports.csv_stream(rows())
+    first = next(chunks)
+    assert len(pulled) < 50 and first.startswith('﻿'.encode())
+    body = first + b''.join(chunks)
+    assert _rows(body) == [['Nom', 'Note']] + [[f"élève {n}", str(n)] for n in range(50)]
+
+
+def test_absence_export_matches_the_rollup(school, sql, monkeypatch):
+    monkeypatch.setattr(db_manager, 'EXPORT_FETCH', 3)  # several fetchmany round trips
+    fid = sql("SELECT FormateurID FROM AbsenceCounter WHERE Absences > 0 LIMIT 1")[0][0]
+    resp = _client(fid, 'Formateur').get('/export/absences')
+    assert resp.status_code == 200 and resp.is_streamed
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="absences.csv"'
+    header, *rows = _rows(resp.get_data())
+    assert header == ['Group', 'Nom', 'Prenom', 'CNE', 'Module', 'Absences']
+    assert sum(int(r[-1]) for r in rows) == sql("SELECT SUM(Absences) FROM AbsenceCounter WHERE FormateurID = ?", (fid,))[0][0]
+
+
+def test_grade_sheet_lists_every_student_of_the_group(school, sql):
+    tp, gid, fid = sql("SELECT TPID, GroupeID, FormateurID FROM TP ORDER BY TPID LIMIT 1")[0]
+    resp = _client(fid, 'Formateur').get(f'/export/grades/{tp}')
+    header, *rows = _rows(resp.get_data())
+    assert header[:3] == ['Nom', 'Prenom', 'CNE']
+    assert len(rows) == sql("SELECT COUNT(*) FROM Etudiant WHERE GroupeID = ?", (gid,))[0][0]
+    # another teacher gets the header only
+    other = sql("SELECT FormateurID FROM Formateur WHERE FormateurID <> ? LIMIT 1", (fid,))[0][0]
+    assert len(_rows(_client(other, 'Formateur').get(f'/export/grades/{tp}').get_data())) == 1
+
+
+def test_students_cannot_export(school, sql):
+    sid = sql("SELECT EtudiantID FROM Etudiant LIMIT 1")[0][0]
+    assert _client(sid, 'Etudiant').get('/export/absences').status_code == 403
@@ -0,0 +1,90 @@
+import hashlib
+
+import pytest
+
+import rpc_auth
+import rpc_handlers
+from app import app
+from transfers import uploads, parse_range, UploadError, content_disposition
+
+
+@pytest.fixture
+def cast(school, sql):
+    """ A submission with its TP, author, a classmate, the TP's teacher, an unrelated teacher and the admin """
+    sub, tp, author, gid, mid, teacher = sql("""
+        SELECT S.SoumissionID, TP.TPID, S.EtudiantID, TP.GroupeID, TP.ModuleID, TP.FormateurID
+        FROM Soumission S JOIN TP ON S.TPID = TP.TPID ORDER BY S.SoumissionID LIMIT 1""")[0]
+    classmate = sql("SELECT EtudiantID FROM Etudiant WHERE GroupeID = ? AND EtudiantID <> ? LIMIT 1", (gid, author))[0][0]
+    stranger = sql("""SELECT FormateurID FROM Formateur WHERE FormateurID NOT IN
+                      (SELECT FormateurID FROM Affectation WHERE GroupeID = ?) LIMIT 1""", (gid,))[0][0]
+    admin = sql("SELECT UserID FROM Utilisateur WHERE Role = 'Direction'")[0][0]
+    return {'submission': sub, 'tp': tp, 'author': (author, 'Etudiant'), 'classmate': (classmate, 'Etudiant'),
+            'teacher': (teacher, 'Formateur'), 'stranger': (stranger, 'Formateur'), 'admin': (admin, 'Direction')}
+
+
+def _download(who, kind, file_id, headers=None):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s.update({'user_id': who[0], 'role': who[1], 'name': 'x'})
+    return client.get(f"/files/{kind}/{file_id}", headers=headers or {})
+
+
+@pytest.mark.parametrize('who, kind, status', [
+    ('author', 'submission', 200), ('classmate', 'submission', 403), ('teacher', 'submission', 200),
+    ('stranger', 'submission', 403), ('admin', 'submission', 200),
+    ('classmate', 'tp', 200), ('stranger', 'tp', 403),
+])
+def test_download_acl(cast, who, kind, status):
+    assert _download(cast[who], kind, cast[kind]).status_code == status
+
+
+def test_rpc_file_reads_need_an_allowed_token(cast):
+    sub = cast['submission']
+    with pytest.raises(rpc_auth.AuthRequired):
+        rpc_handlers.rpc_read_file_chunk('submission', sub, 0, 10)
+    for who, allowed in (('classmate', False), ('author', True), ('teacher', True)):
+        token = rpc_auth.issue({'id': cast[who][0], 'role': cast[who][1]})
+        with rpc_auth.bound(token):
+            if allowed:
+                assert rpc_handlers.rpc_get_file_info('submission', sub)['size'] == 4096
+                assert len(rpc_handlers.rpc_read_file_chunk('submission', sub, 4000, 500).data) == 96
+            else:
+                with pytest.raises(rpc_auth.AuthRequired):
+                    rpc_handlers.rpc_get_file_info('submission', sub)
+
+
+def test_range_and_hostile_file_name(cast, sql):
+    sql("UPDATE Soumission SET FichierNom = ? WHERE SoumissionID = ?", ('rapport"\r\nX-Evil: 1 é.pdf', cast['submission']))
+    resp = _download(cast['author'], 'submission', cast['submission'], {'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert len(resp.data) == 100 and resp.headers['Content-Range'] == 'bytes 100-199/4096'
+    assert 'X-Evil' not in resp.headers
+    assert resp.headers['Content-Disposition'] == content_disposition('rapport___X-Evil: 1 é.pdf')
+    assert "filename*=UTF-8''rapport___X-Evil%3A%201%20%C3%A9.pdf" in resp.headers['Content-Disposition']
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 10)), ('bytes=-10', (90, 100)), ('bytes=95-', (95, 100)), ('bytes=90-500', (90, 100)),
+    ('bytes=100-', None), ('bytes=0-1,5-6', None), ('items=0-1', None), ('bytes=a-b', None), (None, None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+def test_upload_resumes_and_commits(school, sql):
+    data = bytes(range(256)) * 40
+    meta = {'tp_id': sql("SELECT MIN(TPID) FROM TP")[0][0], 'student_id': 2, 'file_name': 'r.pdf', 'file_type': 'application/pdf'}
+    up = uploads.begin('submission', meta, len(data))['upload_id']
+    uploads.put_chunk(up, 0, data[:4000])
+    with pytest.raises(UploadError):
+        uploads.put_chunk(up, 5000, data[5000:6000])  # gap
+    with pytest.raises(UploadError):
+        uploads.put_chunk(up, -10, data[:4010])  # would land the chunk past the declared size
+    assert uploads.get(up).status()['received'] == 4000
+    uploads.put_chunk(up, 3000, data[3000:])  # resend an overlap, then the rest
+    with pytest.raises(UploadError):
+        rpc_handlers.rpc_commit_upload(up, '0' * 64)
+    sid = rpc_handlers.rpc_commit_upload(up, hashlib.sha256(data).hexdigest())
+    assert sql("SELECT FichierData FROM Soumission WHERE SoumissionID = ?", (sid,)) == [(data,)]
+    with pytest.raises(UploadError):
+        uploads.get(up)
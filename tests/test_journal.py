@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+import rpc_handlers
+from journal import WriteJournal, JournalError
+
+
+@pytest.fixture
+def journal(school, tmp_path, monkeypatch):
+    j = WriteJournal(str(tmp_path / 'journal.db'), flush_interval=0.05)
+    monkeypatch.setattr(j, 'start', lambda: None)  # the tests flush by hand
+    monkeypatch.setattr(rpc_handlers, 'journal', j)
+    return j
+
+
+def _seance(sql):
+    sid, gid = sql("SELECT SeanceID, GroupeID FROM Seance ORDER BY SeanceID LIMIT 1")[0]
+    return sid, [r[0] for r in sql("SELECT EtudiantID FROM Etudiant WHERE GroupeID = ? ORDER BY EtudiantID", (gid,))]
+
+
+def test_queued_calls_keep_their_return_shape(journal, sql):
+    sid, students = _seance(sql)
+    sub = sql("SELECT SoumissionID FROM Soumission LIMIT 1")[0][0]
+    assert rpc_handlers.rpc_grade_submission(sub, 15, 'g1') is True
+    assert rpc_handlers.rpc_grade_submissions(None, [[sub, 16]], 'g2') == [{'submission_id': sub, 'result': 'queued'}]
+    out = rpc_handlers.rpc_save_attendance(sid, [{'student_id': s, 'status': 'Absent'} for s in students], 'a1')
+    assert out == [{'seance_id': sid, 'student_id': s, 'result': 'queued'} for s in students]
+    assert journal.stats() == {'pending': 3}
+
+
+def test_replay_applies_once_per_key(journal, sql):
+    sid, students = _seance(sql)
+    presence = [{'student_id': s, 'status': 'Absent'} for s in students]
+    assert journal.record('attendance', {'seances': [{'seance_id': sid, 'presence': presence}]}, 'k')['duplicate'] is False
+    assert journal.record('attendance', {'seances': [{'seance_id': sid, 'presence': presence}]}, 'k')['duplicate'] is True
+    assert journal.flush_once() == 1
+    assert journal.status('k')['status'] == 'done'
+    assert sql("SELECT COUNT(*) FROM Presence WHERE SeanceID = ? AND Etat = 'Absent'", (sid,)) == [(len(students),)]
+    assert journal.flush_once() == 0
+
+
+def test_unknown_submission_is_a_conflict_and_does_not_block_the_batch(journal, sql):
+    sub = sql("SELECT SoumissionID FROM Soumission LIMIT 1")[0][0]
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': 999999, 'grade': 12}]}, 'bad')
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': sub, 'grade': 17}]}, 'good')
+    journal.flush_once()
+    assert journal.status('bad')['status'] == 'conflict'
+    assert journal.status('good')['status'] == 'done'
+    assert [c['key'] for c in journal.conflicts()] == ['bad']
+    assert sql("SELECT Note FROM Soumission WHERE SoumissionID = ?", (sub,)) == [(17,)]
+
+
+def test_done_entries_are_pruned_after_the_retention_window(journal, sql):
+    sub = sql("SELECT SoumissionID FROM Soumission LIMIT 1")[0][0]
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': 999999, 'grade': 12}]}, 'bad')
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': sub, 'grade': 17}]}, 'good')
+    journal.flush_once()
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': sub, 'grade': 18}]}, 'later')
+    assert journal.prune() == 0  # still inside the window: a retry of 'good' is a duplicate
+    assert journal.prune(now=time.time() + journal.retention + 1) == 1
+    assert journal.status('good') is None
+    assert journal.stats() == {'conflict': 1, 'pending': 1}
+
+def test_malformed_write_is_refused(journal):
+    with pytest.raises(JournalError):
+        journal.record('grade', {'grades': [{'submission_id': 'x', 'grade': 12}]})
+    assert journal.stats() == {}
+
+
+def test_pending_entries_replay_after_a_restart(journal, sql):
+    sub = sql("SELECT SoumissionID FROM Soumission LIMIT 1")[0][0]
+    journal.record('grade', {'tp_id': None, 'grades': [{'submission_id': sub, 'grade': 11}]}, 'before-restart')
+    restarted = WriteJournal(journal.path, flush_interval=0.05)
+    restarted.start()  # what the servers do at startup, before any new write
+    deadline = time.monotonic() + 5
+    while restarted.status('before-restart')['status'] == 'pending' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert restarted.status('before-restart')['status'] == 'done'
+    assert sql("SELECT Note FROM Soumission WHERE SoumissionID = ?", (sub,)) == [(11,)]
@@ -0,0 +1,29 @@
+import queries
+from db_manager import SchoolDB
+
+
+def test_projection_picks_columns_and_converts():
+    project = queries.projection(('A', 'B', 'C'), (('c', 'C'), ('a', 'A', queries.blank)))
+    assert project((None, 'b', 3)) == {'c': 3, 'a': ''}
+    assert queries.projection(('A',), (('a', 'A'),))((1,)) == {'a': 1}
+
+
+def test_projected_rows(school, sql):
+    sid, gid, cne = sql("SELECT EtudiantID, GroupeID, CNE FROM Etudiant ORDER BY EtudiantID LIMIT 1")[0]
+    nom, prenom = sql("SELECT Nom, Prenom FROM Utilisateur WHERE UserID = ?", (sid,))[0]
+    fid = sql("SELECT FormateurID FROM Formateur LIMIT 1")[0][0]
+    sub, tp = sql("SELECT SoumissionID, TPID FROM Soumission LIMIT 1")[0]
+    sql("UPDATE Soumission SET Note = NULL WHERE SoumissionID = ?", (sub,))
+    seance = sql("SELECT MAX(SeanceID) + 1 FROM Seance")[0][0]  # no presence: everyone 'Pending'
+    with SchoolDB() as db:
+        student, teacher = db.get_user_details(sid), db.get_user_details(fid)
+        roster = db.get_students_with_presence(gid, seance)
+        graded = {s['id']: s for s in db.get_submissions_for_tp(tp)}
+        users = db.get_all_users_extended()
+    assert student == {'id': sid, 'nom': nom, 'prenom': prenom, 'email': student['email'], 'role': 'Etudiant',
+                       'cne': cne, 'matricule': '', 'groupe_id': gid}
+    assert teacher['cne'] == '' and teacher['groupe_id'] == '' and teacher['matricule']
+    assert {r['status'] for r in roster} == {'Pending'} and f"{nom} {prenom}" in {r['name'] for r in roster}
+    assert graded[sub]['grade'] == ''
+    assert all(isinstance(u['teacher_groups'], list) for u in users)
+    assert len({id(u['teacher_groups']) for u in users}) == len(users)  # a fresh list per row
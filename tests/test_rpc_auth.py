@@ -0,0 +1,94 @@
+import json
+import xmlrpc.client
+
+import pytest
+
+import rpc_auth
+from app import app, AUTH_REQUIRED_FAULT
+
+
+@pytest.fixture
+def people(school, sql):
+    student, gid = sql("SELECT EtudiantID, GroupeID FROM Etudiant ORDER BY EtudiantID LIMIT 1")[0]
+    other_student = sql("SELECT EtudiantID FROM Etudiant WHERE EtudiantID <> ? LIMIT 1", (student,))[0][0]
+    tp, teacher = sql("SELECT TPID, FormateurID FROM TP ORDER BY TPID LIMIT 1")[0]
+    other_teacher = sql("""SELECT FormateurID FROM Formateur WHERE FormateurID NOT IN
+                           (SELECT FormateurID FROM Affectation WHERE GroupeID = (SELECT GroupeID FROM TP WHERE TPID = ?))
+                           LIMIT 1""", (tp,))[0][0]
+    sub = sql("SELECT SoumissionID FROM Soumission WHERE TPID = ? LIMIT 1", (tp,))[0][0]
+    admin = sql("SELECT UserID FROM Utilisateur WHERE Role = 'Direction'")[0][0]
+    token = lambda uid, role: rpc_auth.issue({'id': uid, 'role': role})  # noqa: E731
+    return {'student': (student, token(student, 'Etudiant')), 'other_student': other_student,
+            'teacher': (teacher, token(teacher, 'Formateur')), 'other_teacher': (other_teacher, token(other_teacher, 'Formateur')),
+            'admin': (admin, token(admin, 'Direction')), 'tp': tp, 'submission': sub}
+
+
+def call(method, *params, token=None):
+    """ XML-RPC call through /RPC2: the result, or the Fault """
+    headers = {'Content-Type': 'text/xml'}
+    if token: headers['X-RPC-Token'] = token
+    body = app.test_client().post('/RPC2', data=xmlrpc.client.dumps(params, method, allow_none=True), headers=headers).data
+    try:
+        return xmlrpc.client.loads(body, use_builtin_types=True)[0][0]
+    except xmlrpc.client.Fault as f:
+        return f
+
+
+def denied(result):
+    return isinstance(result, xmlrpc.client.Fault) and result.faultCode == AUTH_REQUIRED_FAULT
+
+
+def test_roles_per_method(people):
+    student, teacher = people['student'][1], people['teacher'][1]
+    assert denied(call('grade_submission', people['submission'], 18, token=student))
+    assert denied(call('grade_submissions', people['tp'], [[people['submission'], 18]], token=student))
+    assert denied(call('save_attendance', 1, [], token=student))
+    assert denied(call('get_student_tps', people['student'][0], token=teacher))
+    assert call('grade_submission', people['submission'], 18, token=teacher) is True
+
+
+def test_id_arguments_must_name_the_caller(people):
+    (sid, student), (fid, teacher), (_, other_teacher) = people['student'], people['teacher'], people['other_teacher']
+    assert isinstance(call('get_student_tps', sid, token=student), list)
+    assert denied(call('get_student_tps', people['other_student'], token=student))
+    assert isinstance(call('get_teacher_data', fid, token=teacher), dict)
+    assert denied(call('get_teacher_data', fid, token=other_teacher))
+    assert denied(call('get_submissions', people['tp'], token=other_teacher))
+    assert denied(call('grade_submission', people['submission'], 3, token=other_teacher))
+    assert denied(call('grade_submissions', None, [{'submission_id': people['submission'], 'grade': 3}], token=other_teacher))
+    # Direction may name anyone
+    assert isinstance(call('get_teacher_data', fid, token=people['admin'][1]), dict)
+
+
+def test_named_params_are_checked_too(people):
+    fid, other_teacher = people['teacher'][0], people['other_teacher'][1]
+    resp = app.test_client().post('/rpc', data=json.dumps({'jsonrpc': '2.0', 'method': 'get_teacher_data', 'params': {'fid': fid}, 'id': 1}),
+                                  headers={'Content-Type': 'application/json', 'X-RPC-Token': other_teacher})
+    assert resp.get_json()['error']['code'] == AUTH_REQUIRED_FAULT
+
+
+def test_required_token_and_revocation(people, monkeypatch):
+    monkeypatch.setattr(rpc_auth, 'REQUIRE_TOKEN', True)
+    fid, teacher = people['teacher']
+    assert denied(call('get_teacher_data', fid))
+    assert call('whoami', token=teacher)['id'] == fid
+    assert call('logout', token=teacher) is True
+    assert denied(call('get_teacher_data', fid, token=teacher))
+
+    sid, student = people['student']
+    rpc_auth.revoke_user(sid)
+    assert denied(call('get_student_tps', sid, token=student))
+
+
+def test_failed_logins_only_lock_that_email(school, sql):
+    rpc_auth.failures.clear()
+    a, b = [r[0] for r in sql("SELECT Email FROM Utilisateur WHERE Role = 'Etudiant' ORDER BY UserID LIMIT 2")]
+    for _ in range(rpc_auth.MAX_FAILURES):
+        assert rpc_auth.authenticate(a, 'wrong', '127.0.0.1') is None
+    with pytest.raises(rpc_auth.RateLimited):
+        rpc_auth.authenticate(a, '123456', '127.0.0.1')
+    # same front-end address (the Django server / ngrok): everyone else still logs in
+    assert rpc_auth.authenticate(b, '123456', '127.0.0.1')['email'] == b
+    assert rpc_auth.authenticate(b, 'typo', '127.0.0.1') is None
+    assert rpc_auth.authenticate(b, '123456', '127.0.0.1')
+    rpc_auth.failures.clear()
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+import rpc_wire
+from app import app, rpc_dispatcher
+
+
+def broken(a, b=1):
+    return None + a  # a TypeError inside the handler, not in its arguments
+
+
+@pytest.fixture
+def rpc(monkeypatch):
+    monkeypatch.setitem(rpc_dispatcher.funcs, 'broken', broken)
+
+    def call(params):
+        resp = app.test_client().post('/rpc', data=json.dumps({'jsonrpc': '2.0', 'method': 'broken', 'params': params, 'id': 1}),
+                                      headers={'Content-Type': 'application/json'})
+        return resp.get_json()['error']['code']
+    return call
+
+
+@pytest.mark.parametrize('params', [[], [1, 2, 3], {'c': 1}, {'b': 2}])
+def test_arguments_that_dont_fit_are_invalid_params(rpc, params):
+    assert rpc(params) == rpc_wire.INVALID_PARAMS
+
+
+@pytest.mark.parametrize('params', [[1], [1, 2], {'a': 1}])
+def test_type_error_inside_the_handler_is_internal(rpc, params):
+    assert rpc(params) == rpc_wire.INTERNAL_ERROR
@@ -0,0 +1,26 @@
+import datetime
+
+from db_manager import SchoolDB
+
+
+def test_pregenerated_seances_do_not_count_as_held(school, sql):
+    fid = sql("SELECT FormateurID FROM Affectation ORDER BY AffectationID LIMIT 1")[0][0]
+    with SchoolDB() as db:
+        before = db.get_global_kpis(), db.get_global_kpis(fid)
+        today = datetime.date.today()
+        out = db.pregenerate_seances(today + datetime.timedelta(days=1), today + datetime.timedelta(days=60))
+        assert out['created'] > 0
+        assert (db.get_global_kpis(), db.get_global_kpis(fid)) == before
+
+
+def test_pregenerate_skips_existing_and_resolve_finds_them(school, sql):
+    day = datetime.date.today() + datetime.timedelta(days=7)
+    fid, gid, mid = sql("SELECT FormateurID, GroupeID, ModuleID FROM Affectation ORDER BY AffectationID LIMIT 1")[0]
+    with SchoolDB() as db:
+        first = db.pregenerate_seances(day, day, weekdays=range(7))
+        again = db.pregenerate_seances(day, day, weekdays=range(7))
+        sid = db.get_or_create_seance(fid, gid, mid, day.isoformat())
+    assert first['created'] == sql("SELECT COUNT(*) FROM Affectation")[0][0]
+    assert again['created'] == 0
+    assert sql("SELECT FormateurID, GroupeID, ModuleID, date(DateDebut) FROM Seance WHERE SeanceID = ?", (sid,)) == \
+        [(fid, gid, mid, day.isoformat())]
@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import tempfile
+import threading
+import contextlib
+import logging
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows dev box: one process, a thread lock is enough
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'rpc_uploads'))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))
+UPLOAD_TTL = int(os.getenv('UPLOAD_TTL', '3600'))
+READ_BLOCK = 256 * 1024
+_UPLOAD_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class UploadError(Exception):
+    pass
+
+
+def as_bytes(data):
+    """ Accepts xmlrpc Binary, raw bytes or a base64 string """
+    if hasattr(data, 'data'):
+        return data.data
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    return base64.b64decode(data)
+
+
+class UploadSession:
+    """ An upload as stored in UPLOAD_DIR: <id>.json (kind, meta, size) beside the <id>.part
+        being filled. Any worker process can pick it up; received is the .part's size """
+
+    def __init__(self, upload_id, kind, meta, total_size):
+        self.id = upload_id
+        self.kind = kind
+        self.meta = meta
+        self.total_size = total_size
+        self.path = os.path.join(UPLOAD_DIR, upload_id + '.part')
+        self.info_path = os.path.join(UPLOAD_DIR, upload_id + '.json')
+
+    @property
+    def received(self):
+        return os.path.getsize(self.path)
+
+    def status(self):
+        return {"upload_id": self.id, "received": self.received, "total_size": self.total_size}
+
+    def iter_file(self, block=READ_BLOCK):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(block)
+                if not chunk: break
+                yield chunk
+
+
+class UploadManager:
+    """ Resumable uploads spooled to disk: begin -> put_chunk* -> commit(sha256).
+        The state lives in UPLOAD_DIR only, so the chunks of one upload may reach different workers """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # stands in for flock where fcntl is missing
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    def begin(self, kind, meta, total_size):
+        if kind not in ('tp', 'submission'):
+            raise UploadError(f"unknown upload kind: {kind}")
+        if total_size < 0 or total_size > UPLOAD_MAX_BYTES:
+            raise UploadError(f"file too large (max {UPLOAD_MAX_BYTES} bytes)")
+        self.expire()
+        up = UploadSession(uuid.uuid4().hex, kind, meta, total_size)
+        open(up.path, 'wb').close()
+        tmp = up.info_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'kind': kind, 'meta': meta, 'total_size': total_size}, f)
+        os.replace(tmp, up.info_path)  # the upload exists once its .json does
+        return up.status()
+
+    @contextlib.contextmanager
+    def _locked(self, upload_id):
+        """ The session, held exclusively (threads and processes) until the block ends """
+        up = self.get(upload_id)
+        try:
+            f = open(up.path, 'r+b')
+        except FileNotFoundError:
+            raise UploadError(f"unknown or expired upload: {upload_id}")
+        with f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                self._lock.acquire()
+            try:
+                if not os.path.exists(up.info_path):  # committed or aborted while we waited
+                    raise UploadError(f"unknown or expired upload: {upload_id}")
+                yield up, f
+            finally:
+                if not fcntl: self._lock.release()
+
+    def put_chunk(self, upload_id, offset, data):
+        """ Writes data at offset; re-sending an already received range is allowed """
+        with self._locked(upload_id) as (up, f):
+            received = os.fstat(f.fileno()).st_size
+            if offset < 0:
+                raise UploadError(f"negative offset: {offset}")
+            if offset > received:
+                raise UploadError(f"gap in upload: expected offset {received}, got {offset}")
+            if offset + len(data) > up.total_size:
+                raise UploadError("chunk goes past the declared size")
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            return up.status()
+
+    def commit(self, upload_id, sha256_hex, store):
+        """ Verifies size + checksum, then hands the spooled file to store(session) """
+        with self._locked(upload_id) as (up, f):
+            if up.received != up.total_size:
+                raise UploadError(f"incomplete upload: {up.received}/{up.total_size} bytes")
+            digest = hashlib.sha256()
+            for chunk in up.iter_file():
+                digest.update(chunk)
+            if digest.hexdigest() != sha256_hex.lower():
+                raise UploadError("checksum mismatch")
+            result = store(up)
+            if result:
+                self._remove(up)
+        return result
+
+    def get(self, upload_id):
+        upload_id = str(upload_id)
+        try:
+            if not _UPLOAD_ID.fullmatch(upload_id):
+                raise FileNotFoundError(upload_id)
+            with open(os.path.join(UPLOAD_DIR, upload_id + '.json')) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError(f"unknown or expired upload: {upload_id}")
+        return UploadSession(upload_id, info['kind'], info['meta'], info['total_size'])
+
+    def abort(self, upload_id):
+        try:
+            up = self.get(upload_id)
+        except UploadError:
+            return False
+        return self._remove(up)
+
+    def _remove(self, up):
+        found = False
+        for path in (up.info_path, up.path):
+            try:
+                os.remove(path)
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    def expire(self):
+        """ Drops sessions not touched for UPLOAD_TTL seconds """
+        limit = time.time() - UPLOAD_TTL
+        for name in os.listdir(UPLOAD_DIR):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json' or not _UPLOAD_ID.fullmatch(upload_id):
+                continue
+            part = os.path.join(UPLOAD_DIR, upload_id + '.part')
+            try:
+                touched = os.path.getmtime(part if os.path.exists(part) else os.path.join(UPLOAD_DIR, name))
+            except FileNotFoundError:
+                continue  # committed meanwhile
+            if touched < limit:
+                logger.info(f"Expiring upload {upload_id}")
+                self.abort(upload_id)
+
+
+uploads = UploadManager()
+
+
+def parse_range(header, size):
+    """ 'bytes=a-b' -> (start, end_exclusive), or None when absent/unsatisfiable """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if first == '':
+            n = int(last)
+            start, end = max(size - n, 0), size
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    end = min(end, size)
+    if start >= end:
+        return None
+    return start, end
+
+
+_UNSAFE_NAME = re.compile(r'[\x00-\x1f\x7f"\\/]')
+
+
+def download_name(name, default):
+    """ An uploaded file name fit for a Content-Disposition header: control characters
+        (CR/LF), quotes, backslashes and slashes become '_'. default if there is none """
+    name = _UNSAFE_NAME.sub('_', str(name or '')).strip()
+    return name or default
+
+
+def content_disposition(name):
+    """ attachment header value: ASCII fallback plus the UTF-8 name (RFC 6266 filename*) """
+    name = download_name(name, 'download')
+    fallback = name.encode('ascii', 'replace').decode().replace('?', '_')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"